@@ -1,170 +1,514 @@
-from flask import Flask, render_template, request, redirect, session, jsonify, url_for, flash
+from flask import (Flask, render_template, request, redirect, session, jsonify, url_for, flash, Response,
+                   send_from_directory)
+import click
 import mysql.connector
 import os
 import time
-from threading import Thread
-from werkzeug.utils import secure_filename
+import base64
+import json
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, date
 from decimal import Decimal
+from db import (get_db_connection, replica_reads, pool as db_pool, router as db_router, export_pool as db_export_pool,
+                init_app as init_db, PoolTimeout)
+from cache import (page_cache, product_cache, cart_count_cache, product_tag, cart_tag, invalidate,
+                   set_cart_count, cache_stats, CATALOG_HEAD_TAG, init_app as init_cache)
+from config import (CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE, CATALOG_DESCRIPTION_CHARS, SEARCH_MAX_PAGES,
+                    SELLER_ORDERS_PAGE_SIZE, ORDERS_PAGE_SIZE,
+                    PAYMENT_WORKERS, PAYMENT_VERIFY_DELAY, PAYMENT_EVENTS_TIMEOUT, PAYMENT_EVENTS_KEEPALIVE,
+                    METRICS_TOKEN, IMAGE_FOLDER, IMAGE_WORKERS, IMAGE_CACHE_MAX_AGE, IMPORT_BATCH_SIZE,
+                    RECOMMENDATIONS_TOP_N, RECOMMENDATIONS_MIN_ORDERS, RECOMMENDATIONS_WINDOW_DAYS,
+                    RECOMMENDATIONS_SHOWN)
+from payment_events import notifier as payment_notifier
+from ids import new_id, new_payment_id
+from payment_store import create_store
+from migrations import upgrade as upgrade_schema, schema_status, init_app as init_migrations
+from images import (add_product_images, load_images, run_image_workers, import_legacy_images,
+                    collect_garbage as collect_image_garbage, ORIGINALS as IMAGE_ORIGINALS,
+                    VARIANTS as IMAGE_VARIANTS_FOLDER)
+from product_import import import_products, detect_format, FORMATS as IMPORT_FORMATS
+from order_export import stream_export, export_filename, release_connection, FORMATS as EXPORT_FORMATS
+from recommendations import recommend, build_recommendations
+from inventory import reserve_stock, settle_stock, release_reservation, OutOfStock
+from payment_worker import (enqueue_payment, find_payment, load_payment_job, queue_stats, run_workers,
+                            PaymentRejected)
+import metrics
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
+metrics.init_app(app)   # first, so its timer also covers the other before_request hooks
+init_db(app)
+init_migrations(app)
+init_cache(app)
 
 # Payment tracking
-payment_status_cache = {}
+payment_store = create_store()
 
-# Upload folder setup
-UPLOAD_FOLDER = 'static/images'
+# Upload folder setup; images.py spools uploads to incoming/ and keeps originals/ and variants/
+UPLOAD_FOLDER = IMAGE_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="root",
-        database="technest"
-    )
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Create tables if they don't exist
-def create_tables():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(50) NOT NULL UNIQUE,
-            password VARCHAR(255) NOT NULL,
-            email VARCHAR(100) NOT NULL UNIQUE,
-            user_type ENUM('buyer', 'seller') NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create products table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            description TEXT,
-            price DECIMAL(10,2) NOT NULL,
-            image VARCHAR(255),
-            seller_id INT NOT NULL,
-            category VARCHAR(50),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (seller_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    
-    # Create cart table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cart (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            product_id INT NOT NULL,
-            quantity INT NOT NULL DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
-            UNIQUE KEY unique_cart_item (user_id, product_id)
-        )
-    """)
-    
-    # Create orders table - UPDATED
+# ------------------- HELPER FUNCTIONS ------------------- #
+
+def update_sales_rollups(cursor, order_id):
+    """Add one paid order to the daily rollups in the caller's transaction"""
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            product_id INT NOT NULL,
-            quantity INT NOT NULL,
-            price DECIMAL(10,2) NOT NULL,
-            address_id INT,
-            payment_status ENUM('pending', 'paid', 'failed') DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
-            FOREIGN KEY (address_id) REFERENCES addresses(id) ON DELETE SET NULL
-        )
-    """)
-    
-    # Create addresses table
+        INSERT INTO product_daily_sales (product_id, day, seller_id, units, revenue)
+        SELECT i.product_id, DATE(h.created_at), i.seller_id, SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        WHERE i.order_id = %s
+        GROUP BY i.product_id, DATE(h.created_at), i.seller_id
+        ON DUPLICATE KEY UPDATE units = units + VALUES(units), revenue = revenue + VALUES(revenue)
+    """, (order_id,))
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS addresses (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            full_name VARCHAR(100) NOT NULL,
-            phone VARCHAR(15) NOT NULL,
-            address TEXT NOT NULL,
-            city VARCHAR(50) NOT NULL,
-            state VARCHAR(50) NOT NULL,
-            pincode VARCHAR(10) NOT NULL,
-            is_default BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    
-    conn.commit()
+        INSERT INTO seller_daily_sales (seller_id, day, orders, units, revenue)
+        SELECT i.seller_id, DATE(h.created_at), 1, SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        WHERE i.order_id = %s
+        GROUP BY i.seller_id, DATE(h.created_at)
+        ON DUPLICATE KEY UPDATE orders = orders + 1, units = units + VALUES(units),
+                                revenue = revenue + VALUES(revenue)
+    """, (order_id,))
+
+def verify_payment_and_create_order(payment_data):
+    """Simulate payment verification and create order; runs in the payment worker process"""
+    time.sleep(PAYMENT_VERIFY_DELAY)
+
+    # In a real app, you would verify with payment gateway here
+    create_order(payment_data)
+
+def get_payment(payment_id):
+    """Payment state, refreshed from payment_jobs while it is still pending"""
+    payment_data = payment_store.get(payment_id)
+    if payment_data and payment_data['status'] != 'pending':
+        return payment_data
+
+    job = load_payment_job(payment_id)
+    if not job:
+        return payment_data
+    return store_payment_job(job)
+
+def store_payment_job(job):
+    """Payment state as the pages see it, built from a payment_jobs row and kept in the payment store"""
+    payment_data = {
+        'user_id': job['user_id'],
+        'status': job['status'] if job['status'] in ('paid', 'failed') else 'pending',
+        'timestamp': float(job['timestamp']),
+        'address_id': job['address_id'],
+        'total': float(job['total'])
+    }
+    payment_store.set(job['payment_id'], payment_data)
+    return payment_data
+
+def encode_cursor(row):
+    """Opaque keyset cursor on (created_at, id) for the last row of a page"""
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor_str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor_str + '=' * (-len(cursor_str) % 4)).decode()
+        created_at, product_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(product_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def catalog_page_query(after, page_size):
+    """SQL for one catalog page after a decoded cursor; one extra row tells whether another page exists"""
+    query = """
+        SELECT id, name, LEFT(description, %s) AS description, price, image, category, created_at
+        FROM products
+    """
+    params = [CATALOG_DESCRIPTION_CHARS]
+    if after:
+        query += " WHERE created_at < %s OR (created_at = %s AND id < %s)"
+        params += [after[0], after[0], after[1]]
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(page_size + 1)
+    return query, params
+
+def cache_catalog_page(cache_key, after, page_size, products):
+    """Trim the extra row, build the next cursor and cache the page under its product tags"""
+    next_cursor = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        next_cursor = encode_cursor(products[-1])
+
+    tags = [product_tag(product['id']) for product in products]
+    if after is None:
+        tags.append(CATALOG_HEAD_TAG)
+    page_cache.set(cache_key, (products, next_cursor), tags)
+    return products, next_cursor
+
+def get_catalog_page(cursor_str=None, page_size=CATALOG_PAGE_SIZE):
+    """Fetch one page of the catalog, newest first, keyset-paginated on (created_at, id)"""
+    page_size = max(1, min(page_size, CATALOG_MAX_PAGE_SIZE))
+    after = decode_cursor(cursor_str) if cursor_str else None
+
+    cache_key = (after, page_size)
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    query, params = catalog_page_query(after, page_size)
+    conn = get_db_connection(primary=True)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, params)
+    products = load_images(cursor, cursor.fetchall())
     conn.close()
+    return cache_catalog_page(cache_key, after, page_size, products)
 
-create_tables()
+def catalog_json(products):
+    return [dict(product, price=float(product['price']), created_at=product['created_at'].isoformat())
+            for product in products]
 
-# ------------------- HELPER FUNCTIONS ------------------- #
+def get_product(product_id):
+    """Product row by id, served from the product cache when possible"""
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return None
 
-def verify_payment_and_create_order(payment_id):
-    """Simulate payment verification and create order"""
-    time.sleep(5)  # Reduced from 30 to 5 seconds for testing
-    
-    payment_data = payment_status_cache.get(payment_id)
-    if not payment_data:
-        return
+    product = product_cache.get(product_id)
+    if product is None:
+        conn = get_db_connection(primary=True)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
+        product = cursor.fetchone()
+        if product:
+            load_images(cursor, [product])
+        conn.close()
+        if product:
+            product_cache.set(product_id, product, [product_tag(product_id)])
+    # Callers get their own copy so they can't corrupt the cached row
+    return dict(product) if product else None
+
+def recommended_products(product_ids, limit=RECOMMENDATIONS_SHOWN):
+    """Products frequently bought with product_ids; sold-out and deleted ones are skipped"""
+    candidates = recommend(product_ids, limit * 2)
+    if not candidates:
+        return []
+    # Checkouts change stock without touching the product cache, so read it live
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, stock FROM products WHERE id IN ({', '.join(['%s'] * len(candidates))})",
+                   candidates)
+    stock = dict(cursor.fetchall())
+    conn.close()
 
-    # In a real app, you would verify with payment gateway here
-    payment_data['status'] = 'paid'
-    create_order(payment_id)
+    products = []
+    for product_id in candidates:
+        if stock.get(product_id, 0) == 0:
+            continue    # deleted (no row) or sold out; NULL stock isn't tracked and never sells out
+        product = get_product(product_id)
+        if product:
+            products.append(dict(product, stock=stock[product_id]))
+            if len(products) == limit:
+                break
+    return products
+
+def search_query(q, category=None, min_price=None, max_price=None, page=1, page_size=CATALOG_PAGE_SIZE):
+    """SQL for one page of full-text search results, best matches first; returns (query, params, page, page_size)"""
+    page_size = max(1, min(page_size, CATALOG_MAX_PAGE_SIZE))
+    page = max(1, min(page, SEARCH_MAX_PAGES))
+
+    query = """
+        SELECT id, name, LEFT(description, %s) AS description, price, image, category,
+               MATCH(name, description) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+        FROM products
+        WHERE MATCH(name, description) AGAINST (%s IN NATURAL LANGUAGE MODE)
+    """
+    params = [CATALOG_DESCRIPTION_CHARS, q, q]
+    if category:
+        query += " AND category = %s"
+        params.append(category)
+    if min_price is not None:
+        query += " AND price >= %s"
+        params.append(min_price)
+    if max_price is not None:
+        query += " AND price <= %s"
+        params.append(max_price)
+    query += " ORDER BY score DESC, id DESC LIMIT %s OFFSET %s"
+    params += [page_size + 1, (page - 1) * page_size]
+    return query, params, page, page_size
+
+def search_products(q, **filters):
+    """Full-text search over name and description; returns (products, has_more)"""
+    query, params, page, page_size = search_query(q, **filters)
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, params)
+    products = load_images(cursor, cursor.fetchall())
+    conn.close()
+    return search_page(products, page, page_size)
 
-def create_order(payment_id):
-    """Create order after successful payment"""
-    payment_data = payment_status_cache.get(payment_id)
-    if not payment_data:
-        return
+def search_page(products, page, page_size):
+    """Trim the extra row; returns (products, has_more)"""
+    has_more = len(products) > page_size and page < SEARCH_MAX_PAGES
+    return products[:page_size], has_more
+
+def search_json(products, page, has_more):
+    products = [dict(product, price=float(product['price']), score=float(product['score'])) for product in products]
+    return {'success': True, 'products': products, 'page': page, 'next_page': page + 1 if has_more else None}
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def export_response(kind, owner_id, args):
+    """Stream an order export as an attachment; ?format=csv|jsonl&from=YYYY-MM-DD&to=YYYY-MM-DD"""
+    fmt = args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return Response(f"Unsupported format {fmt!r}\n", status=400, mimetype='text/plain')
+    date_from = parse_date(args.get('from'))
+    date_to = parse_date(args.get('to'))
+    filename = export_filename(kind, fmt, date_from, date_to)
+    try:
+        chunks, conn = stream_export(kind, owner_id, fmt, date_from, date_to)
+    except PoolTimeout:
+        return Response("Too many exports running; try again shortly\n", status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
+    response = Response(chunks, mimetype=EXPORT_FORMATS[fmt],
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                                 'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: release_connection(conn))
+    return response
+
+def search_args(args):
+    return dict(
+        q=args.get('q', '').strip(),
+        category=args.get('category') or None,
+        min_price=args.get('min_price', type=float),
+        max_price=args.get('max_price', type=float),
+        page=args.get('page', 1, type=int),
+        page_size=args.get('page_size', CATALOG_PAGE_SIZE, type=int),
+    )
+
+def update_cart_summary(cursor, user_id, product_id, quantity_delta):
+    """Apply a cart change to cart_summary in the caller's transaction; returns the new item count"""
+    cursor.execute("""
+        INSERT INTO cart_summary (user_id, item_count, total_price)
+        SELECT %s, %s, price * %s FROM products WHERE id = %s
+        ON DUPLICATE KEY UPDATE item_count = item_count + VALUES(item_count),
+                                total_price = total_price + VALUES(total_price)
+    """, (user_id, quantity_delta, quantity_delta, product_id))
+    cursor.execute("SELECT item_count FROM cart_summary WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    return row['item_count'] if row else 0
+
+def get_cached_cart_count(user_id):
+    """Cart badge count: cache first, then a primary-key read of cart_summary"""
+    count = cart_count_cache.get(user_id)
+    if count is None:
+        conn = get_db_connection(primary=True)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT item_count FROM cart_summary WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        count = row['item_count'] if row else 0
+        cart_count_cache.set(user_id, count, [cart_tag(user_id)])
+    return count
+
+def reconcile_cart_summaries(repair=True):
+    """Compare cart_summary with the cart table and optionally rewrite drifted rows"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT u.user_id,
+               COALESCE(s.item_count, 0) AS item_count, COALESCE(s.total_price, 0) AS total_price,
+               COALESCE(a.item_count, 0) AS actual_count, COALESCE(a.total_price, 0) AS actual_total
+        FROM (SELECT user_id FROM cart UNION SELECT user_id FROM cart_summary) u
+        LEFT JOIN cart_summary s ON s.user_id = u.user_id
+        LEFT JOIN (
+            SELECT c.user_id, SUM(c.quantity) AS item_count, SUM(c.quantity * p.price) AS total_price
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            GROUP BY c.user_id
+        ) a ON a.user_id = u.user_id
+        WHERE COALESCE(s.item_count, 0) <> COALESCE(a.item_count, 0)
+           OR COALESCE(s.total_price, 0) <> COALESCE(a.total_price, 0)
+    """)
+    drifted = cursor.fetchall()
+
+    if repair:
+        for row in drifted:
+            # Lock the summary row first, then recompute: a concurrent cart
+            # mutation waits on the lock and applies its delta on top
+            cursor.execute("SELECT user_id FROM cart_summary WHERE user_id = %s FOR UPDATE", (row['user_id'],))
+            cursor.fetchall()
+            cursor.execute("""
+                INSERT INTO cart_summary (user_id, item_count, total_price)
+                SELECT %s, COALESCE(SUM(c.quantity), 0), COALESCE(SUM(c.quantity * p.price), 0)
+                FROM cart c
+                JOIN products p ON c.product_id = p.id
+                WHERE c.user_id = %s
+                ON DUPLICATE KEY UPDATE item_count = VALUES(item_count), total_price = VALUES(total_price)
+            """, (row['user_id'], row['user_id']))
+            conn.commit()
+            invalidate(cart_tag(row['user_id']))
+
+    conn.close()
+    return drifted
+
+@app.cli.command('reconcile-carts')
+@click.option('--dry-run', is_flag=True, help='Only report drifted cart summaries')
+def reconcile_carts_command(dry_run):
+    """Detect and repair drift between cart and cart_summary"""
+    drifted = reconcile_cart_summaries(repair=not dry_run)
+    for row in drifted:
+        click.echo(f"user {row['user_id']}: summary {row['item_count']} / {row['total_price']}, "
+                   f"actual {row['actual_count']} / {row['actual_total']}")
+    click.echo(f"{len(drifted)} drifted cart summaries{'' if dry_run else ' repaired'}")
+
+@app.cli.command('db-upgrade')
+@click.option('--target', type=int, default=None, help='Stop at this schema version')
+def db_upgrade_command(target):
+    """Apply pending schema migrations"""
+    version = upgrade_schema(target, echo=click.echo)
+    click.echo(f"Schema at version {version}")
+
+@app.cli.command('db-version')
+def db_version_command():
+    """Show the recorded schema version and the latest one"""
+    version, latest = schema_status()
+    click.echo(f"Schema at version {version}, latest {latest}")
+
+@app.cli.command('payment-worker')
+@click.option('--workers', default=PAYMENT_WORKERS, show_default=True, help='Worker threads')
+def payment_worker_command(workers):
+    """Run the payment verification worker pool in this process"""
+    run_workers(verify_payment_and_create_order, workers)
+
+@app.cli.command('payment-queue')
+def payment_queue_command():
+    """Print payment queue depth"""
+    for name, value in queue_stats().items():
+        click.echo(f"{name}: {value}")
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--seller', required=True, help='Seller username or id')
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='Default: from the file extension')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per insert and commit')
+def import_products_command(path, seller, fmt, batch_size):
+    """Bulk-load products for a seller from a CSV or JSONL file"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT id FROM users WHERE (username = %s OR id = %s) AND user_type = 'seller'",
+                   (seller, int(seller) if seller.isdigit() else None))
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        raise click.ClickException(f"No seller {seller!r}")
+
+    def progress(report):
+        click.echo(f"{report.rows} rows read, {report.imported} imported, {len(report.errors)} invalid")
 
+    with open(path, 'rb') as f:
+        report = import_products(conn, f, fmt or detect_format(path), row['id'], batch_size, progress=progress)
+    conn.close()
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {report['imported']} of {report['rows']} rows in {report['batches']} batches, "
+               f"{report['elapsed_s']}s ({report['rows_per_s']} rows/s)")
+    if 'aborted' in report:
+        raise click.ClickException(f"Import stopped: {report['aborted']}")
+
+@app.cli.command('image-worker')
+@click.option('--workers', default=IMAGE_WORKERS, show_default=True, help='Worker threads')
+def image_worker_command(workers):
+    """Ingest spooled product image uploads and render their thumbnail and WebP variants"""
+    run_image_workers(workers)
+
+@app.cli.command('images-import-legacy')
+def images_import_legacy_command():
+    """Move images listed in products.image into the image pipeline"""
+    products, images = import_legacy_images()
+    click.echo(f"Imported {images} images for {products} products")
+
+@app.cli.command('images-gc')
+@click.option('--min-age', default=3600, show_default=True, help='Seconds an unused image is kept')
+def images_gc_command(min_age):
+    """Delete images no product uses any more"""
+    click.echo(f"Deleted {collect_image_garbage(min_age)} unused images")
+
+@app.cli.command('build-recommendations')
+@click.option('--top-n', default=RECOMMENDATIONS_TOP_N, show_default=True, help='Neighbours kept per product')
+@click.option('--min-orders', default=RECOMMENDATIONS_MIN_ORDERS, show_default=True,
+              help='Orders a pair must share')
+@click.option('--window-days', default=RECOMMENDATIONS_WINDOW_DAYS, show_default=True,
+              help='Days of order history to read')
+def build_recommendations_command(top_n, min_orders, window_days):
+    """Rebuild "frequently bought together" from order history"""
+    for name, value in build_recommendations(top_n, min_orders, window_days).items():
+        click.echo(f"{name}: {value}")
+
+def create_order(payment_data):
+    """Create order after successful payment"""
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
     try:
         # Get cart items
         cursor.execute("""
-            SELECT c.product_id, c.quantity, CAST(p.price AS DECIMAL(10,2)) as price, p.name, p.image
+            SELECT c.product_id, c.quantity, CAST(p.price AS DECIMAL(10,2)) as price, p.name, p.image, p.seller_id,
+                   p.stock
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id = %s
         """, (payment_data['user_id'],))
         items = cursor.fetchall()
+        if not items:
+            # A retried job whose order already committed (the worker died before finishing it) is done
+            cursor.execute("SELECT 1 FROM order_headers WHERE payment_id = %s", (payment_data.get('payment_id'),))
+            if cursor.fetchone():
+                return
+            # Emptied after checkout: nothing to order, so don't leave the payment's stock on hold
+            release_reservation(cursor, payment_data.get('payment_id'))
+            conn.commit()
+            raise PaymentRejected("Cart is empty")
 
-        # Create orders for each item
-        for item in items:
-            cursor.execute("""
-                INSERT INTO orders (user_id, product_id, quantity, price, address_id, payment_status)
-                VALUES (%s, %s, %s, %s, %s, 'paid')
-            """, (payment_data['user_id'], item['product_id'], item['quantity'], 
-                 item['price'], payment_data['address_id']))
+        # One header for the checkout, then all its items in one multi-row insert
+        total = sum(item['price'] * item['quantity'] for item in items)
+        cursor.execute("""
+            INSERT INTO order_headers (user_id, address_id, payment_id, total, item_count, payment_status)
+            VALUES (%s, %s, %s, %s, %s, 'paid')
+        """, (payment_data['user_id'], payment_data['address_id'], payment_data.get('payment_id'),
+              total, sum(item['quantity'] for item in items)))
+        order_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, price)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(order_id, item['product_id'], item['seller_id'], item['quantity'], item['price'])
+              for item in items])
+        update_sales_rollups(cursor, order_id)
 
         # Clear cart
         cursor.execute("DELETE FROM cart WHERE user_id = %s", (payment_data['user_id'],))
+        cursor.execute("""
+            UPDATE cart_summary SET item_count = 0, total_price = 0 WHERE user_id = %s
+        """, (payment_data['user_id'],))
+        # Last before the commit: hot product rows stay locked as briefly as possible
+        settle_stock(cursor, payment_data.get('payment_id'), items)
         conn.commit()
-        session['cart_count'] = 0
+        # Runs outside the request, so refresh the badge through the cache rather than the session
+        set_cart_count(payment_data['user_id'], 0)
         
+    except PaymentRejected:
+        raise
     except Exception as e:
         conn.rollback()
         print(f"Error creating order: {str(e)}")
+        raise
     finally:
         conn.close()
 
@@ -234,16 +578,63 @@ def logout():
 # ------------------- BUYER ROUTES ------------------- #
 
 @app.route('/buyer')
+@replica_reads
 def buyer_home():
     if 'user_type' not in session or session['user_type'] != 'buyer':
         return redirect(url_for('login'))
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
-    conn.close()
-    return render_template('buyer_home.html', products=products)
+    products, next_cursor = get_catalog_page(request.args.get('cursor'),
+                                             request.args.get('page_size', CATALOG_PAGE_SIZE, type=int))
+    next_url = url_for('buyer_home', cursor=next_cursor) if next_cursor else None
+    return render_template('buyer_home.html', products=products, next_url=next_url)
+
+@app.route('/get_products')
+@replica_reads
+def get_products():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    products, next_cursor = get_catalog_page(request.args.get('cursor'),
+                                             request.args.get('page_size', CATALOG_PAGE_SIZE, type=int))
+    return jsonify({'success': True, 'products': catalog_json(products), 'next_cursor': next_cursor})
+
+@app.route('/get_recommendations')
+@replica_reads
+def get_recommendations():
+    """Frequently bought together, for the product view: ?product_id=... (repeatable)"""
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    products = recommended_products(request.args.getlist('product_id', type=int))
+    return jsonify({'success': True, 'products': catalog_json(products)})
+
+@app.route('/search')
+@replica_reads
+def search():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return redirect(url_for('login'))
+
+    args = search_args(request.args)
+    if not args['q']:
+        return redirect(url_for('buyer_home'))
+
+    products, has_more = search_products(**args)
+    next_url = url_for('search', **{k: v for k, v in dict(args, page=args['page'] + 1).items()
+                                    if v is not None}) if has_more else None
+    return render_template('buyer_home.html', products=products, next_url=next_url, query=args['q'])
+
+@app.route('/get_search_results')
+@replica_reads
+def get_search_results():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    args = search_args(request.args)
+    if not args['q']:
+        return jsonify({'success': False, 'message': 'Search query missing'})
+
+    products, has_more = search_products(**args)
+    return jsonify(search_json(products, args['page'], has_more))
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
@@ -254,41 +645,25 @@ def add_to_cart():
     if not product_id:
         return jsonify({'success': False, 'message': 'Product ID missing'})
 
+    # Check if product exists
+    if not get_product(product_id):
+        return jsonify({'success': False, 'message': 'Product not found'})
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # Check if product exists
-        cursor.execute("SELECT id FROM products WHERE id = %s", (product_id,))
-        if not cursor.fetchone():
-            return jsonify({'success': False, 'message': 'Product not found'})
-        
-        # Check if item already in cart
+        # Insert or increment in one atomic statement via unique_cart_item,
+        # so concurrent clicks can't lose an increment
         cursor.execute("""
-            SELECT id, quantity FROM cart 
-            WHERE user_id = %s AND product_id = %s
+            INSERT INTO cart (user_id, product_id, quantity)
+            VALUES (%s, %s, 1)
+            ON DUPLICATE KEY UPDATE quantity = quantity + 1
         """, (session['user_id'], product_id))
-        existing_item = cursor.fetchone()
-        
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item['quantity'] + 1
-            cursor.execute("""
-                UPDATE cart SET quantity = %s 
-                WHERE id = %s
-            """, (new_quantity, existing_item['id']))
-        else:
-            # Add new item
-            cursor.execute("""
-                INSERT INTO cart (user_id, product_id, quantity)
-                VALUES (%s, %s, 1)
-            """, (session['user_id'], product_id))
         
+        cart_count = update_cart_summary(cursor, session['user_id'], product_id, 1)
         conn.commit()
-        
-        # Get updated cart count
-        cursor.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (session['user_id'],))
-        cart_count = cursor.fetchone()['count'] or 0
+        set_cart_count(session['user_id'], cart_count)
         session['cart_count'] = cart_count
         
         return jsonify({
@@ -325,14 +700,14 @@ def view_cart():
     for item in items:
         total_price += Decimal(str(item['price'])) * Decimal(str(item['quantity']))
     
-    # Get cart count for the badge
-    cursor.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (session['user_id'],))
-    cart_count = cursor.fetchone()['count'] or 0
-    session['cart_count'] = cart_count
+    # Cart count for the badge
+    session['cart_count'] = sum(item['quantity'] for item in items)
     
     conn.close()
+    recommendations = recommended_products([item['product_id'] for item in items])
     
-    return render_template('cart.html', items=items, total_price=float(total_price))
+    return render_template('cart.html', items=items, total_price=float(total_price),
+                           recommendations=recommendations)
 
 @app.route('/update_cart', methods=['POST'])
 def update_cart():
@@ -346,50 +721,45 @@ def update_cart():
     if not item_id or not action:
         return jsonify({'success': False, 'message': 'Missing parameters'})
 
+    # Relative updates so the database does the read-modify-write atomically
+    if action == 'increase':
+        update_sql = "UPDATE cart SET quantity = quantity + 1 WHERE id = %s AND user_id = %s"
+    elif action == 'decrease':
+        update_sql = "UPDATE cart SET quantity = quantity - 1 WHERE id = %s AND user_id = %s AND quantity > 1"
+    else:
+        return jsonify({'success': False, 'message': 'Invalid action'})
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # Get current quantity
+        cursor.execute(update_sql, (item_id, session['user_id']))
+        updated = cursor.rowcount
+        
+        # New quantity and price in one read
         cursor.execute("""
-            SELECT quantity FROM cart 
-            WHERE id = %s AND user_id = %s
+            SELECT c.product_id, c.quantity, CAST(p.price AS DECIMAL(10,2)) as price
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.id = %s AND c.user_id = %s
         """, (item_id, session['user_id']))
         item = cursor.fetchone()
         
         if not item:
+            conn.rollback()
             return jsonify({'success': False, 'message': 'Item not found in cart'})
-        
-        current_quantity = item['quantity']
-        new_quantity = current_quantity
-        
-        # Update quantity based on action
-        if action == 'increase':
-            new_quantity = current_quantity + 1
-        elif action == 'decrease' and current_quantity > 1:
-            new_quantity = current_quantity - 1
-        else:
+        if not updated:
+            # Decrease at quantity 1
+            conn.rollback()
             return jsonify({'success': False, 'message': 'Invalid action'})
         
-        # Update in database
-        cursor.execute("""
-            UPDATE cart SET quantity = %s 
-            WHERE id = %s
-        """, (new_quantity, item_id))
-        
-        # Get product price for total calculation
-        cursor.execute("""
-            SELECT CAST(p.price AS DECIMAL(10,2)) as price FROM cart c
-            JOIN products p ON c.product_id = p.id
-            WHERE c.id = %s
-        """, (item_id,))
-        price = Decimal(str(cursor.fetchone()['price']))
-        
+        cart_count = update_cart_summary(cursor, session['user_id'], item['product_id'],
+                                         1 if action == 'increase' else -1)
         conn.commit()
+        set_cart_count(session['user_id'], cart_count)
         
-        # Get updated cart count
-        cursor.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (session['user_id'],))
-        cart_count = cursor.fetchone()['count'] or 0
+        new_quantity = item['quantity']
+        price = Decimal(str(item['price']))
         session['cart_count'] = cart_count
         
         return jsonify({
@@ -417,20 +787,28 @@ def delete_cart_item():
         return jsonify({'success': False, 'message': 'Item ID missing'})
 
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = conn.cursor(dictionary=True)
     
     try:
         cursor.execute("""
-            DELETE FROM cart 
+            SELECT product_id, quantity FROM cart
             WHERE id = %s AND user_id = %s
+            FOR UPDATE
         """, (item_id, session['user_id']))
+        item = cursor.fetchone()
         
-        cursor.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (session['user_id'],))
-        result = cursor.fetchone()
-        cart_count = result[0] if result[0] else 0
-        session['cart_count'] = cart_count
+        if item:
+            cursor.execute("DELETE FROM cart WHERE id = %s", (item_id,))
+            cart_count = update_cart_summary(cursor, session['user_id'], item['product_id'], -item['quantity'])
+        else:
+            # Read on this transaction's cursor; the cache is filled once it commits
+            cursor.execute("SELECT item_count FROM cart_summary WHERE user_id = %s", (session['user_id'],))
+            row = cursor.fetchone()
+            cart_count = row['item_count'] if row else 0
         
         conn.commit()
+        set_cart_count(session['user_id'], cart_count)
+        session['cart_count'] = cart_count
         return jsonify({
             'success': True,
             'cart_count': cart_count,
@@ -478,7 +856,8 @@ def checkout():
     return render_template('checkout.html', 
                          items=items, 
                          total=float(total),
-                         addresses=addresses)
+                         addresses=addresses,
+                         idempotency_key=new_id())
 
 @app.route('/process_payment', methods=['POST'])
 def process_payment():
@@ -490,33 +869,56 @@ def process_payment():
         flash('Please select a delivery address', 'error')
         return redirect(url_for('checkout'))
 
+    # Sent back by the checkout form (or as a header by API clients) so a
+    # retried or double-clicked submit maps to the payment it already started
+    idempotency_key = (request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or None)
+    if idempotency_key:
+        idempotency_key = idempotency_key[:64]
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # Get cart items to calculate total
+        # Serialize this buyer's checkouts so two submits can't both start a payment
+        cursor.execute("SELECT user_id FROM cart_summary WHERE user_id = %s FOR UPDATE", (session['user_id'],))
+        cursor.fetchall()
+        payment_id = find_payment(cursor, session['user_id'], idempotency_key)
+        if payment_id:
+            conn.commit()
+            return redirect(url_for('payment_page', payment_id=payment_id))
+        
+        # Get cart items to calculate total and reserve stock
         cursor.execute("""
-            SELECT SUM(CAST(p.price AS DECIMAL(10,2)) * c.quantity) as total
+            SELECT c.product_id, c.quantity, CAST(p.price AS DECIMAL(10,2)) as price, p.name, p.stock
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id = %s
         """, (session['user_id'],))
-        total = cursor.fetchone()['total']
-        
-        # Store payment attempt
-        payment_id = f"payment_{int(time.time())}"
-        payment_status_cache[payment_id] = {
+        items = cursor.fetchall()
+        if not items:
+            conn.rollback()
+            flash('Your cart is empty', 'error')
+            return redirect(url_for('view_cart'))
+        total = sum(item['price'] * item['quantity'] for item in items)
+
+        # Store payment attempt and queue it for the payment worker, holding the stock it pays for
+        payment_id = new_payment_id()
+        enqueue_payment(cursor, payment_id, session['user_id'], address_id, total, idempotency_key)
+        reserve_stock(cursor, payment_id, items)
+        conn.commit()
+        payment_store.set(payment_id, {
             'user_id': session['user_id'],
             'status': 'pending',
             'timestamp': time.time(),
             'address_id': address_id,
             'total': float(total)
-        }
-
-        # Start payment verification in background
-        Thread(target=verify_payment_and_create_order, args=(payment_id,)).start()
+        })
         return redirect(url_for('payment_page', payment_id=payment_id))
-        
+
+    except OutOfStock as e:
+        conn.rollback()
+        flash(f'{e}. Please update your cart.', 'error')
+        return redirect(url_for('view_cart'))
     except Exception as e:
         conn.rollback()
         flash(f'Error processing payment: {str(e)}', 'error')
@@ -529,7 +931,7 @@ def payment_page(payment_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    payment_data = payment_status_cache.get(payment_id)
+    payment_data = get_payment(payment_id)
     if not payment_data or payment_data['user_id'] != session['user_id']:
         flash('Invalid payment session', 'error')
         return redirect(url_for('checkout'))
@@ -544,7 +946,7 @@ def check_payment(payment_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'})
     
-    payment_data = payment_status_cache.get(payment_id)
+    payment_data = get_payment(payment_id)
     if not payment_data or payment_data['user_id'] != session['user_id']:
         return jsonify({'success': False, 'message': 'Invalid payment session'})
     
@@ -554,7 +956,40 @@ def check_payment(payment_id):
         'timestamp': payment_data['timestamp']
     })
 
+def payment_event(payment_data):
+    data = json.dumps({'success': True, 'status': payment_data['status'], 'timestamp': payment_data['timestamp']})
+    return f"event: status\ndata: {data}\n\n"
+
+@app.route('/payment_events/<payment_id>')
+def payment_events(payment_id):
+    """Server-sent events stream that pushes the payment status once it is final"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+    
+    payment_data = get_payment(payment_id)
+    if not payment_data or payment_data['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'message': 'Invalid payment session'})
+
+    # The generator runs after the request has ended, so it must not touch the
+    # session or hold the request's pooled connection while it waits
+    def stream(payment_data):
+        deadline = time.monotonic() + PAYMENT_EVENTS_TIMEOUT
+        yield "retry: 2000\n\n"
+        while payment_data['status'] == 'pending':
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if payment_notifier.wait(payment_id, min(PAYMENT_EVENTS_KEEPALIVE, remaining)):
+                payment_data = get_payment(payment_id)
+            else:
+                yield ": keepalive\n\n"
+        yield payment_event(payment_data)
+
+    return Response(stream(payment_data), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/orders')
+@replica_reads
 def orders():
     if 'user_type' not in session or session['user_type'] != 'buyer':
         return redirect(url_for('login'))
@@ -563,44 +998,53 @@ def orders():
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # Get all orders with product details
-        cursor.execute("""
-            SELECT 
-                o.id as order_id,
-                o.created_at,
-                o.payment_status,
-                p.id as product_id,
-                p.name,
-                p.image,
-                o.quantity,
-                o.price,
-                (o.quantity * o.price) as item_total
-            FROM orders o
-            JOIN products p ON o.product_id = p.id
-            WHERE o.user_id = %s
-            ORDER BY o.created_at DESC
-        """, (session['user_id'],))
-        orders = cursor.fetchall()
-
-        # Group items by order ID
-        orders_dict = {}
-        for order in orders:
-            order_id = order['order_id']
-            if order_id not in orders_dict:
-                orders_dict[order_id] = {
-                    'order_id': order_id,
-                    'created_at': order['created_at'],
-                    'payment_status': order['payment_status'],
-                    'items': [],
-                    'total': 0
-                }
-            orders_dict[order_id]['items'].append(order)
-            orders_dict[order_id]['total'] += order['item_total']
-
-        # Convert to list for template
-        orders_list = list(orders_dict.values())
+        # One page of order headers, newest first; headers already carry the totals
+        query = """
+            SELECT id as order_id, created_at, payment_status, total, item_count
+            FROM order_headers
+            WHERE user_id = %s
+        """
+        params = [session['user_id']]
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        if after:
+            query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [after[0], after[0], after[1]]
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(ORDERS_PAGE_SIZE + 1)
+        cursor.execute(query, params)
+        orders_list = cursor.fetchall()
+
+        next_url = None
+        if len(orders_list) > ORDERS_PAGE_SIZE:
+            orders_list = orders_list[:ORDERS_PAGE_SIZE]
+            last = orders_list[-1]
+            next_url = url_for('orders', cursor=encode_cursor({'created_at': last['created_at'],
+                                                                'id': last['order_id']}))
+
+        # Attach the items of the listed orders in one query
+        orders_dict = {order['order_id']: order for order in orders_list}
+        for order in orders_list:
+            order['items'] = []
+        if orders_dict:
+            placeholders = ', '.join(['%s'] * len(orders_dict))
+            cursor.execute(f"""
+                SELECT 
+                    i.order_id,
+                    p.id as product_id,
+                    p.name,
+                    p.image,
+                    i.quantity,
+                    i.price,
+                    (i.quantity * i.price) as item_total
+                FROM order_items i
+                JOIN products p ON i.product_id = p.id
+                WHERE i.order_id IN ({placeholders})
+                ORDER BY i.id
+            """, list(orders_dict))
+            for item in cursor.fetchall():
+                orders_dict[item['order_id']]['items'].append(item)
         
-        return render_template('orders.html', orders=orders_list)
+        return render_template('orders.html', orders=orders_list, next_url=next_url)
         
     except Exception as e:
         print(f"Error fetching orders: {str(e)}")
@@ -608,39 +1052,107 @@ def orders():
     finally:
         conn.close()
 
+@app.route('/orders/export')
+def orders_export():
+    """The buyer's order history, one line per item, oldest first"""
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return redirect(url_for('login'))
+    return export_response('buyer', session['user_id'], request.args)
+
 # ------------------- SELLER ROUTES ------------------- #
 
 @app.route('/seller')
+@replica_reads
 def seller_dashboard():
     if 'user_type' not in session or session['user_type'] != 'seller':
         return redirect(url_for('login'))
 
+    seller_id = session['user_id']
+    date_from = parse_date(request.args.get('from'))
+    date_to = parse_date(request.args.get('to'))
+    before_id = request.args.get('before', type=int)
+
+    # Rollup filter shared by the earnings, daily and per-product queries
+    range_sql = ""
+    range_params = []
+    if date_from:
+        range_sql += " AND day >= %s"
+        range_params.append(date_from)
+    if date_to:
+        range_sql += " AND day <= %s"
+        range_params.append(date_to)
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     cursor.execute("""
         SELECT * FROM products WHERE seller_id=%s
-    """, (session['user_id'],))
+    """, (seller_id,))
     products = cursor.fetchall()
 
-    cursor.execute("""
-        SELECT o.*, p.name, u.username AS buyer, CAST(p.price AS DECIMAL(10,2)) as price
-        FROM orders o
-        JOIN products p ON o.product_id = p.id
-        JOIN users u ON o.user_id = u.id
-        WHERE p.seller_id = %s
-    """, (session['user_id'],))
+    # Earnings and daily series come from the rollups: O(days), not O(orders)
+    cursor.execute(f"""
+        SELECT day, orders, units, revenue
+        FROM seller_daily_sales
+        WHERE seller_id = %s{range_sql}
+        ORDER BY day DESC
+    """, [seller_id] + range_params)
+    daily_sales = cursor.fetchall()
+    total_earnings = sum((day['revenue'] for day in daily_sales), Decimal('0.00'))
+
+    cursor.execute(f"""
+        SELECT product_id, SUM(units) AS units, SUM(revenue) AS revenue
+        FROM product_daily_sales
+        WHERE seller_id = %s{range_sql}
+        GROUP BY product_id
+    """, [seller_id] + range_params)
+    product_sales = {row['product_id']: row for row in cursor.fetchall()}
+    for product in products:
+        sales = product_sales.get(product['id'])
+        product['units_sold'] = sales['units'] if sales else 0
+        product['revenue'] = sales['revenue'] if sales else Decimal('0.00')
+
+    # Recent orders, newest first, one page at a time
+    query = """
+        SELECT i.id, i.order_id, i.product_id, i.quantity, i.price, h.user_id, h.address_id,
+               h.payment_status, h.created_at, p.name, u.username AS buyer
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        JOIN products p ON i.product_id = p.id
+        JOIN users u ON h.user_id = u.id
+        WHERE i.seller_id = %s
+    """
+    params = [seller_id]
+    if before_id:
+        query += " AND i.id < %s"
+        params.append(before_id)
+    query += " ORDER BY i.id DESC LIMIT %s"
+    params.append(SELLER_ORDERS_PAGE_SIZE + 1)
+    cursor.execute(query, params)
     orders = cursor.fetchall()
+    conn.close()
 
-    total_earnings = Decimal('0.00')
-    for order in orders:
-        total_earnings += Decimal(str(order['price'])) * Decimal(str(order['quantity']))
+    next_url = None
+    if len(orders) > SELLER_ORDERS_PAGE_SIZE:
+        orders = orders[:SELLER_ORDERS_PAGE_SIZE]
+        next_url = url_for('seller_dashboard', before=orders[-1]['id'],
+                           **{k: v for k, v in (('from', date_from), ('to', date_to)) if v})
 
-    conn.close()
     return render_template('seller_dashboard.html', 
                          products=products, 
                          orders=orders, 
+                         next_url=next_url,
+                         daily_sales=daily_sales,
+                         date_from=date_from,
+                         date_to=date_to,
                          total_earnings=float(total_earnings))
 
+@app.route('/seller/orders/export')
+def seller_orders_export():
+    """Every order line of the seller's products, oldest first"""
+    if 'user_type' not in session or session['user_type'] != 'seller':
+        return redirect(url_for('login'))
+    return export_response('seller', session['user_id'], request.args)
+
 @app.route('/add_product', methods=['GET', 'POST'])
 def add_product():
     if 'user_type' not in session or session['user_type'] != 'seller':
@@ -651,26 +1163,23 @@ def add_product():
         description = request.form['description']
         price = float(request.form['price'])
         category = request.form['category']
+        stock = request.form.get('stock', type=int)     # blank: not stock-tracked
         files = request.files.getlist('images')
 
         if files:
-            filenames = []
-            for file in files:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file.save(os.path.join(UPLOAD_FOLDER, filename))
-                    filenames.append(filename)
-
-            filenames_str = ','.join(filenames)
+            uploads = [(file.stream, file.filename.rsplit('.', 1)[1]) for file in files
+                       if file and allowed_file(file.filename)]
 
             conn = get_db_connection()
-            cursor = conn.cursor()
+            cursor = conn.cursor(dictionary=True)
             try:
                 cursor.execute("""
-                    INSERT INTO products (name, description, price, image, seller_id, category)
+                    INSERT INTO products (name, description, price, stock, seller_id, category)
                     VALUES (%s, %s, %s, %s, %s, %s)
-                """, (name, description, price, filenames_str, session['user_id'], category))
+                """, (name, description, price, stock, session['user_id'], category))
+                add_product_images(cursor, cursor.lastrowid, uploads)
                 conn.commit()
+                invalidate(CATALOG_HEAD_TAG)
                 flash('Product added successfully!', 'success')
                 return redirect(url_for('seller_dashboard'))
             except Exception as e:
@@ -681,7 +1190,29 @@ def add_product():
 
     return render_template('add_product.html')
 
+@app.route('/import_products', methods=['POST'])
+def import_products_upload():
+    """Bulk import from an uploaded CSV/JSONL file; responds with counts, per-row errors and throughput"""
+    if 'user_type' not in session or session['user_type'] != 'seller':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'No file uploaded'})
+    fmt = request.form.get('format') or detect_format(file.filename)
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'success': False, 'message': f"Unsupported format {fmt!r}"})
+
+    # Werkzeug spools large uploads to a temporary file, so this reads from disk as it goes
+    conn = get_db_connection()
+    try:
+        report = import_products(conn, file.stream, fmt, session['user_id'])
+    finally:
+        conn.close()
+    return jsonify(dict(report, success='aborted' not in report))
+
 @app.route('/edit_product', methods=['GET', 'POST'])
+@replica_reads
 def edit_product():
     if 'user_type' not in session or session['user_type'] != 'seller':
         return redirect(url_for('login'))
@@ -697,26 +1228,39 @@ def edit_product():
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         try:
-            cursor.execute("SELECT image FROM products WHERE id=%s", (product_id,))
-            product = cursor.fetchone()
-            existing_images = product['image'].split(',') if product and product['image'] else []
-
-            new_images = []
-            for file in images:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file.save(os.path.join(UPLOAD_FOLDER, filename))
-                    new_images.append(filename)
-
-            all_images = existing_images + new_images
-            image_str = ','.join(all_images)
+            # Re-price carts holding this product before the price changes
+            # Correlated subqueries rather than UPDATE ... JOIN, which SQLite can't run
+            cursor.execute("""
+                UPDATE cart_summary
+                SET total_price = total_price + (
+                    SELECT SUM(c.quantity * (%s - p.price))
+                    FROM cart c
+                    JOIN products p ON c.product_id = p.id
+                    WHERE c.user_id = cart_summary.user_id AND c.product_id = %s
+                )
+                WHERE user_id IN (
+                    SELECT c.user_id
+                    FROM cart c
+                    JOIN products p ON c.product_id = p.id
+                    WHERE c.product_id = %s AND p.seller_id = %s
+                )
+            """, (price, product_id, product_id, session['user_id']))
 
             cursor.execute("""
                 UPDATE products 
-                SET name=%s, description=%s, price=%s, image=%s, category=%s
+                SET name=%s, description=%s, price=%s, category=%s
                 WHERE id=%s AND seller_id=%s
-            """, (name, description, price, image_str, category, product_id, session['user_id']))
+            """, (name, description, price, category, product_id, session['user_id']))
+            if 'stock' in request.form:
+                # Units free to sell, not counting those held by checkouts in progress; blank stops tracking
+                cursor.execute("UPDATE products SET stock=%s WHERE id=%s AND seller_id=%s",
+                               (request.form.get('stock', type=int), product_id, session['user_id']))
+            cursor.execute("SELECT 1 FROM products WHERE id=%s AND seller_id=%s", (product_id, session['user_id']))
+            if cursor.fetchone():
+                add_product_images(cursor, product_id, [(file.stream, file.filename.rsplit('.', 1)[1])
+                                                        for file in images if file and allowed_file(file.filename)])
             conn.commit()
+            invalidate(product_tag(product_id))
             flash('Product updated successfully!', 'success')
             return redirect(url_for('seller_dashboard'))
         except Exception as e:
@@ -725,18 +1269,11 @@ def edit_product():
         finally:
             conn.close()
     
-    product_id = request.args.get('product_id')
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products WHERE id=%s", (product_id,))
-    product = cursor.fetchone()
-    
-    if product and product['image']:
-        product['images'] = product['image'].split(',')
-    else:
-        product['images'] = []
-    
-    conn.close()
+    product = get_product(request.args.get('product_id'))
+    if not product:
+        flash('Product not found', 'error')
+        return redirect(url_for('seller_dashboard'))
+
     return render_template('edit_product.html', product=product)
 
 @app.route('/delete_product', methods=['POST'])
@@ -764,6 +1301,21 @@ def delete_product():
             flash('You can only delete your own products', 'error')
             return redirect(url_for('seller_dashboard'))
         
+        # Deleting the product cascades to carts; take it out of their summaries first
+        cursor.execute("""
+            SELECT c.user_id, c.quantity, p.price
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.product_id = %s
+        """, (product_id,))
+        affected = cursor.fetchall()
+        for user_id, quantity, price in affected:
+            cursor.execute("""
+                UPDATE cart_summary
+                SET item_count = item_count - %s, total_price = total_price - %s
+                WHERE user_id = %s
+            """, (quantity, price * quantity, user_id))
+        
         cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
         
         if product[1]:
@@ -774,6 +1326,7 @@ def delete_product():
                     pass
         
         conn.commit()
+        invalidate(product_tag(product_id), *(cart_tag(user_id) for user_id, _, _ in affected))
         flash('Product deleted successfully', 'success')
     except Exception as e:
         conn.rollback()
@@ -869,19 +1422,12 @@ def get_cart_count():
     if 'user_id' not in session:
         return jsonify({'cart_count': 0})
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     try:
-        cursor.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (session['user_id'],))
-        result = cursor.fetchone()
-        cart_count = result['count'] if result['count'] else 0
+        cart_count = get_cached_cart_count(session['user_id'])
         session['cart_count'] = cart_count
         return jsonify({'cart_count': cart_count})
     except Exception as e:
         return jsonify({'cart_count': 0, 'error': str(e)})
-    finally:
-        conn.close()
 
 @app.route('/update_session_cart_count', methods=['POST'])
 def update_session_cart_count():
@@ -892,5 +1438,73 @@ def update_session_cart_count():
     session['cart_count'] = data.get('count', 0)
     return jsonify({'success': True})
 
+@app.route('/images/<any(originals, variants):kind>/<filename>')
+def product_image(kind, filename):
+    """Content-addressed image files: a name never changes content, so clients may cache them forever"""
+    response = send_from_directory(IMAGE_ORIGINALS if kind == 'originals' else IMAGE_VARIANTS_FOLDER, filename,
+                                   max_age=IMAGE_CACHE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+# ------------------- METRICS ------------------- #
+
+def collect_runtime_stats():
+    """Pool, cache, payment store, payment queue and SSE gauges for /metrics"""
+    pool_stats = db_pool.stats()
+    export_stats = db_export_pool.stats()
+    caches = cache_stats()
+    store = payment_store.stats()
+    gauges = {
+        'technest_db_pool_size': ('gauge', 'Pooled connections available to this process.', pool_stats['size'], ()),
+        'technest_db_pool_in_use': ('gauge', 'Pooled connections currently borrowed.', pool_stats['in_use'], ()),
+        'technest_db_pool_timeouts_total': ('counter', 'Borrows that gave up after DB_POOL_TIMEOUT.',
+                                            pool_stats['timeouts'], ()),
+        'technest_db_pool_reconnects_total': ('counter', 'Dead connections reconnected on borrow.',
+                                              pool_stats['reconnects'], ()),
+        'technest_db_export_pool_in_use': ('gauge', 'Export downloads currently holding a connection.',
+                                           export_stats['in_use'], ()),
+        'technest_db_export_pool_timeouts_total': ('counter', 'Exports turned away with a 503.',
+                                                   export_stats['timeouts'], ()),
+        'technest_payment_store_size': ('gauge', 'Entries in the payment state store.',
+                                        {(store['backend'],): store['size']}, ('backend',)),
+        'technest_payment_events_watching': ('gauge', 'Open /payment_events streams.',
+                                             payment_notifier.watching(), ()),
+    }
+    replicas = db_router.stats()
+    if replicas:
+        gauges['technest_db_replica_healthy'] = ('gauge', 'Whether a read replica is in rotation.',
+                                                 {(name,): int(r['healthy']) for name, r in replicas.items()},
+                                                 ('replica',))
+        gauges['technest_db_replica_in_use'] = ('gauge', 'Replica connections currently borrowed.',
+                                                {(name,): r['in_use'] for name, r in replicas.items()},
+                                                ('replica',))
+    for stat, kind in (('size', 'gauge'), ('hits', 'counter'), ('misses', 'counter'),
+                       ('evictions', 'counter'), ('expirations', 'counter'), ('invalidations', 'counter')):
+        name = f'technest_cache_{stat}' + ('_total' if kind == 'counter' else '')
+        gauges[name] = (kind, f'In-process cache {stat}.',
+                        {(cache,): values[stat] for cache, values in caches.items()}, ('cache',))
+    try:
+        queue = queue_stats()
+    except mysql.connector.Error:
+        queue = None   # a scrape shouldn't fail because the database is down
+    if queue is not None:
+        gauges['technest_payment_jobs'] = ('gauge', 'Payment jobs waiting or in progress.',
+                                           {('queued',): queue['queued'], ('running',): queue['running']},
+                                           ('status',))
+        gauges['technest_payment_oldest_queued_seconds'] = ('gauge', 'Age of the oldest runnable payment job.',
+                                                            queue['oldest_queued_age'], ())
+    return gauges
+
+
+metrics.collectors.append(collect_runtime_stats)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only; production runs serve.py
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
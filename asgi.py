@@ -0,0 +1,266 @@
+"""ASGI entrypoint: async handlers for the I/O-bound routes, Flask for the rest.
+
+The catalog, search, cart badge and payment status/SSE routes spend their
+time waiting on MySQL or on a payment notification. Served here they await
+an aiomysql pool instead of holding a thread each, so a thousand open
+/payment_events streams cost a thousand coroutines rather than a thousand
+threads, and database connections stay bounded by ASYNC_DB_POOL_SIZE.
+
+Every other path goes to the unchanged Flask app through WsgiToAsgi. Both
+apps share the secret key, the templates, the session cookie format, the
+caches and the SQL builders in app.py, so a browser can move between them
+freely. The synchronous `flask run` / app.py path is still available.
+
+    hypercorn asgi:application --bind 0.0.0.0:8000
+
+Reads go to the primary; @replica_reads routing is WSGI-only for now.
+"""
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, g, jsonify, redirect, render_template, request, session, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import metrics
+from app import (app as flask_app, catalog_page_query, cache_catalog_page, catalog_json, decode_cursor,
+                 payment_event, search_args, search_json, search_page, search_query, store_payment_job,
+                 payment_store)
+from async_db import pool
+from images import attach_images, product_images_query
+from cache import bus, cart_count_cache, cart_tag, page_cache
+from config import (CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE, PAYMENT_EVENTS_TIMEOUT,
+                    PAYMENT_EVENTS_KEEPALIVE)
+from migrations import LATEST_VERSION
+from payment_events import notifier as payment_notifier
+from payment_worker import PAYMENT_JOB_QUERY
+
+app = Quart(__name__, root_path=flask_app.root_path, template_folder=flask_app.template_folder,
+            static_folder=None)
+app.secret_key = flask_app.secret_key
+
+
+@app.before_serving
+async def startup():
+    await pool.open()
+    row = await pool.fetchone("SELECT MAX(version) AS version FROM schema_migrations")
+    version = row['version'] or 0
+    if version < LATEST_VERSION:
+        await pool.close()
+        raise RuntimeError(f"Database schema is at version {version}, this code needs {LATEST_VERSION}; "
+                           f"run `flask db-upgrade`")
+    bus.start()
+
+
+@app.after_serving
+async def shutdown():
+    await pool.close()
+
+
+@app.before_request
+async def start_timer():
+    g._request_start = time.perf_counter()
+
+
+@app.after_request
+async def record_request(response):
+    start = g.pop('_request_start', None)
+    if start is not None:
+        metrics.request_latency.observe((request.endpoint or 'unmatched', request.method,
+                                         str(response.status_code)), time.perf_counter() - start)
+    return response
+
+
+def build_flask_url(error, endpoint, values):
+    """url_for() fallback for endpoints only the Flask app serves (login, cart, ...)"""
+    return flask_app.url_map.bind('').build(endpoint, values)
+
+
+app.url_build_error_handlers.append(build_flask_url)
+
+# ------------------- QUERIES ------------------- #
+
+async def load_images(products):
+    if products:
+        attach_images(products, await pool.fetchall(*product_images_query([product['id'] for product in products])))
+    return products
+
+
+async def get_catalog_page(cursor_str=None, page_size=CATALOG_PAGE_SIZE):
+    """app.get_catalog_page over the async pool; same cache and cursors"""
+    page_size = max(1, min(page_size, CATALOG_MAX_PAGE_SIZE))
+    after = decode_cursor(cursor_str) if cursor_str else None
+
+    cache_key = (after, page_size)
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    query, params = catalog_page_query(after, page_size)
+    products = await load_images(await pool.fetchall(query, params))
+    return cache_catalog_page(cache_key, after, page_size, products)
+
+
+async def search_products(q, **filters):
+    query, params, page, page_size = search_query(q, **filters)
+    products = await load_images(await pool.fetchall(query, params))
+    return search_page(products, page, page_size)
+
+
+async def get_cached_cart_count(user_id):
+    count = cart_count_cache.get(user_id)
+    if count is None:
+        row = await pool.fetchone("SELECT item_count FROM cart_summary WHERE user_id = %s", (user_id,))
+        count = row['item_count'] if row else 0
+        cart_count_cache.set(user_id, count, [cart_tag(user_id)])
+    return count
+
+
+async def get_payment(payment_id):
+    payment_data = payment_store.get(payment_id)
+    if payment_data and payment_data['status'] != 'pending':
+        return payment_data
+
+    job = await pool.fetchone(PAYMENT_JOB_QUERY, (payment_id,))
+    if not job:
+        return payment_data
+    return store_payment_job(job)
+
+# ------------------- BUYER ROUTES ------------------- #
+
+@app.route('/buyer')
+async def buyer_home():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return redirect(url_for('login'))
+
+    products, next_cursor = await get_catalog_page(request.args.get('cursor'),
+                                                   request.args.get('page_size', CATALOG_PAGE_SIZE, type=int))
+    next_url = url_for('buyer_home', cursor=next_cursor) if next_cursor else None
+    return await render_template('buyer_home.html', products=products, next_url=next_url)
+
+
+@app.route('/get_products')
+async def get_products():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    products, next_cursor = await get_catalog_page(request.args.get('cursor'),
+                                                   request.args.get('page_size', CATALOG_PAGE_SIZE, type=int))
+    return jsonify({'success': True, 'products': catalog_json(products), 'next_cursor': next_cursor})
+
+
+@app.route('/get_search_results')
+async def get_search_results():
+    if 'user_type' not in session or session['user_type'] != 'buyer':
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    args = search_args(request.args)
+    if not args['q']:
+        return jsonify({'success': False, 'message': 'Search query missing'})
+
+    products, has_more = await search_products(**args)
+    return jsonify(search_json(products, args['page'], has_more))
+
+# ------------------- PAYMENT ROUTES ------------------- #
+
+@app.route('/check_payment/<payment_id>')
+async def check_payment(payment_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    payment_data = await get_payment(payment_id)
+    if not payment_data or payment_data['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'message': 'Invalid payment session'})
+
+    return jsonify({
+        'success': True,
+        'status': payment_data['status'],
+        'timestamp': payment_data['timestamp']
+    })
+
+
+@app.route('/payment_events/<payment_id>')
+async def payment_events(payment_id):
+    """Server-sent events stream; waits on the notifier without holding a thread or a connection"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    payment_data = await get_payment(payment_id)
+    if not payment_data or payment_data['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'message': 'Invalid payment session'})
+
+    async def stream(payment_data):
+        deadline = time.monotonic() + PAYMENT_EVENTS_TIMEOUT
+        yield b"retry: 2000\n\n"
+        while payment_data['status'] == 'pending':
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if await payment_notifier.wait_async(payment_id, min(PAYMENT_EVENTS_KEEPALIVE, remaining)):
+                payment_data = await get_payment(payment_id)
+            else:
+                yield b": keepalive\n\n"
+        yield payment_event(payment_data).encode()
+
+    response = app.response_class(stream(payment_data), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None     # the stream ends itself after PAYMENT_EVENTS_TIMEOUT
+    return response
+
+# ------------------- UTILITY ROUTES ------------------- #
+
+@app.route('/get_cart_count')
+async def get_cart_count():
+    if 'user_id' not in session:
+        return jsonify({'cart_count': 0})
+
+    try:
+        cart_count = await get_cached_cart_count(session['user_id'])
+        session['cart_count'] = cart_count
+        return jsonify({'cart_count': cart_count})
+    except Exception as e:
+        return jsonify({'cart_count': 0, 'error': str(e)})
+
+# ------------------- METRICS ------------------- #
+
+def collect_async_stats():
+    """Async pool gauges, served by the Flask app's /metrics alongside its own"""
+    stats = pool.stats()
+    return {
+        'technest_async_db_pool_size': ('gauge', 'Connections the async pool may open.', stats['size'], ()),
+        'technest_async_db_pool_open': ('gauge', 'Connections the async pool has open.', stats['open'], ()),
+        'technest_async_db_pool_in_use': ('gauge', 'Async pool connections currently borrowed.',
+                                          stats['in_use'], ()),
+        'technest_async_db_pool_timeouts_total': ('counter', 'Async borrows that gave up after DB_POOL_TIMEOUT.',
+                                                  stats['timeouts'], ()),
+    }
+
+
+metrics.collectors.append(collect_async_stats)
+
+# ------------------- DISPATCH ------------------- #
+
+class Dispatcher:
+    """Send requests for the routes above to the Quart app and everything else to Flask"""
+
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        self.wsgi_app = WsgiToAsgi(wsgi_app)
+        self._routes = async_app.url_map.bind('')
+
+    def is_async(self, scope):
+        try:
+            self._routes.match(scope['path'], method=scope['method'])
+            return True
+        except RequestRedirect:
+            return True
+        except HTTPException:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.is_async(scope):
+            return await self.wsgi_app(scope, receive, send)
+        return await self.async_app(scope, receive, send)
+
+
+application = Dispatcher(app, flask_app)
@@ -0,0 +1,119 @@
+"""Async MySQL connection pool for the ASGI routes in asgi.py.
+
+Same contract as db.py's pool: a bounded set of connections, a borrow that
+gives up after DB_POOL_TIMEOUT with PoolTimeout, statements timed into the
+shared metrics. An awaiting request holds no thread, so ASYNC_DB_POOL_SIZE
+bounds the database connections however many clients are waiting.
+
+MySQL only (aiomysql); the SQLite backend serves through the WSGI app.
+"""
+import asyncio
+import contextlib
+import threading
+import time
+
+import aiomysql
+
+import metrics
+from config import DATABASE_CONFIG, DB_BACKEND, DB_POOL_TIMEOUT, ASYNC_DB_POOL_SIZE
+from db import PoolTimeout
+
+
+class TimedAsyncCursor:
+    """aiomysql DictCursor proxy recording each statement like metrics.TimedCursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._rows = []
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def execute(self, operation, params=None):
+        label = metrics.statement_label(operation)
+        start = time.perf_counter()
+        try:
+            await self._cursor.execute(operation, params)
+            rows = await self._cursor.fetchall() if self._cursor.description else ()
+        finally:
+            metrics.sql_latency.observe((label,), time.perf_counter() - start)
+        metrics.sql_rows.inc((label,), len(rows) or max(self._cursor.rowcount, 0))
+        self._rows = list(rows)
+
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+class AsyncPool:
+
+    def __init__(self, size=ASYNC_DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, **config):
+        self.size = size
+        self.timeout = timeout
+        self._config = config or DATABASE_CONFIG
+        self._pool = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'borrowed': 0, 'timeouts': 0, 'wait_total': 0.0}
+
+    async def open(self):
+        if DB_BACKEND != 'mysql':
+            raise RuntimeError(f"The ASGI app needs the mysql backend, not {DB_BACKEND!r}")
+        config = dict(self._config)
+        config['db'] = config.pop('database')
+        self._pool = await aiomysql.create_pool(minsize=1, maxsize=self.size, autocommit=True,
+                                                pool_recycle=3600, **config)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    @contextlib.asynccontextmanager
+    async def cursor(self):
+        """Borrow a connection for one block; yields a dictionary cursor"""
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(self._pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        wait = time.perf_counter() - start
+        metrics.pool_wait.observe((), wait)
+        with self._stats_lock:
+            self._stats['borrowed'] += 1
+            self._stats['wait_total'] += wait
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                yield TimedAsyncCursor(cursor)
+        finally:
+            self._pool.release(conn)
+
+    async def fetchone(self, query, params=None):
+        async with self.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchone()
+
+    async def fetchall(self, query, params=None):
+        async with self.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['wait_avg'] = stats['wait_total'] / stats['borrowed'] if stats['borrowed'] else 0.0
+        if self._pool is not None:
+            stats['open'] = self._pool.size
+            stats['in_use'] = self._pool.size - self._pool.freesize
+        else:
+            stats['open'] = stats['in_use'] = 0
+        return stats
+
+
+pool = AsyncPool()
@@ -0,0 +1,258 @@
+"""Connections held versus throughput for the WSGI and ASGI servers.
+
+Starts each server in turn against the database in config.py (MySQL; don't
+run `flask payment-worker` meanwhile, the seeded payments must stay
+pending):
+
+    wsgi  flask run --with-threads    one thread per open connection
+    asgi  hypercorn asgi:application  one event loop, async routes from asgi.py
+
+and drives it with --clients concurrent connections from one asyncio
+process. --hold of them open /payment_events streams on pending payments
+and keep them open; the rest loop over /get_search_results for --duration.
+While it runs the server's thread count and borrowed database connections
+(from /metrics) are sampled; the report shows search throughput and
+latency next to the peak threads and connections each server needed.
+
+    python benchmarks/async_bench.py --clients 1000 --hold 900 --duration 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app import app
+from db import get_db_connection
+from ids import new_payment_id
+from payment_worker import enqueue_payment
+
+WORDS = ['laptop', 'phone', 'camera', 'speaker', 'headphones', 'charger', 'monitor', 'keyboard']
+SERVERS = {
+    'wsgi': lambda port: [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--with-threads',
+                          '--no-reload', '--port', str(port)],
+    'asgi': lambda port: [sys.executable, '-m', 'hypercorn', 'asgi:application', '--bind', f'127.0.0.1:{port}'],
+}
+
+
+# ------------------- FIXTURES ------------------- #
+
+def create_fixtures(products, payments):
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"async_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                   (f"async_buyer_{tag}", f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    cursor.execute("INSERT INTO addresses (user_id, full_name, phone, address, city, state, pincode) "
+                   "VALUES (%s, 'Bench', '0000000000', 'Bench street', 'Bench', 'Bench', '000000')", (buyer_id,))
+    address_id = cursor.lastrowid
+    rng = random.Random(42)
+    cursor.executemany("INSERT INTO products (name, description, price, seller_id, category) "
+                       "VALUES (%s, %s, 99.00, %s, 'bench')",
+                       [(f"Bench {rng.choice(WORDS)} {i}", ' '.join(rng.choices(WORDS, k=8)), seller_id)
+                        for i in range(products)])
+    payment_ids = [new_payment_id() for _ in range(payments)]
+    for payment_id in payment_ids:
+        enqueue_payment(cursor, payment_id, buyer_id, address_id, 99)
+    conn.commit()
+    conn.close()
+    return seller_id, buyer_id, payment_ids
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM payment_jobs WHERE user_id = %s", (buyer_id,))
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def session_cookie(buyer_id):
+    """A session cookie as the login view would set it; both servers read the same format"""
+    value = app.session_interface.get_signing_serializer(app).dumps({'user_id': buyer_id, 'user_type': 'buyer'})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+# ------------------- HTTP ------------------- #
+
+async def send(writer, path, cookie):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nCookie: {cookie}\r\n\r\n".encode())
+    await writer.drain()
+
+
+async def read_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    return int(lines[0].split()[1]), {k.lower(): v for k, v in headers.items()}
+
+
+async def read_body(reader, headers):
+    if 'content-length' in headers:
+        return await reader.readexactly(int(headers['content-length']))
+    body = b''
+    while True:     # chunked
+        size = int((await reader.readline()).strip(), 16)
+        chunk = await reader.readexactly(size + 2)
+        if size == 0:
+            return body
+        body += chunk[:-2]
+
+
+async def search_client(port, cookie, deadline, rng, timings, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            await send(writer, f"/get_search_results?q={rng.choice(WORDS)}&page={rng.randint(1, 3)}", cookie)
+            status, headers = await read_head(reader)
+            body = await read_body(reader, headers)
+            if status != 200 or b'"success":true' not in body.replace(b' ', b''):
+                errors.append(status)
+            timings.append(time.perf_counter() - start)
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def stream_client(port, cookie, payment_id, deadline, held):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await send(writer, f"/payment_events/{payment_id}", cookie)
+        status, _ = await asyncio.wait_for(read_head(reader), max(deadline - time.monotonic(), 0.1))
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return
+    if status == 200:
+        held.append(payment_id)
+        try:
+            await asyncio.wait_for(reader.read(), max(deadline - time.monotonic(), 0))
+        except (OSError, asyncio.TimeoutError):
+            pass
+        held.remove(payment_id)
+    writer.close()
+
+
+# ------------------- SAMPLING ------------------- #
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                return int(line.split()[1])
+    return 0
+
+
+async def scrape(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await send(writer, '/metrics', '')
+    _, headers = await read_head(reader)
+    body = (await read_body(reader, headers)).decode()
+    writer.close()
+    values = {}
+    for line in body.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+async def sample(port, pid, deadline, held, peaks):
+    while time.monotonic() < deadline:
+        peaks['threads'] = max(peaks['threads'], thread_count(pid))
+        peaks['streams'] = max(peaks['streams'], len(held))
+        try:
+            values = await scrape(port)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            values = {}
+        in_use = values.get('technest_db_pool_in_use', 0) + values.get('technest_async_db_pool_in_use', 0)
+        peaks['db_connections'] = max(peaks['db_connections'], in_use)
+        await asyncio.sleep(0.5)
+
+
+# ------------------- RUN ------------------- #
+
+def start_server(name, port):
+    process = subprocess.Popen(SERVERS[name](port), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} server exited: {process.stderr.read().decode()[-2000:]}")
+        try:
+            asyncio.run(scrape(port))
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{name} server did not start on port {port}")
+
+
+async def drive(args, pid, cookie, payment_ids):
+    deadline = time.monotonic() + args.duration
+    rng = random.Random(args.seed)
+    timings, errors, held = [], [], []
+    peaks = {'threads': 0, 'streams': 0, 'db_connections': 0}
+    clients = [stream_client(args.port, cookie, payment_ids[i], deadline, held) for i in range(args.hold)]
+    clients += [search_client(args.port, cookie, deadline, random.Random(rng.random()), timings, errors)
+                for _ in range(args.clients - args.hold)]
+    await asyncio.gather(sample(args.port, pid, deadline, held, peaks), *clients)
+    return timings, errors, peaks
+
+
+def report(name, timings, errors, peaks, duration):
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000 if timings else 0
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000 if timings else 0
+    print(f"{name:<5} {peaks['streams']:>8} {peaks['threads']:>8} {peaks['db_connections']:>8.0f} "
+          f"{len(timings) / duration:>9.1f} {p50:>8.1f} {p99:>8.1f} {len(errors):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', default='wsgi,asgi', help='comma-separated: wsgi, asgi')
+    parser.add_argument('--clients', type=int, default=1000, help='concurrent connections')
+    parser.add_argument('--hold', type=int, default=900, help='of those, open /payment_events streams')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    args.hold = min(args.hold, args.clients)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.clients * 2 + 100)), hard))
+
+    seller_id, buyer_id, payment_ids = create_fixtures(args.products, args.hold)
+    try:
+        cookie = session_cookie(buyer_id)
+        print(f"{args.clients} clients, {args.hold} holding streams, {args.duration:.0f}s per server\n")
+        print(f"{'':<5} {'streams':>8} {'threads':>8} {'db conns':>8} {'search/s':>9} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'errors':>7}")
+        for name in args.servers.split(','):
+            process = start_server(name, args.port)
+            try:
+                timings, errors, peaks = asyncio.run(drive(args, process.pid, cookie, payment_ids))
+            finally:
+                process.terminate()
+                process.wait()
+            report(name, timings, errors, peaks, args.duration)
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+
+if __name__ == '__main__':
+    main()
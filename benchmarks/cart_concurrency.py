@@ -0,0 +1,86 @@
+"""Fire parallel /add_to_cart requests for one buyer and check no increment is lost.
+
+Runs against the database in config.py through the Flask test client, using
+a throwaway buyer, seller and product that it creates and removes itself.
+
+    python benchmarks/cart_concurrency.py --requests 500 --threads 32
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from db import get_db_connection
+
+
+def create_fixtures():
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"bench_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                   (f"bench_buyer_{tag}", f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    cursor.execute("INSERT INTO products (name, description, price, seller_id, category) "
+                   "VALUES ('Bench product', '', 99.00, %s, 'bench')", (seller_id,))
+    product_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return seller_id, buyer_id, product_id
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Cascades to products and cart
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    seller_id, buyer_id, product_id = create_fixtures()
+
+    def add_one(_):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = buyer_id
+                sess['user_type'] = 'buyer'
+            return client.post('/add_to_cart', data={'product_id': product_id}).get_json()['success']
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            ok = sum(executor.map(add_one, range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT quantity FROM cart WHERE user_id = %s AND product_id = %s", (buyer_id, product_id))
+        row = cursor.fetchone()
+        conn.close()
+        quantity = row[0] if row else 0
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+    print(f"{args.requests} requests on {args.threads} threads in {elapsed:.2f}s "
+          f"({args.requests / elapsed:.0f} req/s), {ok} succeeded")
+    print(f"cart quantity {quantity}, expected {ok}")
+    if quantity != ok:
+        print(f"LOST {ok - quantity} increments")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Throughput and memory of the streaming order exports.
+
+Seeds a throwaway seller and buyer in the database from config.py with
+--lines order lines (--items-per-order per order, one order a minute), then
+downloads /seller/orders/export and /orders/export in each --formats through
+the Flask test client, reading the body chunk by chunk as a client would.
+Reports rows/s, MB/s and this process's resident memory before and at its
+peak during the download: the peak should not grow with --lines.
+
+    python benchmarks/export_bench.py --lines 1000000
+
+--buffered also times the same seller query with fetchall(), the way a
+non-streaming export would hold it, for comparison.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from db import get_db_connection
+from order_export import export_query
+
+
+def create_fixtures():
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"export_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                   (f"export_buyer_{tag}", f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO products (name, description, price, seller_id, category) "
+                       "VALUES (%s, '', 99.00, %s, 'bench')", [(f"Bench product {i}", seller_id) for i in range(50)])
+    cursor.execute("SELECT id FROM products WHERE seller_id = %s", (seller_id,))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    conn.close()
+    return seller_id, buyer_id, product_ids
+
+
+def seed_orders(buyer_id, seller_id, product_ids, lines, items_per_order, batch=5000):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start = datetime(2020, 1, 1)
+    orders = lines // items_per_order
+    for offset in range(0, orders, batch):
+        n = min(batch, orders - offset)
+        cursor.executemany("""
+            INSERT INTO order_headers (user_id, total, item_count, payment_status, created_at)
+            VALUES (%s, %s, %s, 'paid', %s)
+        """, [(buyer_id, 99 * items_per_order, items_per_order, start + timedelta(minutes=offset + i))
+              for i in range(n)])
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, price)
+            VALUES (%s, %s, %s, 1, 99.00)
+        """, [(first_id + i, product_ids[(offset + i + j) % len(product_ids)], seller_id)
+              for i in range(n) for j in range(items_per_order)])
+        conn.commit()
+        print(f"\rseeded {(offset + n) * items_per_order} order lines", end='', flush=True)
+    print()
+    conn.close()
+    return orders * items_per_order
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def download(client, path):
+    """(rows, bytes, seconds, peak RSS MB) for one streamed export"""
+    start = time.perf_counter()
+    response = client.get(path, buffered=False)
+    assert response.status_code == 200, response.status_code
+    rows = size = 0
+    peak = rss_mb()
+    for chunk in response.iter_encoded():
+        rows += chunk.count(b'\n')
+        size += len(chunk)
+        peak = max(peak, rss_mb())
+    response.close()
+    return rows, size, time.perf_counter() - start, peak
+
+
+def buffered(seller_id):
+    """The seller export read the non-streaming way, for the memory comparison"""
+    query, params, _ = export_query('seller', seller_id)
+    start = time.perf_counter()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = len(cursor.fetchall())
+    peak = rss_mb()
+    conn.close()
+    return rows, time.perf_counter() - start, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000, help='order lines to seed')
+    parser.add_argument('--items-per-order', type=int, default=4)
+    parser.add_argument('--formats', default='csv,jsonl')
+    parser.add_argument('--buffered', action='store_true', help='also time a fetchall() of the seller export')
+    args = parser.parse_args()
+
+    seller_id, buyer_id, product_ids = create_fixtures()
+    try:
+        lines = seed_orders(buyer_id, seller_id, product_ids, args.lines, args.items_per_order)
+        print(f"{'export':<22} {'rows':>9} {'MB':>8} {'seconds':>8} {'rows/s':>9} {'MB/s':>7} "
+              f"{'RSS before':>10} {'RSS peak':>9}")
+        for kind, user_id, user_type, path in (('seller', seller_id, 'seller', '/seller/orders/export'),
+                                               ('buyer', buyer_id, 'buyer', '/orders/export')):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['user_type'] = user_type
+            for fmt in args.formats.split(','):
+                before = rss_mb()
+                rows, size, seconds, peak = download(client, f"{path}?format={fmt}")
+                rows -= fmt == 'csv'    # header line
+                assert rows == lines, f"{kind} {fmt}: exported {rows} of {lines} rows"
+                mb = size / 1024 / 1024
+                print(f"{f'{kind} {fmt}':<22} {rows:>9} {mb:>8.1f} {seconds:>8.2f} {rows / seconds:>9.0f} "
+                      f"{mb / seconds:>7.1f} {before:>8.1f}MB {peak:>7.1f}MB")
+        if args.buffered:
+            before = rss_mb()
+            rows, seconds, peak = buffered(seller_id)
+            print(f"{'seller fetchall()':<22} {rows:>9} {'':>8} {seconds:>8.2f} {rows / seconds:>9.0f} "
+                  f"{'':>7} {before:>8.1f}MB {peak:>7.1f}MB")
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+
+if __name__ == '__main__':
+    main()
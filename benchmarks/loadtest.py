@@ -0,0 +1,429 @@
+"""Mixed storefront load test with per-route throughput and latency percentiles.
+
+Seeds the database from config.py with a tagged set of sellers, buyers,
+products and past orders. Then it runs --concurrency virtual users, each
+making --requests weighted-random storefront calls:
+
+    browse           GET  /buyer, then one /get_products page
+    add_to_cart      POST /add_to_cart
+    update_cart      POST /update_cart
+    checkout         GET  /checkout
+    process_payment  POST /process_payment, then --polls GET /check_payment/<id>
+    seller           GET  /seller (seller virtual users)
+
+Every random choice comes from --seed, so the same arguments replay the same
+request sequence. The report is printed and written as JSON. Pass a previous
+run to --compare to see p95 changes between commits:
+
+    python benchmarks/loadtest.py --out before.json
+    git checkout my-branch
+    python benchmarks/loadtest.py --compare before.json
+
+By default requests go through the Flask test client in this process. With
+--url they go over HTTP to a running server that uses the same database.
+The seed data is deleted afterwards unless --keep is given.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from werkzeug.security import generate_password_hash
+
+from app import app
+from db import get_db_connection
+
+PASSWORD = 'bench-password'
+DEFAULT_MIX = 'browse=50,add_to_cart=15,update_cart=10,checkout=8,process_payment=5,seller=12'
+
+
+# ------------------- SEED DATA ------------------- #
+
+def seed(tag, sellers, buyers, products, orders, rng, batch=2000):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    password = generate_password_hash(PASSWORD)
+
+    cursor.executemany("INSERT INTO users (username, password, email, user_type) VALUES (%s, %s, %s, %s)",
+                       [(f"lt_{tag}_s{i}", password, f"lt_{tag}_s{i}@bench.local", 'seller') for i in range(sellers)]
+                       + [(f"lt_{tag}_b{i}", password, f"lt_{tag}_b{i}@bench.local", 'buyer') for i in range(buyers)])
+    cursor.execute("SELECT id, username, user_type FROM users WHERE username LIKE %s ORDER BY id", (f"lt_{tag}_%",))
+    users = cursor.fetchall()
+    seller_ids = [row[0] for row in users if row[2] == 'seller']
+    buyer_rows = [(row[0], row[1]) for row in users if row[2] == 'buyer']
+
+    cursor.executemany("""
+        INSERT INTO addresses (user_id, full_name, phone, address, city, state, pincode, is_default)
+        VALUES (%s, 'Load Test', '9999999999', '1 Bench Street', 'Pune', 'MH', '411001', TRUE)
+    """, [(buyer_id,) for buyer_id, _ in buyer_rows])
+    cursor.execute("SELECT user_id, id FROM addresses WHERE user_id IN (SELECT id FROM users WHERE username LIKE %s)",
+                   (f"lt_{tag}_%",))
+    address_ids = dict(cursor.fetchall())
+
+    categories = ['laptops', 'phones', 'audio', 'cameras', 'accessories']
+    for offset in range(0, products, batch):
+        cursor.executemany("""
+            INSERT INTO products (name, description, price, seller_id, category) VALUES (%s, %s, %s, %s, %s)
+        """, [(f"Load test product {i}", f"Seeded product {i} for load test {tag}",
+               round(rng.uniform(100, 100000), 2), rng.choice(seller_ids), rng.choice(categories))
+              for i in range(offset, min(offset + batch, products))])
+    cursor.execute("SELECT id, seller_id, price FROM products WHERE seller_id IN (%s)"
+                   % ', '.join(['%s'] * len(seller_ids)), seller_ids)
+    product_rows = cursor.fetchall()
+
+    start = datetime.now() - timedelta(days=90)
+    for offset in range(0, orders, batch):
+        n = min(batch, orders - offset)
+        lines = [[rng.choice(product_rows) for _ in range(rng.randint(1, 3))] for _ in range(n)]
+        cursor.executemany("""
+            INSERT INTO order_headers (user_id, total, item_count, payment_status, created_at)
+            VALUES (%s, %s, %s, 'paid', %s)
+        """, [(rng.choice(buyer_rows)[0], sum(p[2] for p in items), len(items),
+               start + timedelta(minutes=rng.randrange(90 * 24 * 60))) for items in lines])
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, price) VALUES (%s, %s, %s, 1, %s)
+        """, [(first_id + i, p[0], p[1], p[2]) for i, items in enumerate(lines) for p in items])
+        conn.commit()
+
+    # Rollups for the seeded orders, the same shape update_sales_rollups keeps
+    placeholders = ', '.join(['%s'] * len(seller_ids))
+    cursor.execute(f"""
+        INSERT INTO product_daily_sales (product_id, day, seller_id, units, revenue)
+        SELECT i.product_id, DATE(h.created_at), i.seller_id, SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i JOIN order_headers h ON i.order_id = h.id
+        WHERE i.seller_id IN ({placeholders})
+        GROUP BY i.product_id, DATE(h.created_at), i.seller_id
+    """, seller_ids)
+    cursor.execute(f"""
+        INSERT INTO seller_daily_sales (seller_id, day, orders, units, revenue)
+        SELECT i.seller_id, DATE(h.created_at), COUNT(DISTINCT h.id), SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i JOIN order_headers h ON i.order_id = h.id
+        WHERE i.seller_id IN ({placeholders})
+        GROUP BY i.seller_id, DATE(h.created_at)
+    """, seller_ids)
+    conn.commit()
+    conn.close()
+
+    buyers = [{'id': buyer_id, 'username': username, 'address_id': address_ids[buyer_id]}
+              for buyer_id, username in buyer_rows]
+    sellers = [{'id': seller_id, 'username': f"lt_{tag}_s{i}"} for i, seller_id in enumerate(seller_ids)]
+    return sellers, buyers, [row[0] for row in product_rows]
+
+
+def drop_seed(tag):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE username LIKE %s", (f"lt_{tag}_%",))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if user_ids:
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        # product_daily_sales has no foreign key to cascade from
+        cursor.execute(f"DELETE FROM product_daily_sales WHERE seller_id IN ({placeholders})", user_ids)
+        cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders})", user_ids)
+    conn.commit()
+    conn.close()
+
+
+def cart_item_ids(user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM cart WHERE user_id = %s ORDER BY id", (user_id,))
+    ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return ids
+
+
+# ------------------- CLIENTS ------------------- #
+
+class TestClient:
+    """Flask test client in this process, logged in through the session cookie"""
+
+    def __init__(self, user, user_type):
+        self._client = app.test_client()
+        with self._client.session_transaction() as sess:
+            sess['user_id'] = user['id']
+            sess['username'] = user['username']
+            sess['user_type'] = user_type
+
+    def request(self, method, path, data=None, json_body=None):
+        response = self._client.open(path, method=method, data=data, json=json_body)
+        return response.status_code, response.headers.get('Location', ''), response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """urllib against a running server, logged in through /login"""
+
+    def __init__(self, user, user_type, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+        self.request('POST', '/login', data={'username': user['username'], 'password': PASSWORD})
+
+    def request(self, method, path, data=None, json_body=None):
+        body, headers = None, {}
+        if json_body is not None:
+            body, headers = json.dumps(json_body).encode(), {'Content-Type': 'application/json'}
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=30) as response:
+                return response.status, response.headers.get('Location', ''), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Location', ''), e.read()
+
+
+# ------------------- SCENARIOS ------------------- #
+
+class Recorder:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+
+    def call(self, client, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, location, body = client.request(method, path, **kwargs)
+        except Exception:
+            status, location, body = None, '', b''
+        elapsed = time.perf_counter() - start
+        failed = status is None or status >= 400 or (status == 302 and '/login' in location)
+        with self._lock:
+            self.timings.setdefault(route, []).append(elapsed)
+            if failed:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, location, body
+
+
+def browse(ctx):
+    ctx.call('/buyer', 'GET', '/buyer')
+    ctx.call('/get_products', 'GET', '/get_products?page_size=24')
+
+
+def add_to_cart(ctx):
+    ctx.call('/add_to_cart', 'POST', '/add_to_cart', data={'product_id': ctx.rng.choice(ctx.product_ids)})
+
+
+def update_cart(ctx):
+    items = cart_item_ids(ctx.user['id'])
+    if not items:
+        return add_to_cart(ctx)
+    ctx.call('/update_cart', 'POST', '/update_cart',
+             json_body={'item_id': ctx.rng.choice(items), 'action': ctx.rng.choice(['increase', 'decrease'])})
+
+
+def checkout(ctx):
+    ctx.call('/checkout', 'GET', '/checkout')
+
+
+def process_payment(ctx):
+    if not cart_item_ids(ctx.user['id']):
+        add_to_cart(ctx)
+    _, location, _ = ctx.call('/process_payment', 'POST', '/process_payment',
+                              data={'address_id': ctx.user['address_id'], 'idempotency_key': uuid.uuid4().hex})
+    if '/payment/' not in location:
+        return
+    payment_id = location.rstrip('/').rsplit('/', 1)[-1]
+    for _ in range(ctx.polls):
+        ctx.call('/check_payment/<id>', 'GET', f'/check_payment/{payment_id}')
+
+
+def seller(ctx):
+    ctx.call('/seller', 'GET', '/seller')
+
+
+SCENARIOS = {
+    'browse': browse,
+    'add_to_cart': add_to_cart,
+    'update_cart': update_cart,
+    'checkout': checkout,
+    'process_payment': process_payment,
+    'seller': seller,
+}
+
+
+class VirtualUser:
+
+    def __init__(self, client, user, recorder, rng, product_ids, polls):
+        self.client = client
+        self.user = user
+        self.recorder = recorder
+        self.rng = rng
+        self.product_ids = product_ids
+        self.polls = polls
+
+    def call(self, route, method, path, **kwargs):
+        return self.recorder.call(self.client, route, method, path, **kwargs)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name.strip()!r}; expected one of {sorted(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run(args, sellers, buyers, product_ids):
+    weights = parse_mix(args.mix)
+    buyer_scenarios = [name for name in weights if name != 'seller']
+    seller_share = weights.get('seller', 0) / sum(weights.values())
+    recorder = Recorder()
+
+    def worker(index):
+        rng = random.Random(args.seed * 1000 + index)
+        is_seller = index < round(args.concurrency * seller_share) or not buyer_scenarios
+        user = sellers[index % len(sellers)] if is_seller else buyers[index % len(buyers)]
+        user_type = 'seller' if is_seller else 'buyer'
+        client = HttpClient(user, user_type, args.url) if args.url else TestClient(user, user_type)
+        vu = VirtualUser(client, user, recorder, rng, product_ids, args.polls)
+        for _ in range(args.requests):
+            if is_seller:
+                seller(vu)
+            else:
+                name = rng.choices(buyer_scenarios, [weights[n] for n in buyer_scenarios])[0]
+                SCENARIOS[name](vu)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+# ------------------- REPORT ------------------- #
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    everything = []
+    for route, timings in sorted(recorder.timings.items()):
+        timings = sorted(timings)
+        everything.extend(timings)
+        routes[route] = {
+            'requests': len(timings),
+            'errors': recorder.errors.get(route, 0),
+            'throughput': len(timings) / elapsed,
+            'mean_ms': sum(timings) / len(timings) * 1000,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p95_ms': percentile(timings, 95) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+        }
+    everything.sort()
+    total = {
+        'requests': len(everything),
+        'errors': sum(recorder.errors.values()),
+        'throughput': len(everything) / elapsed,
+        'p50_ms': percentile(everything, 50) * 1000,
+        'p95_ms': percentile(everything, 95) * 1000,
+        'p99_ms': percentile(everything, 99) * 1000,
+    }
+    return routes, total
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes, total, elapsed, baseline=None):
+    print(f"\n{'route':<22} {'reqs':>7} {'errs':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          + (f" {'p95 vs base':>12}" if baseline else ''))
+    for route, row in list(routes.items()) + [('TOTAL', total)]:
+        line = (f"{route:<22} {row['requests']:>7} {row['errors']:>5} {row['throughput']:>8.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        if baseline:
+            base = baseline['total'] if route == 'TOTAL' else baseline['routes'].get(route)
+            if base and base['p95_ms']:
+                line += f" {(row['p95_ms'] / base['p95_ms'] - 1) * 100:>+11.1f}%"
+        print(line)
+    print(f"\n{total['requests']} requests in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sellers', type=int, default=10)
+    parser.add_argument('--buyers', type=int, default=100)
+    parser.add_argument('--products', type=int, default=5_000)
+    parser.add_argument('--orders', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, default=8, help='virtual users')
+    parser.add_argument('--requests', type=int, default=200, help='scenarios per virtual user')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='scenario=weight list')
+    parser.add_argument('--polls', type=int, default=3, help='/check_payment polls after each payment')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help='base URL of a running server; default is the in-process test client')
+    parser.add_argument('--out', help='JSON results file (default benchmarks/results/loadtest-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='earlier JSON results to compare p95 against')
+    parser.add_argument('--keep', action='store_true', help='leave the seed data in place')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    started_at = datetime.now()
+    tag = f"{args.seed}_{uuid.uuid4().hex[:6]}"
+    print(f"Seeding {args.sellers} sellers, {args.buyers} buyers, {args.products} products, {args.orders} orders")
+    sellers, buyers, product_ids = seed(tag, args.sellers, args.buyers, args.products, args.orders, rng)
+    try:
+        recorder, elapsed = run(args, sellers, buyers, product_ids)
+    finally:
+        if not args.keep:
+            drop_seed(tag)
+
+    routes, total = summarize(recorder, elapsed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(routes, total, elapsed, baseline)
+
+    commit = git_commit()
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results',
+                                   f"loadtest-{commit or 'nogit'}-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'target': args.url or 'flask-test-client',
+            'args': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+            'elapsed_s': elapsed,
+            'routes': routes,
+            'total': total,
+        }, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
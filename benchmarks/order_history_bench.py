@@ -0,0 +1,105 @@
+"""First-page latency of /orders as one buyer's history grows.
+
+Seeds a throwaway buyer in the database from config.py with orders of
+--items-per-order lines each, then times GET /orders through the Flask test
+client at every size. p95 should stay flat: the page is a keyset range on
+order_headers(user_id, created_at, id).
+
+    python benchmarks/order_history_bench.py --lines 10 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from db import get_db_connection
+
+
+def create_fixtures():
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"bench_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                   (f"bench_buyer_{tag}", f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO products (name, description, price, seller_id, category) "
+                       "VALUES (%s, '', 99.00, %s, 'bench')", [(f"Bench product {i}", seller_id) for i in range(20)])
+    cursor.execute("SELECT id FROM products WHERE seller_id = %s", (seller_id,))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    conn.close()
+    return seller_id, buyer_id, product_ids
+
+
+def grow_history(buyer_id, seller_id, product_ids, have, want, items_per_order, batch=2000):
+    """Add orders until the buyer has `want` order lines"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start = datetime(2020, 1, 1)
+    orders = (want - have) // items_per_order
+    for offset in range(0, orders, batch):
+        n = min(batch, orders - offset)
+        first = have // items_per_order + offset
+        cursor.executemany("""
+            INSERT INTO order_headers (user_id, total, item_count, payment_status, created_at)
+            VALUES (%s, %s, %s, 'paid', %s)
+        """, [(buyer_id, 99 * items_per_order, items_per_order, start + timedelta(minutes=first + i))
+              for i in range(n)])
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, price)
+            VALUES (%s, %s, %s, 1, 99.00)
+        """, [(first_id + i, product_ids[(i + j) % len(product_ids)], seller_id)
+              for i in range(n) for j in range(items_per_order)])
+        conn.commit()
+    conn.close()
+    return have + orders * items_per_order
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[10, 1_000, 10_000, 100_000])
+    parser.add_argument('--items-per-order', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    seller_id, buyer_id, product_ids = create_fixtures()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = buyer_id
+        sess['user_type'] = 'buyer'
+
+    try:
+        lines = 0
+        print(f"{'order lines':>12} {'p50 ms':>8} {'p95 ms':>8}")
+        for target in sorted(args.lines):
+            lines = grow_history(buyer_id, seller_id, product_ids, lines, target, args.items_per_order)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get('/orders')
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200
+            timings.sort()
+            print(f"{lines:>12} {timings[len(timings) // 2]:>8.2f} {timings[int(len(timings) * 0.95) - 1]:>8.2f}")
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Compare /check_payment polling with the /payment_events stream.
+
+Needs the app and `flask payment-worker` running against the database in
+config.py. For each mode it checks out one payment, attaches --clients
+waiting clients to it, and reports how many requests the wait cost and how
+long after the worker finished the job each client found out.
+
+    python benchmarks/payment_notify_bench.py --url http://127.0.0.1:5000 --clients 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from http.cookiejar import CookieJar
+
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import get_db_connection
+
+PASSWORD = 'bench-password'
+
+
+def create_fixtures():
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"bench_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    username = f"bench_buyer_{tag}"
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, %s, %s, 'buyer')",
+                   (username, generate_password_hash(PASSWORD), f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    cursor.execute("INSERT INTO products (name, description, price, seller_id, category) "
+                   "VALUES ('Bench product', '', 99.00, %s, 'bench')", (seller_id,))
+    product_id = cursor.lastrowid
+    cursor.execute("INSERT INTO addresses (user_id, full_name, phone, address, city, state, pincode) "
+                   "VALUES (%s, 'Bench', '0000000000', 'Bench street', 'Bench', 'Bench', '000000')", (buyer_id,))
+    address_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return seller_id, buyer_id, username, product_id, address_id
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def finished_at(payment_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT UNIX_TIMESTAMP(finished_at) FROM payment_jobs WHERE payment_id = %s", (payment_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return float(row[0]) if row and row[0] else None
+
+
+def start_payment(url, opener, product_id, address_id):
+    opener.open(f"{url}/add_to_cart", urllib.parse.urlencode({'product_id': product_id}).encode())
+    response = opener.open(f"{url}/process_payment", urllib.parse.urlencode({'address_id': address_id}).encode())
+    return response.geturl().rstrip('/').rsplit('/', 1)[-1]
+
+
+def poll_client(url, cookie, payment_id, interval, results):
+    requests = 0
+    while True:
+        request = urllib.request.Request(f"{url}/check_payment/{payment_id}", headers={'Cookie': cookie})
+        body = urllib.request.urlopen(request).read()
+        requests += 1
+        if b'"pending"' not in body:
+            results.append((time.time(), requests))
+            return
+        time.sleep(interval)
+
+
+def sse_client(url, cookie, payment_id, results):
+    request = urllib.request.Request(f"{url}/payment_events/{payment_id}", headers={'Cookie': cookie})
+    with urllib.request.urlopen(request) as stream:
+        for line in stream:
+            if line.startswith(b'event: status'):
+                results.append((time.time(), 1))
+                return
+
+
+def run_mode(mode, args, opener, cookie, product_id, address_id):
+    payment_id = start_payment(args.url, opener, product_id, address_id)
+    results = []
+    if mode == 'poll':
+        target, extra = poll_client, (args.poll_interval, results)
+    else:
+        target, extra = sse_client, (results,)
+    threads = [threading.Thread(target=target, args=(args.url, cookie, payment_id) + extra)
+               for _ in range(args.clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    done = finished_at(payment_id)
+    latencies = sorted(max(seen - done, 0) * 1000 for seen, _ in results)
+    requests = sum(count for _, count in results)
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+    print(f"{mode:>5}: {len(results)} clients, {requests} requests ({requests / elapsed:.1f} req/s), "
+          f"notify latency p50 {statistics.median(latencies):.0f} ms, p99 {p99:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between /check_payment polls')
+    args = parser.parse_args()
+
+    seller_id, buyer_id, username, product_id, address_id = create_fixtures()
+    try:
+        jar = CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+        opener.open(f"{args.url}/login", urllib.parse.urlencode({'username': username, 'password': PASSWORD}).encode())
+        cookie = '; '.join(f"{c.name}={c.value}" for c in jar)
+        for mode in ('poll', 'sse'):
+            run_mode(mode, args, opener, cookie, product_id, address_id)
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Build time, quality and lookup latency of the co-purchase recommendations.
+
+Seeds a throwaway seller with --products products in bundles of
+--bundle-size, and --orders paid orders that each buy a few products of one
+bundle plus, sometimes, one random product. Then runs the same build as
+`flask build-recommendations` (it replaces the whole product_recommendations
+table, as the nightly job would), reports how many of each product's top
+--check neighbours come from its own bundle, and times recommend() for one
+product and for a three-product cart, cold (empty cache) and warm.
+
+    python benchmarks/recommendations_bench.py --products 5000 --orders 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from cache import recommendation_cache
+from db import get_db_connection
+from recommendations import build_recommendations, neighbours, recommend
+
+
+def create_fixtures(products, orders, bundle_size, noise, rng, batch=5000):
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"recs_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                   (f"recs_buyer_{tag}", f"buyer_{tag}@bench.local"))
+    buyer_id = cursor.lastrowid
+    for offset in range(0, products, batch):
+        cursor.executemany("INSERT INTO products (name, description, price, seller_id, category) "
+                           "VALUES (%s, '', 99.00, %s, 'bench')",
+                           [(f"Bench product {i}", seller_id)
+                            for i in range(offset, min(offset + batch, products))])
+    cursor.execute("SELECT id FROM products WHERE seller_id = %s ORDER BY id", (seller_id,))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    bundles = [product_ids[i:i + bundle_size] for i in range(0, len(product_ids), bundle_size)]
+
+    start = datetime.now() - timedelta(days=30)
+    for offset in range(0, orders, batch):
+        n = min(batch, orders - offset)
+        baskets = []
+        for _ in range(n):
+            bundle = rng.choice(bundles)
+            basket = rng.sample(bundle, min(len(bundle), rng.randint(2, 3)))
+            if rng.random() < noise:
+                extra = rng.choice(product_ids)
+                if extra not in basket:
+                    basket.append(extra)
+            baskets.append(basket)
+        cursor.executemany("""
+            INSERT INTO order_headers (user_id, total, item_count, payment_status, created_at)
+            VALUES (%s, %s, %s, 'paid', %s)
+        """, [(buyer_id, 99 * len(basket), len(basket), start + timedelta(seconds=offset + i))
+              for i, basket in enumerate(baskets)])
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, price)
+            VALUES (%s, %s, %s, 1, 99.00)
+        """, [(first_id + i, product_id, seller_id) for i, basket in enumerate(baskets) for product_id in basket])
+        conn.commit()
+    conn.close()
+    return seller_id, buyer_id, bundles
+
+
+def drop_fixtures(seller_id, buyer_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Cascades to products, orders and their recommendations
+    cursor.execute("DELETE FROM users WHERE id IN (%s, %s)", (seller_id, buyer_id))
+    conn.commit()
+    conn.close()
+
+
+def timed(func, samples):
+    """p50 and p99 microseconds of func(sample) over samples"""
+    timings = []
+    for sample in samples:
+        start = time.perf_counter()
+        func(sample)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5_000)
+    parser.add_argument('--orders', type=int, default=200_000)
+    parser.add_argument('--bundle-size', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=0.3, help='share of orders with one random extra product')
+    parser.add_argument('--check', type=int, default=3, help='top neighbours checked against the bundle')
+    parser.add_argument('--lookups', type=int, default=2_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    seller_id, buyer_id, bundles = create_fixtures(args.products, args.orders, args.bundle_size, args.noise, rng)
+    try:
+        stats = build_recommendations()
+        print(f"build: {stats['order_lines']} order lines, {stats['orders']} orders -> {stats['rows']} rows for "
+              f"{stats['products']} products (load {stats['load_s']:.2f}s, build {stats['build_s']:.2f}s, "
+              f"write {stats['write_s']:.2f}s)")
+
+        bundle_of = {product_id: set(bundle) for bundle in bundles for product_id in bundle}
+        product_ids = list(bundle_of)
+        checked = hits = 0
+        for product_id in product_ids:
+            top = [recommended_id for recommended_id, _ in neighbours(product_id)[:args.check]]
+            checked += len(top)
+            hits += sum(recommended_id in bundle_of[product_id] for recommended_id in top)
+        print(f"top-{args.check} neighbours from the product's own bundle: {hits}/{checked} "
+              f"({hits / max(checked, 1):.1%})")
+
+        singles = [[rng.choice(product_ids)] for _ in range(args.lookups)]
+        carts = [rng.sample(product_ids, 3) for _ in range(args.lookups)]
+        print(f"{'lookup':<18} {'p50 us':>8} {'p99 us':>8}")
+        with app.app_context():
+            for name, samples in (('product', singles), ('3-item cart', carts)):
+                recommendation_cache.clear()
+                for state in ('cold', 'warm'):
+                    p50, p99 = timed(recommend, samples)
+                    print(f"{f'{name}, {state}':<18} {p50:>8.1f} {p99:>8.1f}")
+    finally:
+        drop_fixtures(seller_id, buyer_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Replica routing check with SQLite files standing in for a primary and two replicas.
+
+Builds a primary with `flask db-upgrade`'s migrations, snapshots it into two
+replica files, then writes a product only the primary has (replication lag,
+frozen). Drives /get_search_results through the Flask test client and checks:
+
+- reads alternate between the two replicas and never see the new product
+- after the session commits (add_to_cart), its reads go to the primary
+- a broken replica leaves the rotation and rejoins after it is repaired
+- with every replica down, reads fall back to the primary
+
+    python benchmarks/replica_routing.py --reads 200
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp(prefix='technest-replicas-')
+PRIMARY = os.path.join(WORKDIR, 'primary.sqlite3')
+REPLICAS = [os.path.join(WORKDIR, 'replica_a.sqlite3'), os.path.join(WORKDIR, 'replica_b.sqlite3')]
+CHECK_INTERVAL = 0.5
+
+# Configure before anything imports db.py
+os.environ['TECHNEST_DB_BACKEND'] = 'sqlite'
+os.environ['TECHNEST_SQLITE_PATH'] = PRIMARY
+import config
+config.DB_REPLICAS = [{'path': path} for path in REPLICAS]
+config.DB_REPLICA_CHECK_INTERVAL = CHECK_INTERVAL
+
+from app import app
+from db import get_db_connection, pool, router
+from migrations import upgrade
+
+
+def create_fixtures():
+    upgrade(echo=lambda message: None)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES ('rr_seller', '-', 'rs@x', 'seller')")
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES ('rr_buyer', '-', 'rb@x', 'buyer')")
+    buyer_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO products (name, description, price, seller_id, category) "
+                       "VALUES (%s, 'replicated', 10.00, %s, 'bench')", [(f"Gadget {i}", seller_id) for i in range(20)])
+    product_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return buyer_id, product_id
+
+
+def snapshot(path):
+    source, target = sqlite3.connect(PRIMARY), sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+
+def add_primary_only_product():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO products (name, description, price, seller_id, category) "
+                   "SELECT 'Zephyr drone', 'only on the primary', 99.00, seller_id, 'bench' FROM products LIMIT 1")
+    conn.commit()
+    conn.close()
+
+
+def borrowed():
+    return [pool.stats()['borrowed']] + [replica.pool.stats()['borrowed'] for replica in router.replicas]
+
+
+def search(client, q):
+    response = client.get(f'/get_search_results?q={q}')
+    return [product['name'] for product in response.get_json()['products']]
+
+
+def reads(client, n, q='zephyr'):
+    """Run n searches; return which pools served them and whether any saw the primary-only product"""
+    before = borrowed()
+    seen = sum(bool(search(client, q)) for _ in range(n))
+    return [after - b for after, b in zip(borrowed(), before)], seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=100)
+    args = parser.parse_args()
+
+    try:
+        buyer_id, product_id = create_fixtures()
+        for path in REPLICAS:
+            snapshot(path)
+        add_primary_only_product()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = buyer_id
+            sess['user_type'] = 'buyer'
+        search(client, 'gadget')    # first request also checks the schema version on the primary
+
+        start = time.perf_counter()
+        served, seen = reads(client, args.reads)
+        elapsed = time.perf_counter() - start
+        print(f"replica reads        primary/a/b = {served}, saw primary-only row {seen}x, "
+              f"{args.reads / elapsed:.0f} req/s")
+        assert served[0] == 0 and abs(served[1] - served[2]) <= 1 and seen == 0
+
+        client.post('/add_to_cart', data={'product_id': product_id})
+        served, seen = reads(client, args.reads)
+        print(f"after a write        primary/a/b = {served}, saw primary-only row {seen}x")
+        assert served[1] == served[2] == 0 and seen == args.reads
+
+        # Expire the read-your-writes window
+        with client.session_transaction() as sess:
+            sess['db_primary_until'] = 0
+        shutil.move(REPLICAS[0], REPLICAS[0] + '.bak')
+        os.makedirs(REPLICAS[0])     # a directory where the database should be: every open fails
+        time.sleep(CHECK_INTERVAL)
+        served, seen = reads(client, args.reads)
+        print(f"replica a broken     primary/a/b = {served}, healthy = "
+              f"{[replica.healthy for replica in router.replicas]}")
+        assert served[0] == 0 and served[2] == args.reads
+
+        os.rmdir(REPLICAS[0])
+        shutil.move(REPLICAS[0] + '.bak', REPLICAS[0])
+        time.sleep(CHECK_INTERVAL)
+        served, seen = reads(client, args.reads)
+        print(f"replica a repaired   primary/a/b = {served}")
+        assert served[1] > 0 and served[2] > 0
+
+        for path in REPLICAS:
+            shutil.move(path, path + '.bak')
+            os.makedirs(path)
+        time.sleep(CHECK_INTERVAL)
+        served, seen = reads(client, args.reads)
+        print(f"all replicas broken  primary/a/b = {served}, saw primary-only row {seen}x")
+        assert served[0] == args.reads and seen == args.reads
+        print("OK")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Product search latency at growing catalog sizes.
+
+Seeds a scratch `products` table in its own database (never the app's) and
+times the same FULLTEXT query /search runs, with and without filters.
+
+    python benchmarks/search_bench.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DATABASE_CONFIG
+
+WORDS = ['wireless', 'bluetooth', 'charger', 'headphone', 'earbuds', 'keyboard', 'smart', 'bulb',
+         'thermostat', 'powerbank', 'usb', 'fitness', 'band', 'vr', 'headset', 'noise', 'cancelling',
+         'portable', 'fast', 'ergonomic', 'mechanical', 'compact', 'battery', 'premium', 'gaming']
+CATEGORIES = ['audio', 'accessories', 'wearables', 'smart home', 'gaming']
+QUERIES = ['wireless headphone', 'smart bulb', 'mechanical keyboard', 'fast charger', 'vr headset']
+
+SEARCH_SQL = """
+    SELECT id, name, price, MATCH(name, description) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+    FROM products
+    WHERE MATCH(name, description) AGAINST (%s IN NATURAL LANGUAGE MODE) {filters}
+    ORDER BY score DESC, id DESC LIMIT 25
+"""
+
+
+def connect(database):
+    config = dict(DATABASE_CONFIG, database=database)
+    return mysql.connector.connect(**config)
+
+
+def seed(cursor, conn, size, batch=5000):
+    cursor.execute("DROP TABLE IF EXISTS products")
+    cursor.execute("""
+        CREATE TABLE products (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            price DECIMAL(10,2) NOT NULL,
+            category VARCHAR(50)
+        )
+    """)
+    rng = random.Random(size)
+    for start in range(0, size, batch):
+        rows = []
+        for _ in range(min(batch, size - start)):
+            name = ' '.join(rng.sample(WORDS, 3)).title()
+            description = ' '.join(rng.choices(WORDS, k=30))
+            rows.append((name, description, round(rng.uniform(199, 49999), 2), rng.choice(CATEGORIES)))
+        cursor.executemany("INSERT INTO products (name, description, price, category) VALUES (%s, %s, %s, %s)", rows)
+        conn.commit()
+    # Built after the load, which is much faster than maintaining it row by row
+    cursor.execute("ALTER TABLE products ADD FULLTEXT ft_products_name_description (name, description)")
+
+
+def time_query(cursor, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--database', default='technest_bench')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    admin = connect(None)
+    admin.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {args.database}")
+    admin.close()
+
+    conn = connect(args.database)
+    cursor = conn.cursor()
+    print(f"{'products':>10}  {'query':<28} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        seed(cursor, conn, size)
+        for q in QUERIES:
+            cases = [
+                ('', (q, q)),
+                ('AND category = %s AND price BETWEEN %s AND %s', (q, q, 'audio', 500, 5000)),
+            ]
+            for filters, params in cases:
+                p50, p95 = time_query(cursor, SEARCH_SQL.format(filters=filters), params, args.repeat)
+                label = q + (' +filters' if filters else '')
+                print(f"{size:>10}  {label:<28} {p50:>8.2f} {p95:>8.2f}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare serve.py worker/thread settings on the storefront load test.
+
+For each WORKERSxTHREADS setting in --grid it starts serve.py on --port,
+runs benchmarks/loadtest.py against it over HTTP with the same seed, stops
+the server, and prints throughput and latency side by side. The payment
+worker runs under each server, so process_payment exercises the whole flow.
+
+    python benchmarks/server_bench.py --grid 1x8,2x4,4x4,4x8 --concurrency 32
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_serving(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{url}/metrics", timeout=2).read()
+            return
+        except urllib.error.HTTPError:
+            return      # answering, just not authorized
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"serve.py did not answer on {url}")
+
+
+def run_setting(workers, threads, args):
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, 'serve.py', '--bind', f'127.0.0.1:{args.port}',
+                               '--workers', str(workers), '--threads', str(threads),
+                               '--payment-workers', str(args.payment_workers)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    out = os.path.join(tempfile.mkdtemp(prefix='technest-server-bench-'), 'result.json')
+    try:
+        wait_until_serving(url, server)
+        subprocess.run([sys.executable, os.path.join('benchmarks', 'loadtest.py'), '--url', url, '--out', out,
+                        '--concurrency', str(args.concurrency), '--requests', str(args.requests),
+                        '--buyers', str(args.buyers), '--products', str(args.products),
+                        '--orders', str(args.orders), '--seed', str(args.seed)],
+                       cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    with open(out) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grid', default='1x8,2x4,4x4,4x8', help='comma-separated WORKERSxTHREADS settings')
+    parser.add_argument('--concurrency', type=int, default=32, help='load test virtual users')
+    parser.add_argument('--requests', type=int, default=50, help='scenarios per virtual user')
+    parser.add_argument('--buyers', type=int, default=100)
+    parser.add_argument('--products', type=int, default=5_000)
+    parser.add_argument('--orders', type=int, default=5_000)
+    parser.add_argument('--payment-workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8077)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    settings = [tuple(int(n) for n in setting.split('x')) for setting in args.grid.split(',')]
+    print(f"{'workers x threads':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  "
+          f"slowest route (p95)")
+    for workers, threads in settings:
+        result = run_setting(workers, threads, args)
+        total = result['total']
+        slowest = max(result['routes'].items(), key=lambda item: item[1]['p95_ms'])
+        print(f"{f'{workers} x {threads}':<18} {total['throughput']:>8.1f} {total['p50_ms']:>8.2f} "
+              f"{total['p95_ms']:>8.2f} {total['p99_ms']:>8.2f} {total['errors']:>7}  "
+              f"{slowest[0]} {slowest[1]['p95_ms']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Flash sale on one product: concurrent checkouts must never oversell.
+
+Seeds a throwaway seller with one product holding --stock units and
+--buyers buyers with --quantity of it in their carts, then has every buyer
+POST /process_payment at once through the Flask test client on --threads
+threads. Checks that the units reserved add up to exactly what was taken
+from stock and that stock never went below zero, then settles the queued
+payments the way the payment worker does (create_order, or a failure for
+--fail-rate of them) and checks again: ordered + stock back on sale must
+equal the starting stock. Don't run `flask payment-worker` meanwhile: the
+benchmark settles whatever payment jobs it can claim.
+
+    python benchmarks/stock_contention.py --stock 1000 --buyers 3000 --threads 64
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, create_order
+from config import PAYMENT_WORKERS
+from db import get_db_connection
+from payment_worker import claim_job, finish_job
+
+
+def create_fixtures(stock, buyers, quantity):
+    tag = uuid.uuid4().hex[:8]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'seller')",
+                   (f"stock_seller_{tag}", f"seller_{tag}@bench.local"))
+    seller_id = cursor.lastrowid
+    cursor.execute("INSERT INTO products (name, description, price, stock, seller_id, category) "
+                   "VALUES ('Flash sale product', '', 99.00, %s, %s, 'bench')", (stock, seller_id))
+    product_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO users (username, password, email, user_type) VALUES (%s, '-', %s, 'buyer')",
+                       [(f"stock_{tag}_b{i}", f"stock_{tag}_b{i}@bench.local") for i in range(buyers)])
+    cursor.execute("SELECT id FROM users WHERE username LIKE %s ORDER BY id", (f"stock_{tag}_b%",))
+    buyer_ids = [row[0] for row in cursor.fetchall()]
+    cursor.executemany("""
+        INSERT INTO addresses (user_id, full_name, phone, address, city, state, pincode, is_default)
+        VALUES (%s, 'Bench', '0000000000', 'Bench street', 'Bench', 'Bench', '000000', TRUE)
+    """, [(buyer_id,) for buyer_id in buyer_ids])
+    cursor.execute("SELECT user_id, id FROM addresses WHERE user_id IN (SELECT id FROM users WHERE username LIKE %s)",
+                   (f"stock_{tag}_b%",))
+    address_ids = dict(cursor.fetchall())
+    cursor.executemany("INSERT INTO cart (user_id, product_id, quantity) VALUES (%s, %s, %s)",
+                       [(buyer_id, product_id, quantity) for buyer_id in buyer_ids])
+    cursor.executemany("INSERT INTO cart_summary (user_id, item_count, total_price) VALUES (%s, %s, %s)",
+                       [(buyer_id, quantity, 99 * quantity) for buyer_id in buyer_ids])
+    conn.commit()
+    conn.close()
+    return seller_id, product_id, [(buyer_id, address_ids[buyer_id]) for buyer_id in buyer_ids]
+
+
+def drop_fixtures(seller_id, buyers):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # product_daily_sales has no foreign key to cascade from
+    cursor.execute("DELETE FROM product_daily_sales WHERE seller_id = %s", (seller_id,))
+    user_ids = [seller_id] + [buyer_id for buyer_id, _ in buyers]
+    for offset in range(0, len(user_ids), 1000):
+        chunk = user_ids[offset:offset + 1000]
+        cursor.execute(f"DELETE FROM users WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+    conn.commit()
+    conn.close()
+
+
+def stock_state(product_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+    stock = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_reservations WHERE product_id = %s", (product_id,))
+    reserved = int(cursor.fetchone()[0])
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE product_id = %s", (product_id,))
+    ordered = int(cursor.fetchone()[0])
+    conn.close()
+    return stock, reserved, ordered
+
+
+def checkout(buyer):
+    buyer_id, address_id = buyer
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_id'] = buyer_id
+            sess['user_type'] = 'buyer'
+        start = time.perf_counter()
+        response = client.post('/process_payment', data={'address_id': address_id})
+        elapsed = time.perf_counter() - start
+    return '/payment/' in response.location, elapsed
+
+
+def settle(buyer_ids, fail_rate, threads, seed):
+    """Run every queued payment of these buyers once: create the order, or fail it"""
+    rng = random.Random(seed)
+    failing = {buyer_id for buyer_id in buyer_ids if rng.random() < fail_rate}
+
+    def drain(_):
+        paid = failed = 0
+        conn = get_db_connection()
+        try:
+            while True:
+                job = claim_job(conn)
+                if job is None:
+                    return paid, failed
+                if job['user_id'] in failing:
+                    finish_job(conn, job, 'failed', 'declined by benchmark')
+                    failed += 1
+                else:
+                    create_order(job)
+                    finish_job(conn, job, 'paid')
+                    paid += 1
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(drain, range(threads)))
+    return sum(paid for paid, _ in results), sum(failed for _, failed in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=1000)
+    parser.add_argument('--buyers', type=int, default=3000)
+    parser.add_argument('--quantity', type=int, default=1, help='units in each cart')
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--payment-workers', type=int, default=PAYMENT_WORKERS, help='threads settling payments')
+    parser.add_argument('--fail-rate', type=float, default=0.1, help='share of payments to decline')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    seller_id, product_id, buyers = create_fixtures(args.stock, args.buyers, args.quantity)
+    problems = []
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            results = list(executor.map(checkout, buyers))
+        elapsed = time.perf_counter() - start
+        reserved_ok = sum(ok for ok, _ in results)
+        timings = sorted(seconds * 1000 for _, seconds in results)
+
+        stock, reserved, ordered = stock_state(product_id)
+        print(f"{args.buyers} checkouts of {args.quantity} unit(s) on {args.threads} threads in {elapsed:.2f}s "
+              f"({args.buyers / elapsed:.0f} checkouts/s, p50 {timings[len(timings) // 2]:.1f} ms, "
+              f"p99 {timings[int(len(timings) * 0.99) - 1]:.1f} ms)")
+        print(f"reserved {reserved_ok} checkouts ({reserved} units), {args.buyers - reserved_ok} sold out; "
+              f"stock left {stock}")
+        expected = min(args.buyers, args.stock // args.quantity)
+        if stock < 0 or reserved + stock != args.stock or reserved != reserved_ok * args.quantity:
+            problems.append(f"after checkout: stock {stock} + reserved {reserved} != {args.stock}")
+        if reserved_ok != expected:
+            problems.append(f"after checkout: {reserved_ok} checkouts reserved, expected {expected}")
+
+        start = time.perf_counter()
+        paid, failed = settle([buyer_id for buyer_id, _ in buyers], args.fail_rate, args.payment_workers,
+                              args.seed)
+        elapsed = time.perf_counter() - start
+        stock, reserved, ordered = stock_state(product_id)
+        print(f"settled {paid} paid and {failed} declined payments in {elapsed:.2f}s: "
+              f"{ordered} units ordered, {stock} back on sale, {reserved} still reserved")
+        if stock < 0 or reserved or ordered + stock != args.stock or ordered != paid * args.quantity:
+            problems.append(f"after settling: ordered {ordered} + stock {stock} + reserved {reserved} "
+                            f"!= {args.stock}")
+    finally:
+        drop_fixtures(seller_id, buyers)
+
+    for problem in problems:
+        print(f"OVERSOLD OR LOST STOCK: {problem}")
+    if problems:
+        sys.exit(1)
+    print("no oversell")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from config import (PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, PAGE_CACHE_SIZE, PAGE_CACHE_TTL,
+                    CART_COUNT_CACHE_SIZE, CART_COUNT_CACHE_TTL, RECOMMENDATIONS_CACHE_SIZE,
+                    RECOMMENDATIONS_CACHE_TTL, CACHE_BUS_DIR)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and tag-based invalidation"""
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (expires_at, value, tags)
+        self._tags = defaultdict(set)   # tag -> keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class InvalidationBus:
+    """Broadcasts invalidated tags to the other workers on this host.
+
+    Each worker binds a unix datagram socket in CACHE_BUS_DIR and a publish
+    is one datagram to every other socket found there. It stands in for a
+    real pub/sub broker; entries still expire by TTL if a message is lost.
+    """
+
+    def __init__(self, directory, handler):
+        self.directory = directory
+        self.handler = handler
+        self.pid = None
+        self._sock = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and hasattr(socket, 'AF_UNIX')
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.sock")
+
+    def start(self):
+        """(Re)bind for the current process; safe to call on every request"""
+        if not self.enabled or self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            if os.path.exists(path):
+                os.remove(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self._sock = sock
+            self.pid = os.getpid()
+            threading.Thread(target=self._listen, args=(sock,), daemon=True, name='cache-bus').start()
+
+    def _listen(self, sock):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            for tag in data.decode().split('\n'):
+                if tag:
+                    self.handler(tag)
+
+    def publish(self, tags):
+        if not self.enabled:
+            return
+        self.start()
+        message = '\n'.join(tags).encode()
+        own = self._path(os.getpid())
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.sock') or path == own:
+                continue
+            try:
+                self._sock.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; clean up its socket file
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+
+
+product_cache = LRUCache('product', PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+page_cache = LRUCache('catalog_page', PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+cart_count_cache = LRUCache('cart_count', CART_COUNT_CACHE_SIZE, CART_COUNT_CACHE_TTL)
+recommendation_cache = LRUCache('recommendations', RECOMMENDATIONS_CACHE_SIZE, RECOMMENDATIONS_CACHE_TTL)
+caches = [product_cache, page_cache, cart_count_cache, recommendation_cache]
+
+
+# Extra callbacks run for every invalidated tag, e.g. to wake waiting clients
+listeners = []
+
+
+def _invalidate_local(tag):
+    for cache in caches:
+        cache.invalidate(tag)
+    for listener in listeners:
+        listener(tag)
+
+
+bus = InvalidationBus(CACHE_BUS_DIR, _invalidate_local)
+
+
+def product_tag(product_id):
+    return f"product:{int(product_id)}"
+
+
+def cart_tag(user_id):
+    return f"cart:{int(user_id)}"
+
+
+def set_cart_count(user_id, count):
+    """Cache a freshly committed cart count; other workers drop their copy"""
+    invalidate(cart_tag(user_id))
+    cart_count_cache.set(int(user_id), count, [cart_tag(user_id)])
+
+
+def payment_tag(payment_id):
+    return f"payment:{payment_id}"
+
+
+# Pages fetched without a cursor; a new product only ever lands on these
+CATALOG_HEAD_TAG = 'catalog:head'
+
+# Every cached neighbour list; a recommendations build replaces them all
+RECOMMENDATIONS_TAG = 'recommendations'
+
+
+def invalidate(*tags):
+    """Drop every cached entry carrying one of the tags, here and in other workers"""
+    for tag in tags:
+        _invalidate_local(tag)
+    bus.publish(tags)
+
+
+def subscribe(listener):
+    """Call listener(tag) for every invalidation, local or from another process"""
+    listeners.append(listener)
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def init_app(app):
+    app.before_request(bus.start)
@@ -1,3 +1,12 @@
+import os
+
+# 'mysql', or 'sqlite' for a single-node shop, benchmarks and CI (see sqlite_backend.py)
+DB_BACKEND = os.environ.get('TECHNEST_DB_BACKEND', 'mysql')
+SQLITE_PATH = os.environ.get('TECHNEST_SQLITE_PATH', 'instance/technest.sqlite3')
+SQLITE_BUSY_TIMEOUT = 5     # seconds a writer waits for the write lock
+SQLITE_CACHE_MB = 64        # page cache per connection
+SQLITE_MMAP_MB = 256        # memory-mapped reads; 0 turns it off
+
 DATABASE_CONFIG = {
     'host': 'localhost',
     'user': 'root',
@@ -5,6 +14,111 @@ DATABASE_CONFIG = {
     'database': 'technest'
 }
 
+# Connection pool shared by app.py and db.py
+DB_POOL_NAME = 'technest'
+DB_POOL_SIZE = 10          # mysql-connector caps a single pool at 32
+DB_POOL_TIMEOUT = 5        # seconds a request waits for a free connection
+DB_POOL_PRE_PING = True    # check connections are alive when borrowed
+
+# Read replicas for @replica_reads views; DATABASE_CONFIG-style dicts ({'path': ...} on SQLite)
+DB_REPLICAS = []
+DB_REPLICA_POOL_SIZE = 10
+DB_REPLICA_CHECK_INTERVAL = 5      # seconds between health checks, and before retrying a failed replica
+DB_REPLICA_MAX_LAG = None          # seconds; set to check SHOW REPLICA STATUS (needs REPLICATION CLIENT)
+DB_READ_YOUR_WRITES_WINDOW = 10    # seconds a session reads from the primary after it commits
+
+# Product images (images.py)
+IMAGE_FOLDER = 'static/images'
+IMAGE_VARIANTS = {'thumb': 400, 'large': 1200}   # longest side in px; each is written as JPEG and WebP
+IMAGE_JPEG_QUALITY = 85
+IMAGE_WEBP_QUALITY = 80
+IMAGE_CACHE_MAX_AGE = 31536000      # content-addressed names, so a year is safe
+IMAGE_WORKERS = 2                   # threads in `flask image-worker`
+IMAGE_JOB_VISIBILITY_TIMEOUT = 60
+IMAGE_JOB_MAX_ATTEMPTS = 3
+IMAGE_WORKER_POLL_INTERVAL = 1
+
+# Bulk product import (product_import.py)
+IMPORT_BATCH_SIZE = 1000            # rows per multi-row INSERT and per transaction
+IMPORT_MAX_ERRORS = 1000            # invalid rows reported before an import gives up
+
+# Order exports (order_export.py)
+EXPORT_FETCH_SIZE = 1000            # rows per fetch from the unbuffered cursor, and per response chunk
+EXPORT_NET_WRITE_TIMEOUT = 600      # seconds MySQL waits on a slow download before giving up
+EXPORT_POOL_SIZE = 2                # concurrent exports per process; keep < SERVER_THREADS
+EXPORT_POOL_TIMEOUT = 1             # seconds an export waits for a connection before a 503
+EXPORT_DB = None                    # DATABASE_CONFIG-style dict, e.g. one of DB_REPLICAS; None reads the primary
+
+# Production server (serve.py): prefork workers, each with a bounded thread pool
+SERVER_BIND = '127.0.0.1:8000'
+SERVER_WORKERS = 4                  # processes; roughly one or two per core
+SERVER_THREADS = 8                  # request threads per worker; keep <= DB_POOL_SIZE
+SERVER_BACKLOG = 2048
+SERVER_KEEPALIVE = 5                # seconds an idle keep-alive connection may hold a thread
+SERVER_GRACEFUL_TIMEOUT = 30        # seconds a stopping worker gets to finish in-flight requests
+SERVER_PAYMENT_WORKERS = 4          # payment worker threads run under the master; 0 to run them separately
+SERVER_IMAGE_WORKERS = 1            # image worker threads run under the master; 0 to run them separately
+
+# ASGI mode (asgi.py): the async routes share one aiomysql pool per process
+ASYNC_DB_POOL_SIZE = 20
+
+# Buyer catalog
+CATALOG_PAGE_SIZE = 24
+CATALOG_MAX_PAGE_SIZE = 100
+CATALOG_DESCRIPTION_CHARS = 160   # the grid only shows a short blurb
+SEARCH_MAX_PAGES = 50              # deep offset pages get expensive; nobody reads them
+
+# Buyer order history
+ORDERS_PAGE_SIZE = 20
+
+# Seller dashboard
+SELLER_ORDERS_PAGE_SIZE = 20
+
+# In-process catalog cache (see cache.py)
+PRODUCT_CACHE_SIZE = 5000
+PRODUCT_CACHE_TTL = 300     # seconds; upper bound on staleness if an invalidation is lost
+PAGE_CACHE_SIZE = 500
+PAGE_CACHE_TTL = 60
+CART_COUNT_CACHE_SIZE = 20000
+CART_COUNT_CACHE_TTL = 600
+RECOMMENDATIONS_CACHE_SIZE = 20000
+RECOMMENDATIONS_CACHE_TTL = 3600    # a rebuild invalidates them anyway
+CACHE_BUS_DIR = '/tmp/technest-cache-bus'   # None keeps invalidations process-local
+
+# Payment verification queue (see payment_worker.py)
+PAYMENT_WORKERS = 4                  # threads in the `flask payment-worker` process
+PAYMENT_VERIFY_DELAY = 5             # simulated gateway round trip, seconds
+PAYMENT_JOB_VISIBILITY_TIMEOUT = 30  # a claimed job is retried if not finished in time
+PAYMENT_JOB_MAX_ATTEMPTS = 5
+PAYMENT_JOB_BACKOFF = 2              # seconds before the first retry, doubled each attempt
+PAYMENT_WORKER_POLL_INTERVAL = 0.5
+
+# "Frequently bought together" (see recommendations.py)
+RECOMMENDATIONS_TOP_N = 20          # neighbours kept per product
+RECOMMENDATIONS_MIN_ORDERS = 2      # orders a pair must share before it counts
+RECOMMENDATIONS_WINDOW_DAYS = 365   # order history each build reads
+RECOMMENDATIONS_SHOWN = 6           # products shown on the cart and product views
+
+# Stock reservations (see inventory.py)
+STOCK_RESERVATION_TIMEOUT = 600           # seconds a checkout holds stock while its payment is unsettled
+STOCK_RESERVATION_SWEEP_INTERVAL = 10     # how often the payment worker returns expired reservations
+
+# Payment state store (see payment_store.py)
+PAYMENT_STORE_BACKEND = 'memory'    # 'sqlite' to share state between workers on one host
+PAYMENT_STORE_PATH = '/tmp/technest-payments.sqlite3'
+PAYMENT_STORE_MAXSIZE = 10000
+PAYMENT_STORE_TTL = 3600            # seconds; payment_jobs still has the full history
+
+# /payment_events server-sent events
+PAYMENT_EVENTS_TIMEOUT = 120        # close the stream after this long; the client reconnects
+PAYMENT_EVENTS_KEEPALIVE = 15       # comment line to keep proxies from dropping an idle stream
+PAYMENT_EVENTS_POLL_INTERVAL = 2    # batched fallback check in case a notification is lost
+
+# /metrics and the slow query log (see metrics.py)
+METRICS_TOKEN = None                # set to require `Authorization: Bearer <token>` on /metrics
+SLOW_QUERY_LOG = False              # log statements slower than the threshold with their EXPLAIN plan
+SLOW_QUERY_THRESHOLD_MS = 200
+
 SECRET_KEY = 'supersecretkey'
 RAZORPAY_KEY_ID = 'your_razorpay_key_id'
 RAZORPAY_KEY_SECRET = 'your_razorpay_key_secret'
\ No newline at end of file
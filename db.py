@@ -1,5 +1,295 @@
+import functools
+import itertools
+import threading
+import time
+
 import mysql.connector
-from config import DATABASE_CONFIG
+from mysql.connector import pooling
+from flask import g, has_app_context, has_request_context, request, session
+
+from config import (DATABASE_CONFIG, DB_BACKEND, DB_POOL_NAME, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+                    SQLITE_PATH, DB_REPLICAS, DB_REPLICA_POOL_SIZE, DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_MAX_LAG,
+                    DB_READ_YOUR_WRITES_WINDOW, EXPORT_DB, EXPORT_POOL_SIZE, EXPORT_POOL_TIMEOUT)
+import metrics
+from sqlite_backend import SQLitePool
+
+BACKENDS = ('mysql', 'sqlite')
+
+
+class PoolTimeout(mysql.connector.errors.PoolError):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT"""
+
+
+class PooledConnection:
+    """Thin proxy around a pooled connection; close() hands it back to the pool.
+
+    A request's shared connection ignores close() until release_db_connection
+    returns it at teardown, so a helper that closes it can't pull it out from
+    under the view's open transaction.
+    """
+
+    def __init__(self, conn, pool, wait):
+        self._conn = conn
+        self._pool = pool
+        self.wait = wait
+        self.closed = False
+        self.shared = False
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = metrics.TimedCursor(self._conn.cursor(*args, **kwargs), self._conn)
+        self._cursors.append(cursor)
+        return cursor
+
+    def commit(self):
+        self._conn.commit()
+        if not self._pool.replica and has_request_context():
+            g.db_committed = True
+
+    def close(self):
+        if self.closed or self.shared:
+            return
+        self.closed = True
+        try:
+            # Cursors are rarely closed explicitly; record their last statement now
+            for cursor in self._cursors:
+                cursor.flush()
+            self._cursors = []
+            self._conn.close()
+        finally:
+            self._pool.release()
+
+
+class ConnectionPool:
+    """Bounded connection pool with blocking borrow and wait-time stats"""
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, pre_ping=DB_POOL_PRE_PING, backend=DB_BACKEND,
+                 name=DB_POOL_NAME, replica=False, **config):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown DB_BACKEND {backend!r}; expected one of {list(BACKENDS)}")
+        self.backend = backend
+        self.name = name
+        self.replica = replica
+        self.size = size
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self._config = config or DATABASE_CONFIG
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'borrowed': 0,
+            'in_use': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    def _get_pool(self):
+        # Created lazily so importing this module never opens a socket
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None and self.backend == 'sqlite':
+                    self._pool = SQLitePool(self._config.get('path', SQLITE_PATH), size=self.size)
+                elif self._pool is None:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=self.name,
+                        pool_size=self.size,
+                        pool_reset_session=True,
+                        **self._config
+                    )
+        return self._pool
+
+    def get_connection(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        wait = time.perf_counter() - start
+
+        try:
+            conn = self._get_pool().get_connection()
+            if self.pre_ping and not conn.is_connected():
+                conn.reconnect(attempts=2, delay=0)
+                with self._stats_lock:
+                    self._stats['reconnects'] += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._stats['borrowed'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_total'] += wait
+            self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+        metrics.pool_wait.observe((), wait)
+        return PooledConnection(conn, self, wait)
+
+    def release(self):
+        with self._stats_lock:
+            self._stats['in_use'] -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['wait_avg'] = stats['wait_total'] / stats['borrowed'] if stats['borrowed'] else 0.0
+        return stats
+
+
+class Replica:
+    """One replica's pool plus its health: a failed borrow or check benches it for a while"""
+
+    def __init__(self, index, config):
+        self.name = config.get('path') or f"{config.get('host', 'localhost')}:{config.get('port', 3306)}"
+        self.pool = ConnectionPool(size=DB_REPLICA_POOL_SIZE, name=f'{DB_POOL_NAME}_replica{index}', replica=True,
+                                   **config)
+        self.healthy = True
+        self.checked_at = 0.0
+        self.failures = 0
+        self.lag = None
+
+
+class ReplicaRouter:
+    """Round-robin over healthy replicas; returns None when there is none to use"""
+
+    def __init__(self, configs, check_interval=DB_REPLICA_CHECK_INTERVAL, max_lag=DB_REPLICA_MAX_LAG):
+        self.replicas = [Replica(i, config) for i, config in enumerate(configs)]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            now = time.monotonic()
+            if not replica.healthy and now - replica.checked_at < self.check_interval:
+                continue
+            try:
+                conn = replica.pool.get_connection()
+            except PoolTimeout:
+                continue    # busy, not broken
+            except mysql.connector.Error as e:
+                self._mark(replica, False, error=e)
+                continue
+            if now - replica.checked_at >= self.check_interval and not self._check(replica, conn):
+                conn.close()
+                continue
+            return conn
+        return None
+
+    def _check(self, replica, conn):
+        """Connectivity, and replication lag when DB_REPLICA_MAX_LAG is set (MySQL only)"""
+        try:
+            cursor = conn.cursor(dictionary=True)
+            if self.max_lag is not None and replica.pool.backend == 'mysql':
+                cursor.execute("SHOW REPLICA STATUS")
+                status = cursor.fetchone() or {}
+                replica.lag = status.get('Seconds_Behind_Source')
+                # NULL lag means replication is stopped or broken
+                healthy = replica.lag is not None and replica.lag <= self.max_lag
+            else:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                healthy = True
+        except mysql.connector.Error as e:
+            self._mark(replica, False, error=e)
+            return False
+        self._mark(replica, healthy, error=None if healthy else f"lag {replica.lag}")
+        return healthy
+
+    def _mark(self, replica, healthy, error=None):
+        with self._lock:
+            if replica.healthy and not healthy:
+                print(f"Replica {replica.name} taken out of rotation: {error}")
+            elif healthy and not replica.healthy:
+                print(f"Replica {replica.name} back in rotation")
+            replica.healthy = healthy
+            replica.checked_at = time.monotonic()
+            replica.failures += 0 if healthy else 1
+
+    def stats(self):
+        return {replica.name: dict(replica.pool.stats(), healthy=replica.healthy, failures=replica.failures,
+                                   lag=replica.lag)
+                for replica in self.replicas}
+
+
+pool = ConnectionPool()
+router = ReplicaRouter(DB_REPLICAS)
+# Exports hold a connection for the whole download, so they get their own few and never drain the request pool
+export_pool = ConnectionPool(size=EXPORT_POOL_SIZE, timeout=EXPORT_POOL_TIMEOUT, name=f'{DB_POOL_NAME}_export',
+                             replica=bool(EXPORT_DB), **(EXPORT_DB or {}))
+
+
+def replica_reads(view):
+    """GET requests to this view may read from a replica, unless this session wrote recently"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if (request.method in ('GET', 'HEAD') and router.replicas
+                and time.time() >= session.get('db_primary_until', 0)):
+            g.db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def get_db_connection(primary=False):
+    """Borrow a pooled connection; inside a request it is reused and returned at teardown.
+
+    In a replica_reads view the connection comes from a replica unless
+    `primary` is set; cache fills pass it so a lagging replica can't be cached.
+    """
+    if not has_app_context():
+        return pool.get_connection()
+
+    if not primary and g.get('db_use_replica'):
+        conn = g.get('_db_replica_conn')
+        if conn is None or conn.closed:
+            conn = router.get_connection()
+            if conn is not None:
+                conn.shared = True
+                g._db_replica_conn = conn
+                g.db_pool_wait = g.get('db_pool_wait', 0.0) + conn.wait
+                return conn
+        else:
+            return conn
+
+    conn = g.get('_db_conn')
+    if conn is None or conn.closed:
+        conn = pool.get_connection()
+        conn.shared = True
+        g._db_conn = conn
+        g.db_pool_wait = g.get('db_pool_wait', 0.0) + conn.wait
+    return conn
+
+
+def release_db_connection(exc=None):
+    for key in ('_db_conn', '_db_replica_conn'):
+        conn = g.pop(key, None)
+        if conn is not None and not conn.closed:
+            conn.shared = False
+            if exc is not None:
+                try:
+                    conn.rollback()
+                except mysql.connector.Error:
+                    pass
+            conn.close()
+
+
+def remember_writes(response):
+    """Read your writes: a session that just committed reads from the primary for a while"""
+    if g.get('db_committed') and router.replicas:
+        session['db_primary_until'] = time.time() + DB_READ_YOUR_WRITES_WINDOW
+    return response
+
 
-def get_db_connection():
-    return mysql.connector.connect(**DATABASE_CONFIG)
\ No newline at end of file
+def init_app(app):
+    app.after_request(remember_writes)
+    app.teardown_appcontext(release_db_connection)
@@ -0,0 +1,45 @@
+"""ULID-style identifiers: 48-bit millisecond timestamp + 80 random bits.
+
+They sort by creation time, so inserts land at the end of an index, and
+are unique across processes without coordination. Within one process ids
+are strictly increasing even when several are made in the same millisecond.
+"""
+import os
+import threading
+import time
+
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'   # Crockford base32
+RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_state = {'pid': None, 'ms': 0, 'random': 0}
+
+
+def _encode(value):
+    chars = []
+    for _ in range(26):
+        chars.append(ENCODING[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_id(prefix=''):
+    with _lock:
+        ms = int(time.time() * 1000)
+        # A forked child inherits the parent's counter; start it afresh
+        if _state['pid'] != os.getpid() or ms > _state['ms']:
+            _state['pid'] = os.getpid()
+            _state['ms'] = ms
+            _state['random'] = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+        else:
+            # Same (or earlier, if the clock stepped back) millisecond: keep increasing
+            _state['random'] += 1
+            if _state['random'] >> RANDOM_BITS:
+                _state['ms'] += 1
+                _state['random'] = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big') >> 1
+        value = (_state['ms'] << RANDOM_BITS) | _state['random']
+    return prefix + _encode(value)
+
+
+def new_payment_id():
+    return new_id('payment_')
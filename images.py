@@ -0,0 +1,411 @@
+"""Product images: content-addressed originals plus resized JPEG/WebP variants.
+
+The request only spools an upload: one plain copy to incoming/ and an
+`image_uploads` row holding the product position it goes to. `flask
+image-worker` (or serve.py) ingests spooled uploads first: it hashes each
+one, stores it once as originals/<sha256>.<ext> however many products or
+sellers upload it, and adds the `images` row (status 'pending') and the
+product's `product_images` row. It then claims pending images with a lease,
+like the payment queue, and writes variants/<sha256>-<variant>.<ext> for
+each IMAGE_VARIANTS size, in JPEG and WebP, listed in `image_variants`.
+Pages show an image once it is ingested, the original until the thumbnail
+is ready; the worker invalidates the products' cache tags at each step.
+
+Ingestion and garbage collection both hold the `images` row lock while
+they check for, place or delete an original, so GC can't remove a file
+that an upload of the same bytes has just deduplicated against.
+
+File names change whenever content does, so /images/ responses are
+cacheable forever (see the route in app.py). Only the worker needs Pillow.
+"""
+import hashlib
+import os
+import shutil
+import signal
+import threading
+import time
+
+from db import get_db_connection
+from cache import invalidate, product_tag
+from ids import new_id
+from config import (IMAGE_FOLDER, IMAGE_VARIANTS, IMAGE_JPEG_QUALITY, IMAGE_WEBP_QUALITY,
+                    IMAGE_JOB_VISIBILITY_TIMEOUT, IMAGE_JOB_MAX_ATTEMPTS, IMAGE_WORKER_POLL_INTERVAL)
+
+INCOMING = os.path.join(IMAGE_FOLDER, 'incoming')
+ORIGINALS = os.path.join(IMAGE_FOLDER, 'originals')
+VARIANTS = os.path.join(IMAGE_FOLDER, 'variants')
+URL_PREFIX = '/images/'
+LEGACY_URL_PREFIX = '/static/images/'
+
+
+# ------------------- UPLOADS ------------------- #
+
+def spool_upload(stream, ext, chunk_size=1 << 20):
+    """Copy an upload to incoming/ as is; returns the spool file name"""
+    os.makedirs(INCOMING, exist_ok=True)
+    ext = 'jpg' if ext.lower() == 'jpeg' else ext.lower()
+    filename = f"{new_id()}.{ext}"
+    with open(os.path.join(INCOMING, filename), 'wb') as f:
+        shutil.copyfileobj(stream, f, chunk_size)
+    return filename
+
+
+def add_product_images(cursor, product_id, uploads):
+    """Spool uploads and queue them after the product's images in the caller's transaction.
+
+    cursor is a dictionary cursor; uploads is a list of (stream, ext). Returns how many were added.
+    """
+    # After both the stored images and those still waiting for the worker
+    cursor.execute("""
+        SELECT COALESCE(MAX(position) + 1, 0) AS next FROM (
+            SELECT position FROM product_images WHERE product_id = %s
+            UNION ALL
+            SELECT position FROM image_uploads WHERE product_id = %s
+        ) positions
+    """, (product_id, product_id))
+    position = cursor.fetchone()['next']
+    rows = [(product_id, position + i, spool_upload(stream, ext)) for i, (stream, ext) in enumerate(uploads)]
+    if rows:
+        cursor.executemany("INSERT INTO image_uploads (product_id, position, filename) VALUES (%s, %s, %s)", rows)
+    return len(rows)
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def claim_upload(conn):
+    """Lease the oldest spooled upload, or return None when there is none"""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT id, product_id, position, filename FROM image_uploads
+        WHERE locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP(3)
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """)
+    upload = cursor.fetchone()
+    if upload:
+        cursor.execute("""
+            UPDATE image_uploads SET locked_until = CURRENT_TIMESTAMP(3) + INTERVAL %s SECOND WHERE id = %s
+        """, (IMAGE_JOB_VISIBILITY_TIMEOUT, upload['id']))
+    conn.commit()
+    return upload
+
+
+def ingest_upload(conn):
+    """Hash one spooled upload into originals/ and the product's images; returns False when none is waiting"""
+    upload = claim_upload(conn)
+    if upload is None:
+        return False
+    spool = os.path.join(INCOMING, upload['filename'])
+    cursor = conn.cursor()
+    if not os.path.exists(spool):
+        print(f"Upload {upload['filename']} is missing from {INCOMING}; dropping it")
+        cursor.execute("DELETE FROM image_uploads WHERE id = %s", (upload['id'],))
+        conn.commit()
+        return True
+
+    # Hashing reads the whole file, so it runs before the transaction
+    content_hash, size = hash_file(spool)
+    ext = upload['filename'].rsplit('.', 1)[1]
+    try:
+        cursor.execute("DELETE FROM image_uploads WHERE id = %s", (upload['id'],))
+        if cursor.rowcount == 0:
+            conn.rollback()     # the product was deleted meanwhile
+            os.remove(spool)
+            return True
+        cursor.execute("INSERT IGNORE INTO images (content_hash, ext, bytes) VALUES (%s, %s, %s)",
+                       (content_hash, ext, size))
+        # Same bytes stored before: keep the first row and whatever variants it already has. Under
+        # this row lock collect_garbage can't be deleting the original while we decide to reuse it.
+        cursor.execute("SELECT ext FROM images WHERE content_hash = %s FOR UPDATE", (content_hash,))
+        ext = cursor.fetchone()[0]
+        path = os.path.join(ORIGINALS, f"{content_hash}.{ext}")
+        if not os.path.exists(path):
+            os.makedirs(ORIGINALS, exist_ok=True)
+            os.replace(spool, path)
+        # A fresh mtime keeps the untracked-file sweep in collect_garbage off it until we commit
+        os.utime(path)
+        cursor.execute("INSERT INTO product_images (product_id, position, content_hash) VALUES (%s, %s, %s)",
+                       (upload['product_id'], upload['position'], content_hash))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if os.path.exists(spool):
+        os.remove(spool)
+    invalidate(product_tag(upload['product_id']))
+    return True
+
+
+# ------------------- READS ------------------- #
+
+def product_images_query(product_ids):
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    return f"""
+        SELECT pi.product_id, i.content_hash, i.ext, i.status
+        FROM product_images pi
+        JOIN images i ON i.content_hash = pi.content_hash
+        WHERE pi.product_id IN ({placeholders})
+        ORDER BY pi.product_id, pi.position
+    """, list(product_ids)
+
+
+def image_urls(content_hash, ext, status):
+    urls = {'original': f"{URL_PREFIX}originals/{content_hash}.{ext}"}
+    if status == 'ready':
+        for variant in IMAGE_VARIANTS:
+            urls[variant] = f"{URL_PREFIX}variants/{content_hash}-{variant}.jpg"
+            urls[f"{variant}_webp"] = f"{URL_PREFIX}variants/{content_hash}-{variant}.webp"
+    return urls
+
+
+def attach_images(products, rows):
+    """Set images, image_url and image_webp_url on each product from product_images_query rows"""
+    by_product = {}
+    for row in rows:
+        by_product.setdefault(row['product_id'], []).append(
+            image_urls(row['content_hash'], row['ext'], row['status']))
+    for product in products:
+        images = by_product.get(product['id'])
+        if images is None and product.get('image'):
+            # Uploaded before the pipeline; `flask images-import-legacy` moves these over
+            images = [{'original': LEGACY_URL_PREFIX + name} for name in product['image'].split(',')]
+        product['images'] = images or []
+        first = product['images'][0] if product['images'] else {}
+        product['image_url'] = first.get('thumb', first.get('original'))
+        product['image_webp_url'] = first.get('thumb_webp')
+    return products
+
+
+def load_images(cursor, products):
+    """attach_images with the lookup on the caller's cursor; one query per page"""
+    if products:
+        cursor.execute(*product_images_query([product['id'] for product in products]))
+        attach_images(products, cursor.fetchall())
+    return products
+
+
+# ------------------- VARIANTS ------------------- #
+
+def render_variants(content_hash, ext):
+    """Write every variant of one original; returns image_variants rows and the original's size"""
+    from PIL import Image, ImageOps
+
+    os.makedirs(VARIANTS, exist_ok=True)
+    rows = []
+    with Image.open(os.path.join(ORIGINALS, f"{content_hash}.{ext}")) as original:
+        original = ImageOps.exif_transpose(original)
+        size = original.size
+        for variant, longest_side in IMAGE_VARIANTS.items():
+            resized = original.copy()
+            resized.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            flattened = resized
+            if resized.mode in ('RGBA', 'LA', 'P'):
+                resized = resized.convert('RGBA')
+                flattened = Image.new('RGB', resized.size, 'white')
+                flattened.paste(resized, mask=resized.getchannel('A'))
+            for image, fmt, suffix, options in (
+                    (flattened.convert('RGB'), 'JPEG', 'jpg', {'quality': IMAGE_JPEG_QUALITY, 'optimize': True,
+                                                               'progressive': True}),
+                    (resized, 'WEBP', 'webp', {'quality': IMAGE_WEBP_QUALITY, 'method': 6})):
+                filename = f"{content_hash}-{variant}.{suffix}"
+                path = os.path.join(VARIANTS, filename)
+                tmp = f"{path}.tmp{os.getpid()}"
+                image.save(tmp, fmt, **options)
+                os.replace(tmp, path)
+                name = variant if suffix == 'jpg' else f"{variant}_webp"
+                rows.append((content_hash, name, filename, f"image/{'jpeg' if suffix == 'jpg' else 'webp'}",
+                             image.width, image.height, os.path.getsize(path)))
+    return rows, size
+
+
+def claim_image(conn):
+    """Lease the next pending image, or return None when there is none"""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT content_hash, ext, attempts FROM images
+        WHERE status IN ('pending', 'processing')
+          AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP(3))
+        ORDER BY created_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """)
+    image = cursor.fetchone()
+    if image:
+        cursor.execute("""
+            UPDATE images
+            SET status = 'processing', attempts = attempts + 1,
+                locked_until = CURRENT_TIMESTAMP(3) + INTERVAL %s SECOND
+            WHERE content_hash = %s
+        """, (IMAGE_JOB_VISIBILITY_TIMEOUT, image['content_hash']))
+        image['attempts'] += 1
+    conn.commit()
+    return image
+
+
+def finish_image(conn, image, rows=(), size=(None, None), error=None):
+    cursor = conn.cursor()
+    if error is None:
+        cursor.executemany("""
+            INSERT INTO image_variants (content_hash, variant, filename, mime_type, width, height, bytes)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE filename = VALUES(filename), width = VALUES(width),
+                                    height = VALUES(height), bytes = VALUES(bytes)
+        """, rows)
+        status = 'ready'
+    else:
+        status = 'failed' if image['attempts'] >= IMAGE_JOB_MAX_ATTEMPTS else 'pending'
+    cursor.execute("""
+        UPDATE images
+        SET status = %s, width = COALESCE(%s, width), height = COALESCE(%s, height),
+            last_error = %s, locked_until = NULL
+        WHERE content_hash = %s
+    """, (status, size[0], size[1], error, image['content_hash']))
+    cursor.execute("SELECT product_id FROM product_images WHERE content_hash = %s", (image['content_hash'],))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    if status == 'ready':
+        # Cached pages and products still point at the original
+        invalidate(*(product_tag(product_id) for product_id in product_ids))
+    return status
+
+
+def work(stop):
+    while not stop.is_set():
+        conn = get_db_connection()
+        try:
+            if ingest_upload(conn):
+                continue
+            image = claim_image(conn)
+            if image is None:
+                stop.wait(IMAGE_WORKER_POLL_INTERVAL)
+                continue
+            start = time.perf_counter()
+            try:
+                rows, size = render_variants(image['content_hash'], image['ext'])
+            except Exception as e:
+                status = finish_image(conn, image, error=str(e)[:255])
+                print(f"Image {image['content_hash'][:12]} attempt {image['attempts']} failed ({status}): {e}")
+            else:
+                finish_image(conn, image, rows, size)
+                print(f"Image {image['content_hash'][:12]}: {len(rows)} variants "
+                      f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except Exception as e:
+            # The lease expires and another worker retries it
+            print(f"Image worker error: {e}")
+            stop.wait(IMAGE_WORKER_POLL_INTERVAL)
+        finally:
+            conn.close()
+
+
+def run_image_workers(concurrency):
+    """Render variants on a fixed pool of threads until SIGINT/SIGTERM; in-flight images finish first"""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    threads = [threading.Thread(target=work, args=(stop,), name=f"image-worker-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    print(f"Image worker pool started with {concurrency} threads")
+    for thread in threads:
+        thread.join()
+    print("Image worker pool stopped")
+
+
+# ------------------- MAINTENANCE ------------------- #
+
+def import_legacy_images():
+    """Queue products.image file lists for the image worker; returns (products, images) queued"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT id, image FROM products p
+        WHERE image IS NOT NULL AND image <> ''
+          AND NOT EXISTS (SELECT 1 FROM product_images pi WHERE pi.product_id = p.id)
+          AND NOT EXISTS (SELECT 1 FROM image_uploads u WHERE u.product_id = p.id)
+    """)
+    products = cursor.fetchall()
+    imported = 0
+    for product in products:
+        uploads = []
+        for name in product['image'].split(','):
+            path = os.path.join(IMAGE_FOLDER, name)
+            if '.' in name and os.path.isfile(path):
+                uploads.append((open(path, 'rb'), name.rsplit('.', 1)[1]))
+        try:
+            imported += add_product_images(cursor, product['id'], uploads)
+        finally:
+            for stream, _ in uploads:
+                stream.close()
+        conn.commit()
+    conn.close()
+    invalidate(*(product_tag(product['id']) for product in products))
+    return len(products), imported
+
+
+def collect_garbage(min_age=3600):
+    """Delete images no product uses any more, with their files, and untracked uploads; returns how many"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT content_hash, ext FROM images i
+        WHERE created_at < CURRENT_TIMESTAMP(3) - INTERVAL %s SECOND
+          AND NOT EXISTS (SELECT 1 FROM product_images pi WHERE pi.content_hash = i.content_hash)
+    """, (min_age,))
+    orphans = cursor.fetchall()
+    deleted = 0
+    for image in orphans:
+        # Check again under the row lock ingest_upload takes before it reuses an original
+        cursor.execute("SELECT content_hash FROM images WHERE content_hash = %s FOR UPDATE", (image['content_hash'],))
+        locked = cursor.fetchone()
+        cursor.execute("SELECT 1 FROM product_images WHERE content_hash = %s LIMIT 1", (image['content_hash'],))
+        if locked is None or cursor.fetchone():
+            conn.rollback()     # deleted, or uploaded again, since the scan
+            continue
+        cursor.execute("SELECT filename FROM image_variants WHERE content_hash = %s", (image['content_hash'],))
+        paths = [os.path.join(VARIANTS, row['filename']) for row in cursor.fetchall()]
+        paths.append(os.path.join(ORIGINALS, f"{image['content_hash']}.{image['ext']}"))
+        cursor.execute("DELETE FROM images WHERE content_hash = %s", (image['content_hash'],))
+        # Files go before the commit releases the lock; an ingest waiting on it then stores the original afresh
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        conn.commit()
+        deleted += 1
+
+    # Originals from ingests that rolled back never got a row; spooled uploads whose request rolled
+    # back never got an image_uploads row
+    cutoff = time.time() - min_age
+    for folder, query in (
+            (ORIGINALS, "SELECT content_hash AS name FROM images WHERE content_hash IN ({})"),
+            (INCOMING, "SELECT filename AS name FROM image_uploads WHERE filename IN ({})")):
+        if not os.path.isdir(folder):
+            continue
+        files = {name if folder == INCOMING else name.split('.', 1)[0]: name for name in os.listdir(folder)
+                 if not name.startswith('.') and os.path.getmtime(os.path.join(folder, name)) < cutoff}
+        keys = list(files)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            cursor.execute(query.format(', '.join(['%s'] * len(chunk))), chunk)
+            known = {row['name'] for row in cursor.fetchall()}
+            for key in set(chunk) - known:
+                path = os.path.join(folder, files[key])
+                # ingest_upload refreshes the mtime of an original it is about to commit
+                if os.path.exists(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    deleted += 1
+    conn.close()
+    return deleted
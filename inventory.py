@@ -0,0 +1,123 @@
+"""Stock levels and checkout reservations.
+
+products.stock is the number of units still free to reserve; NULL means the
+product isn't stock-tracked and never sells out. /process_payment reserves
+the cart's tracked lines in the transaction that queues the payment, with
+one conditional decrement per product:
+
+    UPDATE products SET stock = stock - %s WHERE id = %s AND stock >= %s
+
+A sold-out product matches no row, so stock can't go negative and there is
+no SELECT ... FOR UPDATE to queue behind. The decrements run last, just
+before the commit, so a hot product's row lock is held for one statement's
+worth of time. stock_reservations records what each payment took.
+create_order settles it into the order (taking or returning the difference
+if the cart changed meanwhile); a failed payment, or one not settled within
+STOCK_RESERVATION_TIMEOUT, puts the stock back.
+"""
+from db import get_db_connection
+from config import STOCK_RESERVATION_TIMEOUT
+
+
+class OutOfStock(Exception):
+    """A cart line wants more units than are left"""
+
+    def __init__(self, item):
+        self.item = item
+        super().__init__(f"Not enough stock left for {item['name']}")
+
+
+def take_stock(cursor, product_id, quantity):
+    cursor.execute("UPDATE products SET stock = stock - %s WHERE id = %s AND stock >= %s",
+                   (quantity, product_id, quantity))
+    return cursor.rowcount == 1
+
+
+def return_stock(cursor, product_id, quantity):
+    # NULL + n stays NULL, so a product that stopped being tracked is left alone
+    cursor.execute("UPDATE products SET stock = stock + %s WHERE id = %s", (quantity, product_id))
+
+
+def reserve_stock(cursor, payment_id, items):
+    """Reserve the stock-tracked cart lines for payment_id in the caller's transaction.
+
+    items are dicts with product_id, quantity, stock and name. Raises
+    OutOfStock on the first line that can't be covered; roll back then.
+    """
+    # Product id order, so two carts sharing products can't deadlock
+    tracked = sorted((item for item in items if item['stock'] is not None), key=lambda item: item['product_id'])
+    if not tracked:
+        return
+    cursor.executemany("""
+        INSERT INTO stock_reservations (payment_id, product_id, quantity) VALUES (%s, %s, %s)
+    """, [(payment_id, item['product_id'], item['quantity']) for item in tracked])
+    for item in tracked:
+        if not take_stock(cursor, item['product_id'], item['quantity']):
+            raise OutOfStock(item)
+
+
+def take_reservation(cursor, payment_id):
+    """Remove payment_id's reservation in the caller's transaction; returns {product_id: quantity}"""
+    cursor.execute("""
+        SELECT product_id, quantity FROM stock_reservations WHERE payment_id = %s FOR UPDATE
+    """, (payment_id,))
+    reserved = {row['product_id']: row['quantity'] for row in cursor.fetchall()}
+    if reserved:
+        cursor.execute("DELETE FROM stock_reservations WHERE payment_id = %s", (payment_id,))
+    return reserved
+
+
+def settle_stock(cursor, payment_id, items):
+    """Turn payment_id's reservation into the stock sold for items; raises OutOfStock.
+
+    The reservation may no longer match the cart (edited after checkout) or
+    may be gone (it expired), so the difference is taken or returned here.
+    """
+    reserved = take_reservation(cursor, payment_id)
+    for item in sorted(items, key=lambda item: item['product_id']):
+        held = reserved.pop(item['product_id'], 0)
+        if item['stock'] is None:
+            continue
+        if item['quantity'] > held and not take_stock(cursor, item['product_id'], item['quantity'] - held):
+            raise OutOfStock(item)
+        if item['quantity'] < held:
+            return_stock(cursor, item['product_id'], held - item['quantity'])
+    # Reserved, then removed from the cart
+    for product_id, quantity in sorted(reserved.items()):
+        return_stock(cursor, product_id, quantity)
+
+
+def release_reservation(cursor, payment_id):
+    """Give payment_id's reserved stock back in the caller's transaction"""
+    reserved = take_reservation(cursor, payment_id)
+    for product_id, quantity in sorted(reserved.items()):
+        return_stock(cursor, product_id, quantity)
+    return sum(reserved.values())
+
+
+def release_expired(timeout=STOCK_RESERVATION_TIMEOUT, limit=500):
+    """Release reservations older than timeout whose payment isn't being verified right now"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT DISTINCT r.payment_id
+            FROM stock_reservations r
+            WHERE r.created_at < CURRENT_TIMESTAMP(3) - INTERVAL %s SECOND
+              AND NOT EXISTS (
+                  SELECT 1 FROM payment_jobs j
+                  WHERE j.payment_id = r.payment_id AND j.status = 'running'
+                    AND j.locked_until >= CURRENT_TIMESTAMP(3)
+              )
+            LIMIT %s
+        """, (timeout, limit))
+        payment_ids = [row['payment_id'] for row in cursor.fetchall()]
+        units = 0
+        for payment_id in payment_ids:
+            units += release_reservation(cursor, payment_id)
+            conn.commit()
+        if payment_ids:
+            print(f"Released {units} units of stock from {len(payment_ids)} expired reservations")
+        return len(payment_ids)
+    finally:
+        conn.close()
@@ -0,0 +1,234 @@
+"""Request and SQL latency metrics in Prometheus text format.
+
+Per process: with several workers each one serves its own /metrics, which
+Prometheus scrapes and sums like any multi-process target.
+"""
+import logging
+import re
+import threading
+import time
+
+from flask import g, request
+
+from config import SLOW_QUERY_LOG, SLOW_QUERY_THRESHOLD_MS
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('technest.slow_query')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+request_latency = Histogram('technest_http_request_duration_seconds',
+                            'Time to produce a response, by endpoint.', ('endpoint', 'method', 'status'))
+sql_latency = Histogram('technest_sql_statement_duration_seconds',
+                        'Time spent executing and fetching a SQL statement.', ('statement',))
+sql_rows = Counter('technest_sql_rows_total', 'Rows returned or affected, by SQL statement.', ('statement',))
+pool_wait = Histogram('technest_db_pool_wait_seconds', 'Time spent waiting to borrow a pooled connection.')
+slow_queries = Counter('technest_sql_slow_queries_total', 'Statements slower than SLOW_QUERY_THRESHOLD_MS.',
+                       ('statement',))
+metrics = [request_latency, sql_latency, sql_rows, pool_wait, slow_queries]
+
+# Callables returning {metric name: (type, help, value or {labels tuple: value}, labelnames)}
+collectors = []
+
+
+# ------------------- SQL TIMING ------------------- #
+
+_whitespace = re.compile(r'\s+')
+_in_list = re.compile(r'IN \((?:%s, )*%s\)', re.IGNORECASE)
+
+
+def statement_label(sql):
+    """Stable label for a statement: whitespace collapsed, IN lists folded, truncated"""
+    sql = _whitespace.sub(' ', sql).strip()
+    sql = _in_list.sub('IN (...)', sql)
+    return sql[:120]
+
+
+class TimedCursor:
+    """Cursor proxy that times each statement from execute() through its last fetch"""
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+        self._pending = None    # [label, sql, params, seconds, rows]
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _timed(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if self._pending is not None:
+                self._pending[3] += time.perf_counter() - start
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self.flush()
+        self._pending = [statement_label(operation), operation, params, 0.0, 0]
+        result = self._timed(self._cursor.execute, operation, params, *args, **kwargs)
+        if self._cursor.rowcount and self._cursor.rowcount > 0 and not self._cursor.with_rows:
+            self._pending[4] = self._cursor.rowcount
+        return result
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self.flush()
+        self._pending = [statement_label(operation), operation, None, 0.0, 0]
+        result = self._timed(self._cursor.executemany, operation, seq_params, *args, **kwargs)
+        self._pending[4] = max(self._cursor.rowcount or 0, 0)
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None and self._pending is not None:
+            self._pending[4] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._timed(self._cursor.fetchmany, *args, **kwargs)
+        if self._pending is not None:
+            self._pending[4] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        if self._pending is not None:
+            self._pending[4] += len(rows)
+        return rows
+
+    def close(self):
+        self.flush()
+        return self._cursor.close()
+
+    def flush(self):
+        """Record the statement in progress; called on the next execute and on connection close"""
+        if self._pending is None:
+            return
+        label, sql, params, seconds, rows = self._pending
+        self._pending = None
+        sql_latency.observe((label,), seconds)
+        sql_rows.inc((label,), rows)
+        if SLOW_QUERY_LOG and seconds * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            slow_queries.inc((label,))
+            self._log_slow(sql, params, seconds)
+
+    def _log_slow(self, sql, params, seconds):
+        plan = None
+        if sql.lstrip().upper().startswith('SELECT') and not self._conn.unread_result:
+            try:
+                cursor = self._conn.cursor(buffered=True, dictionary=True)
+                cursor.execute('EXPLAIN ' + sql, params)
+                plan = cursor.fetchall()
+                cursor.close()
+            except Exception as e:
+                plan = f"EXPLAIN failed: {e}"
+        slow_query_log.warning("Slow query (%.1f ms): %s\nEXPLAIN: %s",
+                               seconds * 1000, _whitespace.sub(' ', sql).strip(), plan)
+
+
+# ------------------- REQUEST TIMING ------------------- #
+
+def start_timer():
+    g._request_start = time.perf_counter()
+
+
+def record_request(response):
+    start = g.pop('_request_start', None)
+    if start is not None:
+        request_latency.observe((request.endpoint or 'unmatched', request.method, str(response.status_code)),
+                                time.perf_counter() - start)
+    return response
+
+
+def render():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in collectors:
+        try:
+            collected = collect()
+        except Exception as e:
+            lines.append(f"# collector {getattr(collect, '__name__', collect)} failed: {_escape(e)}")
+            continue
+        for name, (kind, help, value, labelnames) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(value, dict):
+                for labels, v in sorted(value.items()):
+                    lines.append(f"{name}{_labels(labelnames, labels)} {v}")
+            else:
+                lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(record_request)
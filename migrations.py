@@ -0,0 +1,463 @@
+"""Versioned schema migrations.
+
+Run them with `flask db-upgrade`; the app itself only checks the recorded
+version (one indexed read) the first time each worker serves a request.
+MySQL commits DDL implicitly, so a migration is not atomic: every step is
+written to be safe to re-run after a failure part-way through. On the
+SQLite backend DDL is transactional and each migration applies atomically.
+"""
+import time
+
+from flask import current_app
+
+from config import DB_BACKEND
+from db import get_db_connection
+from payment_worker import CREATE_TABLE_SQL as PAYMENT_JOBS_TABLE_SQL
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return register
+
+
+# ------------------- HELPERS ------------------- #
+
+def create_index(cursor, table, name, columns, kind='INDEX'):
+    """Add an index to an existing table unless it is already there"""
+    if DB_BACKEND == 'sqlite':
+        # A FULLTEXT index is an FTS5 table on SQLite (see sqlite_backend.py)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       (f"{table}_fts" if kind == 'FULLTEXT' else name,))
+    else:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+        """, (table, name))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({columns})")
+
+
+def add_column(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    if DB_BACKEND == 'sqlite':
+        cursor.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, column))
+    else:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            LIMIT 1
+        """, (table, column))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def table_exists(cursor, table):
+    if DB_BACKEND == 'sqlite':
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    else:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table,))
+    return cursor.fetchone() is not None
+
+
+# ------------------- MIGRATIONS ------------------- #
+
+@migration(1, 'initial schema')
+def initial_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            email VARCHAR(100) NOT NULL UNIQUE,
+            user_type ENUM('buyer', 'seller') NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            price DECIMAL(10,2) NOT NULL,
+            image VARCHAR(255),
+            seller_id INT NOT NULL,
+            category VARCHAR(50),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (seller_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cart (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_cart_item (user_id, product_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS addresses (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            full_name VARCHAR(100) NOT NULL,
+            phone VARCHAR(15) NOT NULL,
+            address TEXT NOT NULL,
+            city VARCHAR(50) NOT NULL,
+            state VARCHAR(50) NOT NULL,
+            pincode VARCHAR(10) NOT NULL,
+            is_default BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+
+
+@migration(2, 'catalog pagination and search indexes')
+def catalog_indexes(cursor):
+    create_index(cursor, 'products', 'idx_products_created', 'created_at, id')
+    create_index(cursor, 'products', 'ft_products_name_description', 'name, description', kind='FULLTEXT')
+
+
+@migration(3, 'cart summary')
+def cart_summary(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cart_summary (
+            user_id INT PRIMARY KEY,
+            item_count INT NOT NULL DEFAULT 0,
+            total_price DECIMAL(12,2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    # Backfill carts that predate cart_summary
+    cursor.execute("""
+        INSERT IGNORE INTO cart_summary (user_id, item_count, total_price)
+        SELECT c.user_id, SUM(c.quantity), SUM(c.quantity * p.price)
+        FROM cart c
+        JOIN products p ON c.product_id = p.id
+        GROUP BY c.user_id
+    """)
+
+
+@migration(4, 'payment jobs')
+def payment_jobs(cursor):
+    cursor.execute(PAYMENT_JOBS_TABLE_SQL)
+    add_column(cursor, 'payment_jobs', 'idempotency_key', 'VARCHAR(64) AFTER total')
+    create_index(cursor, 'payment_jobs', 'unique_payment_idempotency', 'user_id, idempotency_key', kind='UNIQUE')
+
+
+@migration(5, 'order headers and items')
+def order_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_headers (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            address_id INT,
+            payment_id VARCHAR(64) UNIQUE,
+            total DECIMAL(12,2) NOT NULL,
+            item_count INT NOT NULL,
+            payment_status ENUM('pending', 'paid', 'failed') DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (address_id) REFERENCES addresses(id) ON DELETE SET NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            order_id INT NOT NULL,
+            product_id INT NOT NULL,
+            seller_id INT,
+            quantity INT NOT NULL,
+            price DECIMAL(10,2) NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES order_headers(id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+    if not table_exists(cursor, 'orders'):
+        return
+
+    # The old orders table has no checkout id; rows written by one
+    # create_order call share user, address, status and created_at
+    cursor.execute("""
+        INSERT INTO order_headers (user_id, address_id, total, item_count, payment_status, created_at)
+        SELECT user_id, address_id, SUM(quantity * price), SUM(quantity), payment_status, created_at
+        FROM orders
+        GROUP BY user_id, address_id, payment_status, created_at
+    """)
+    cursor.execute("""
+        INSERT INTO order_items (order_id, product_id, quantity, price)
+        SELECT h.id, o.product_id, o.quantity, o.price
+        FROM orders o
+        JOIN order_headers h ON h.user_id = o.user_id AND h.address_id <=> o.address_id
+             AND h.payment_status = o.payment_status AND h.created_at = o.created_at
+        WHERE h.payment_id IS NULL
+        ORDER BY o.id
+    """)
+    cursor.execute("RENAME TABLE orders TO orders_legacy")
+
+
+@migration(6, 'seller sales rollups')
+def seller_rollups(cursor):
+    # Seller id copied onto each item so a seller's recent orders are one index range
+    add_column(cursor, 'order_items', 'seller_id', 'INT AFTER product_id')
+    cursor.execute("""
+        UPDATE order_items
+        SET seller_id = (SELECT p.seller_id FROM products p WHERE p.id = order_items.product_id)
+        WHERE seller_id IS NULL
+    """)
+    create_index(cursor, 'order_items', 'idx_order_items_seller', 'seller_id, id')
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS seller_daily_sales (
+            seller_id INT NOT NULL,
+            day DATE NOT NULL,
+            orders INT NOT NULL DEFAULT 0,
+            units INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (seller_id, day),
+            FOREIGN KEY (seller_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_daily_sales (
+            product_id INT NOT NULL,
+            day DATE NOT NULL,
+            seller_id INT NOT NULL,
+            units INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_id, day),
+            INDEX idx_product_daily_sales_seller (seller_id, day)
+        )
+    """)
+
+    # Backfill from existing orders unless an earlier run already did
+    cursor.execute("SELECT 1 FROM seller_daily_sales LIMIT 1")
+    if cursor.fetchone():
+        return
+    cursor.execute("""
+        INSERT INTO product_daily_sales (product_id, day, seller_id, units, revenue)
+        SELECT i.product_id, DATE(h.created_at), i.seller_id, SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        WHERE h.payment_status = 'paid' AND i.seller_id IS NOT NULL
+        GROUP BY i.product_id, DATE(h.created_at), i.seller_id
+    """)
+    cursor.execute("""
+        INSERT INTO seller_daily_sales (seller_id, day, orders, units, revenue)
+        SELECT i.seller_id, DATE(h.created_at), COUNT(DISTINCT h.id), SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        WHERE h.payment_status = 'paid' AND i.seller_id IS NOT NULL
+        GROUP BY i.seller_id, DATE(h.created_at)
+    """)
+
+
+@migration(7, 'order history index')
+def order_history_index(cursor):
+    create_index(cursor, 'order_headers', 'idx_order_headers_user_created', 'user_id, created_at, id')
+
+
+@migration(8, 'hot path indexes')
+def hot_path_indexes(cursor):
+    # Seller dashboard product list
+    create_index(cursor, 'products', 'idx_products_seller', 'seller_id')
+    # Category browsing with a price range
+    create_index(cursor, 'products', 'idx_products_category_price', 'category, price')
+    # Checkout address list, default first
+    create_index(cursor, 'addresses', 'idx_addresses_user_default', 'user_id, is_default')
+
+
+@migration(9, 'product image variants')
+def product_image_variants(cursor):
+    # One row per distinct upload, keyed by content; status doubles as the image worker's queue
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            content_hash CHAR(64) PRIMARY KEY,
+            ext VARCHAR(8) NOT NULL,
+            bytes INT NOT NULL,
+            width INT,
+            height INT,
+            status ENUM('pending', 'processing', 'ready', 'failed') NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            locked_until TIMESTAMP(3) NULL,
+            last_error VARCHAR(255),
+            created_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+            INDEX idx_images_claim (status, created_at)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_variants (
+            content_hash CHAR(64) NOT NULL,
+            variant VARCHAR(16) NOT NULL,
+            filename VARCHAR(100) NOT NULL,
+            mime_type VARCHAR(32) NOT NULL,
+            width INT NOT NULL,
+            height INT NOT NULL,
+            bytes INT NOT NULL,
+            PRIMARY KEY (content_hash, variant),
+            FOREIGN KEY (content_hash) REFERENCES images(content_hash) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_images (
+            product_id INT NOT NULL,
+            position INT NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            PRIMARY KEY (product_id, position),
+            INDEX idx_product_images_hash (content_hash),
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+            FOREIGN KEY (content_hash) REFERENCES images(content_hash)
+        )
+    """)
+
+
+@migration(10, 'order items by order')
+def order_items_by_order(cursor):
+    # Order history and the buyer export walk an order's lines in id order; on MySQL this
+    # replaces the implicit foreign key index, SQLite had no index on order_id at all
+    create_index(cursor, 'order_items', 'idx_order_items_order', 'order_id, id')
+
+
+@migration(11, 'stock and reservations')
+def stock_reservations(cursor):
+    # NULL: not stock-tracked, never sells out
+    add_column(cursor, 'products', 'stock', 'INT NULL AFTER price')
+    if DB_BACKEND == 'sqlite':
+        # Recreate the FTS update trigger so it only fires on name/description (see sqlite_backend.py)
+        cursor.execute("DROP TRIGGER IF EXISTS products_fts_update")
+        cursor.execute("ALTER TABLE products ADD FULLTEXT ft_products_name_description (name, description)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            payment_id VARCHAR(64) NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            created_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+            PRIMARY KEY (payment_id, product_id),
+            INDEX idx_stock_reservations_created (created_at),
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+
+
+@migration(12, 'product recommendations')
+def product_recommendations(cursor):
+    # Rebuilt by `flask build-recommendations`; see recommendations.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_recommendations (
+            product_id INT NOT NULL,
+            position SMALLINT NOT NULL,
+            recommended_id INT NOT NULL,
+            orders INT NOT NULL,
+            score FLOAT NOT NULL,
+            PRIMARY KEY (product_id, position),
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+            FOREIGN KEY (recommended_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+
+
+@migration(13, 'image upload spool')
+def image_upload_spool(cursor):
+    # Uploads waiting for the image worker to hash them into images/product_images; see images.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_uploads (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            product_id INT NOT NULL,
+            position INT NOT NULL,
+            filename VARCHAR(64) NOT NULL UNIQUE,
+            locked_until TIMESTAMP(3) NULL,
+            created_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+            INDEX idx_image_uploads_product (product_id, position),
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+
+
+LATEST_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+
+# ------------------- RUNNER ------------------- #
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(cursor):
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def upgrade(target=None, echo=print):
+    """Apply every migration above the recorded version, in order"""
+    target = LATEST_VERSION if target is None else target
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    try:
+        ensure_version_table(cursor)
+        version = current_version(cursor)
+        for number, name, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if number <= version or number > target:
+                continue
+            start = time.perf_counter()
+            func(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (number, name))
+            conn.commit()
+            echo(f"Applied {number:03d} {name} ({time.perf_counter() - start:.2f}s)")
+            version = number
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def schema_status():
+    """(recorded version, version this code expects)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if not table_exists(cursor, 'schema_migrations'):
+            return 0, LATEST_VERSION
+        return current_version(cursor), LATEST_VERSION
+    finally:
+        conn.close()
+
+
+_schema_ok = False
+
+
+def require_current_schema():
+    """Refuse to serve until `flask db-upgrade` has brought the schema up to date"""
+    global _schema_ok
+    if _schema_ok:
+        return None
+    version, latest = schema_status()
+    if version < latest:
+        current_app.logger.error(f"Database schema is at version {version}, this code needs {latest}")
+        return f"Database schema is out of date (version {version} of {latest}); run `flask db-upgrade`.", 503
+    _schema_ok = True
+    return None
+
+
+def init_app(app):
+    app.before_request(require_current_schema)
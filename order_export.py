@@ -0,0 +1,137 @@
+"""Streaming order exports as CSV or JSONL.
+
+Sellers export their order lines, buyers their order history, optionally
+limited to an order date range. The query runs on an unbuffered
+(server-side) cursor on a connection from db.export_pool, and rows are
+fetched EXPORT_FETCH_SIZE at a time, encoded and yielded as one chunk. Only
+one chunk is ever in memory, whatever the size of the export.
+
+A download holds its connection until it finishes, so exports are capped at
+EXPORT_POOL_SIZE per process; past that, stream_export raises PoolTimeout
+before the response starts.
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+
+import mysql.connector
+
+from config import EXPORT_FETCH_SIZE, EXPORT_NET_WRITE_TIMEOUT
+from db import export_pool
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+EXPORTS = {
+    # Walks idx_order_items_seller (seller_id, id)
+    'seller': ("""
+        SELECT i.id, i.order_id, h.created_at, h.payment_status, i.product_id, p.name,
+               i.quantity, i.price, i.quantity * i.price, u.username
+        FROM order_items i
+        JOIN order_headers h ON i.order_id = h.id
+        JOIN products p ON i.product_id = p.id
+        JOIN users u ON h.user_id = u.id
+        WHERE i.seller_id = %s{range_sql}
+        ORDER BY i.id
+    """, ['order_item_id', 'order_id', 'created_at', 'payment_status', 'product_id', 'product_name',
+          'quantity', 'price', 'item_total', 'buyer']),
+    # Walks idx_order_headers_user_created, then idx_order_items_order for each order's lines in id
+    # order; adding i.id to the ORDER BY would make MySQL sort the whole result first
+    'buyer': ("""
+        SELECT h.id, h.created_at, h.payment_status, h.total, i.product_id, p.name,
+               i.quantity, i.price, i.quantity * i.price
+        FROM order_headers h
+        JOIN order_items i ON i.order_id = h.id
+        JOIN products p ON i.product_id = p.id
+        WHERE h.user_id = %s{range_sql}
+        ORDER BY h.created_at, h.id
+    """, ['order_id', 'created_at', 'payment_status', 'order_total', 'product_id', 'product_name',
+          'quantity', 'price', 'item_total']),
+}
+
+
+def export_query(kind, owner_id, date_from=None, date_to=None):
+    """(query, params, columns) for one seller's or buyer's orders; date_to is inclusive"""
+    query, columns = EXPORTS[kind]
+    range_sql = ""
+    params = [owner_id]
+    if date_from:
+        range_sql += " AND h.created_at >= %s"
+        params.append(date_from)
+    if date_to:
+        range_sql += " AND h.created_at < %s"
+        params.append(date_to + timedelta(days=1))
+    return query.format(range_sql=range_sql), params, columns
+
+
+def export_filename(kind, fmt, date_from=None, date_to=None):
+    span = '_'.join(str(day) for day in (date_from, date_to) if day)
+    return f"{kind}_orders{'_' + span if span else ''}.{fmt}"
+
+
+# ------------------- ENCODERS ------------------- #
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_jsonl(columns, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows).encode()
+
+
+ENCODERS = {'csv': encode_csv, 'jsonl': encode_jsonl}
+
+
+# ------------------- STREAMING ------------------- #
+
+def release_connection(conn):
+    """Hand an export connection back; safe to call again once the response closes"""
+    if conn.closed:
+        return
+    if conn.unread_result:
+        # The client went away mid-export: drop the socket rather than read the rest of the result
+        conn.disconnect()
+    try:
+        conn.close()
+    except mysql.connector.Error:
+        pass    # the pool reconnects it on the next borrow
+
+
+def fetch_batches(conn, query, params, fetch_size=EXPORT_FETCH_SIZE):
+    """Yield lists of row tuples from an unbuffered cursor; releases conn when exhausted or closed"""
+    try:
+        cursor = conn.cursor(buffered=False)
+        if export_pool.backend == 'mysql':
+            # The server waits on us while the client downloads; don't let a slow client abort the query
+            cursor.execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        release_connection(conn)
+
+
+def stream_export(kind, owner_id, fmt, date_from=None, date_to=None, fetch_size=EXPORT_FETCH_SIZE):
+    """(chunks, conn): a generator of encoded chunks for a Response, and the connection it reads.
+
+    The connection is borrowed now rather than on the first chunk, so a full
+    export pool raises PoolTimeout while a 503 can still be sent. A generator
+    that never starts never runs its cleanup: release_connection(conn) when
+    the response closes.
+    """
+    query, params, columns = export_query(kind, owner_id, date_from, date_to)
+    conn = export_pool.get_connection()
+    return ENCODERS[fmt](columns, fetch_batches(conn, query, params, fetch_size)), conn
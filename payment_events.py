@@ -0,0 +1,119 @@
+"""Wakes /payment_events streams when a payment is verified.
+
+The payment worker publishes a payment tag on the cache bus as soon as a
+job finishes, which lands here through cache.subscribe. As a fallback, one
+thread per process checks every watched payment in a single query, so a
+lost notification costs at most PAYMENT_EVENTS_POLL_INTERVAL.
+
+Streams served by asgi.py wait on an asyncio.Event instead of a thread;
+notify() wakes those on their own event loop.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from db import get_db_connection
+from cache import subscribe
+from config import PAYMENT_EVENTS_POLL_INTERVAL
+
+
+class PaymentNotifier:
+
+    def __init__(self, poll_interval=PAYMENT_EVENTS_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._events = {}       # payment_id -> (Event, waiter count)
+        self._async_events = {}  # payment_id -> [(loop, asyncio.Event), ...]
+        self._watcher_pid = None
+
+    def wait(self, payment_id, timeout):
+        """Block until the payment is notified or the timeout passes; True if notified"""
+        self._start_watcher()
+        with self._lock:
+            event, waiters = self._events.get(payment_id, (threading.Event(), 0))
+            self._events[payment_id] = (event, waiters + 1)
+        try:
+            return event.wait(timeout)
+        finally:
+            with self._lock:
+                event, waiters = self._events[payment_id]
+                if waiters <= 1:
+                    del self._events[payment_id]
+                else:
+                    self._events[payment_id] = (event, waiters - 1)
+
+    async def wait_async(self, payment_id, timeout):
+        """wait() for coroutines: suspends instead of blocking a thread"""
+        self._start_watcher()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._async_events.setdefault(payment_id, []).append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._async_events[payment_id]
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._async_events[payment_id]
+
+    def notify(self, payment_id):
+        with self._lock:
+            entry = self._events.get(payment_id)
+            waiters = list(self._async_events.get(payment_id, ()))
+        if entry:
+            entry[0].set()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def watching(self):
+        with self._lock:
+            return len(self._events.keys() | self._async_events.keys())
+
+    def on_invalidate(self, tag):
+        if tag.startswith('payment:'):
+            self.notify(tag[len('payment:'):])
+
+    def _start_watcher(self):
+        if self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            threading.Thread(target=self._watch, daemon=True, name='payment-events').start()
+
+    def _watch(self, batch=500):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                payment_ids = list(self._events.keys() | self._async_events.keys())
+            for start in range(0, len(payment_ids), batch):
+                chunk = payment_ids[start:start + batch]
+                conn = None
+                try:
+                    conn = get_db_connection()
+                    cursor = conn.cursor()
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    cursor.execute(f"""
+                        SELECT payment_id FROM payment_jobs
+                        WHERE payment_id IN ({placeholders}) AND status IN ('paid', 'failed')
+                    """, chunk)
+                    finished = [row[0] for row in cursor.fetchall()]
+                except Exception as e:
+                    print(f"Payment events watcher error: {e}")
+                    continue
+                finally:
+                    if conn is not None:
+                        conn.close()
+                for payment_id in finished:
+                    self.notify(payment_id)
+
+
+notifier = PaymentNotifier()
+subscribe(notifier.on_invalidate)
+
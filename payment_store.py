@@ -0,0 +1,141 @@
+"""Short-lived payment state shared by process_payment, payment_page and check_payment.
+
+payment_jobs stays the durable record; this store keeps recent payment
+state close to the web workers. Two backends, picked by PAYMENT_STORE_BACKEND:
+
+- 'memory': per-process LRU with TTL; fine for a single worker.
+- 'sqlite': one SQLite file shared by every worker on the host, so a poll
+  routed to another worker still finds the payment.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import LRUCache
+from config import PAYMENT_STORE_BACKEND, PAYMENT_STORE_PATH, PAYMENT_STORE_MAXSIZE, PAYMENT_STORE_TTL
+
+
+class MemoryPaymentStore:
+
+    def __init__(self, maxsize=PAYMENT_STORE_MAXSIZE, ttl=PAYMENT_STORE_TTL):
+        self._cache = LRUCache('payment_state', maxsize, ttl)
+
+    def get(self, payment_id):
+        return self._cache.get(payment_id)
+
+    def set(self, payment_id, payment_data):
+        self._cache.set(payment_id, dict(payment_data))
+
+    def delete(self, payment_id):
+        self._cache.delete(payment_id)
+
+    def stats(self):
+        return dict(self._cache.stats(), backend='memory')
+
+
+class SQLitePaymentStore:
+
+    def __init__(self, path=PAYMENT_STORE_PATH, maxsize=PAYMENT_STORE_MAXSIZE, ttl=PAYMENT_STORE_TTL,
+                 prune_every=100):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def _conn(self):
+        # sqlite3 connections can't cross threads (or forks); one per thread per process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS payment_state (
+                    payment_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_state_expires ON payment_state (expires_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, payment_id):
+        row = self._conn().execute(
+            "SELECT data, expires_at FROM payment_state WHERE payment_id = ?", (payment_id,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(row[0])
+
+    def set(self, payment_id, payment_data):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO payment_state (payment_id, data, expires_at) VALUES (?, ?, ?)",
+            (payment_id, json.dumps(payment_data), time.time() + self.ttl)
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def delete(self, payment_id):
+        self._conn().execute("DELETE FROM payment_state WHERE payment_id = ?", (payment_id,))
+
+    def prune(self):
+        """Drop expired entries, then the soonest-to-expire ones beyond maxsize"""
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM payment_state WHERE expires_at < ?", (time.time(),)).rowcount
+        evicted = conn.execute("""
+            DELETE FROM payment_state WHERE payment_id IN (
+                SELECT payment_id FROM payment_state ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.maxsize,)).rowcount
+        self._count('expirations', max(expired, 0))
+        self._count('evictions', max(evicted, 0))
+
+    def stats(self):
+        size = self._conn().execute("SELECT COUNT(*) FROM payment_state").fetchone()[0]
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'size': size,
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+
+BACKENDS = {
+    'memory': MemoryPaymentStore,
+    'sqlite': SQLitePaymentStore,
+}
+
+
+def create_store(backend=PAYMENT_STORE_BACKEND):
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown PAYMENT_STORE_BACKEND {backend!r}; expected one of {sorted(BACKENDS)}")
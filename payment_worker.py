@@ -0,0 +1,255 @@
+"""Durable payment verification queue backed by the payment_jobs table.
+
+Web workers enqueue a row per checkout; `flask payment-worker` runs a fixed
+pool of threads in its own process that claim rows with a visibility
+timeout, so jobs held by a crashed worker are picked up again once it lapses.
+"""
+import signal
+import threading
+import time
+from collections import deque
+
+from db import get_db_connection
+from cache import invalidate, payment_tag
+from config import (PAYMENT_JOB_VISIBILITY_TIMEOUT, PAYMENT_JOB_MAX_ATTEMPTS, PAYMENT_JOB_BACKOFF,
+                    PAYMENT_WORKER_POLL_INTERVAL, STOCK_RESERVATION_SWEEP_INTERVAL)
+from inventory import release_reservation, release_expired
+
+
+class PaymentRejected(Exception):
+    """Raised by a handler when retrying can't help; the job fails at once"""
+
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS payment_jobs (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        payment_id VARCHAR(64) NOT NULL UNIQUE,
+        user_id INT NOT NULL,
+        address_id INT,
+        total DECIMAL(12,2) NOT NULL,
+        idempotency_key VARCHAR(64),
+        status ENUM('queued', 'running', 'paid', 'failed') NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        run_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        locked_until TIMESTAMP(3) NULL,
+        last_error VARCHAR(255),
+        created_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        finished_at TIMESTAMP(3) NULL,
+        INDEX idx_payment_jobs_claim (status, run_at),
+        UNIQUE KEY unique_payment_idempotency (user_id, idempotency_key),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+
+def enqueue_payment(cursor, payment_id, user_id, address_id, total, idempotency_key=None):
+    """Queue a payment for verification in the caller's transaction"""
+    cursor.execute("""
+        INSERT INTO payment_jobs (payment_id, user_id, address_id, total, idempotency_key)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (payment_id, user_id, address_id, total, idempotency_key))
+
+
+def find_payment(cursor, user_id, idempotency_key=None):
+    """Payment already started for this submit: same idempotency key, or any still in flight"""
+    if idempotency_key:
+        cursor.execute("""
+            SELECT payment_id FROM payment_jobs
+            WHERE user_id = %s AND idempotency_key = %s
+        """, (user_id, idempotency_key))
+        row = cursor.fetchone()
+        if row:
+            return row['payment_id']
+    # The cart is only cleared once a payment is verified, so a second
+    # payment started meanwhile would charge the same cart twice
+    cursor.execute("""
+        SELECT payment_id FROM payment_jobs
+        WHERE user_id = %s AND status IN ('queued', 'running')
+        ORDER BY id DESC LIMIT 1
+    """, (user_id,))
+    row = cursor.fetchone()
+    return row['payment_id'] if row else None
+
+
+PAYMENT_JOB_QUERY = """
+    SELECT payment_id, user_id, address_id, total, status,
+           UNIX_TIMESTAMP(created_at) AS timestamp
+    FROM payment_jobs WHERE payment_id = %s
+"""
+
+
+def load_payment_job(payment_id):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(PAYMENT_JOB_QUERY, (payment_id,))
+    job = cursor.fetchone()
+    conn.close()
+    return job
+
+
+def claim_job(conn):
+    """Lease the next runnable job, or return None when the queue is empty"""
+    cursor = conn.cursor(dictionary=True)
+    # 'running' rows whose lease expired belong to a worker that died
+    cursor.execute("""
+        SELECT * FROM payment_jobs
+        WHERE status IN ('queued', 'running') AND run_at <= CURRENT_TIMESTAMP(3)
+          AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP(3))
+        ORDER BY run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """)
+    job = cursor.fetchone()
+    if job:
+        cursor.execute("""
+            UPDATE payment_jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_until = CURRENT_TIMESTAMP(3) + INTERVAL %s SECOND
+            WHERE id = %s
+        """, (PAYMENT_JOB_VISIBILITY_TIMEOUT, job['id']))
+        job['attempts'] += 1
+    conn.commit()
+    return job
+
+
+def finish_job(conn, job, status, error=None):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        UPDATE payment_jobs
+        SET status = %s, last_error = %s, locked_until = NULL, finished_at = CURRENT_TIMESTAMP(3)
+        WHERE id = %s
+    """, (status, error, job['id']))
+    if status == 'failed':
+        # A paid job's reservation was settled by create_order; a failed one goes back on sale
+        release_reservation(cursor, job['payment_id'])
+    conn.commit()
+    # Wakes clients waiting on /payment_events in every web worker
+    invalidate(payment_tag(job['payment_id']))
+
+
+def retry_job(conn, job, error):
+    """Reschedule with exponential backoff, or give up after the last attempt"""
+    if job['attempts'] >= PAYMENT_JOB_MAX_ATTEMPTS:
+        finish_job(conn, job, 'failed', error)
+        return False
+    delay = PAYMENT_JOB_BACKOFF * 2 ** (job['attempts'] - 1)
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE payment_jobs
+        SET status = 'queued', last_error = %s, locked_until = NULL,
+            run_at = CURRENT_TIMESTAMP(3) + INTERVAL %s SECOND
+        WHERE id = %s
+    """, (error, delay, job['id']))
+    conn.commit()
+    return True
+
+
+def queue_stats():
+    """Queue depth and age of the oldest runnable job, straight from the table"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT status, COUNT(*) AS jobs,
+               TIMESTAMPDIFF(MICROSECOND, MIN(run_at), CURRENT_TIMESTAMP(3)) / 1e6 AS oldest_age
+        FROM payment_jobs
+        WHERE status IN ('queued', 'running')
+        GROUP BY status
+    """)
+    rows = cursor.fetchall()
+    conn.close()
+    stats = {'queued': 0, 'running': 0, 'oldest_queued_age': 0.0}
+    for row in rows:
+        stats[row['status']] = row['jobs']
+        if row['status'] == 'queued':
+            stats['oldest_queued_age'] = max(float(row['oldest_age'] or 0), 0.0)
+    return stats
+
+
+class WorkerStats:
+    """Job counters and end-to-end latency (enqueue to finish) for this worker process"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def record(self, outcome, latency=None):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            snapshot = {'completed': self.completed, 'failed': self.failed, 'retried': self.retried}
+        if latencies:
+            snapshot['latency_p50'] = latencies[len(latencies) // 2]
+            snapshot['latency_p95'] = latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0]
+            snapshot['latency_max'] = latencies[-1]
+        return snapshot
+
+
+def work(handler, stop, stats):
+    """One worker thread: claim, run, finish, repeat until stopped"""
+    while not stop.is_set():
+        conn = get_db_connection()
+        try:
+            job = claim_job(conn)
+            if job is None:
+                stop.wait(PAYMENT_WORKER_POLL_INTERVAL)
+                continue
+            try:
+                handler(job)
+            except PaymentRejected as e:
+                print(f"Payment job {job['payment_id']} rejected: {e}")
+                finish_job(conn, job, 'failed', str(e)[:255])
+                stats.record('failed')
+            except Exception as e:
+                print(f"Payment job {job['payment_id']} attempt {job['attempts']} failed: {e}")
+                if retry_job(conn, job, str(e)[:255]):
+                    stats.record('retried')
+                else:
+                    stats.record('failed')
+            else:
+                finish_job(conn, job, 'paid')
+                stats.record('completed', time.time() - job['created_at'].timestamp())
+        except Exception as e:
+            # Lost the database mid-job; the lease expires and another worker retries it
+            print(f"Payment worker error: {e}")
+            stop.wait(PAYMENT_WORKER_POLL_INTERVAL)
+        finally:
+            conn.close()
+
+
+def run_workers(handler, concurrency, report_interval=30):
+    """Run a fixed pool of worker threads until SIGINT/SIGTERM; in-flight jobs finish first.
+
+    Between reports the main thread releases expired stock reservations.
+    """
+    stop = threading.Event()
+    stats = WorkerStats()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    threads = [threading.Thread(target=work, args=(handler, stop, stats), name=f"payment-worker-{i}")
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    print(f"Payment worker pool started with {concurrency} threads")
+
+    next_report = time.monotonic() + report_interval
+    while not stop.wait(STOCK_RESERVATION_SWEEP_INTERVAL):
+        try:
+            release_expired()
+        except Exception as e:
+            print(f"Stock reservation sweep failed: {e}")
+        if time.monotonic() >= next_report:
+            print(f"Payment queue {queue_stats()} | workers {stats.snapshot()}")
+            next_report += report_interval
+
+    for thread in threads:
+        thread.join()
+    print(f"Payment worker pool stopped | workers {stats.snapshot()}")
@@ -0,0 +1,186 @@
+"""Streaming bulk product import from CSV or JSONL.
+
+Rows are read one at a time from the upload (or file), validated, and
+written IMPORT_BATCH_SIZE at a time: one multi-row INSERT and one commit
+per batch, then one catalog cache invalidation. Memory stays flat however
+large the file. A batch the database rejects is retried row by row, so
+one bad row costs its own insert rather than the whole batch.
+
+Columns: name (required), price (required), description, category.
+"""
+import codecs
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+import mysql.connector
+
+from cache import invalidate, CATALOG_HEAD_TAG
+from config import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS
+
+FORMATS = ('csv', 'jsonl')
+MAX_PRICE = Decimal('99999999.99')     # DECIMAL(10,2)
+
+INSERT_SQL = """
+    INSERT INTO products (name, description, price, seller_id, category)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+class ImportAborted(Exception):
+    """Too many invalid rows; batches already committed stay"""
+
+
+class MalformedFile(ImportAborted):
+    """The file can't be parsed past this line; batches already committed stay"""
+
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+        super().__init__(f"line {line}: {message}")
+
+
+def detect_format(filename, default='csv'):
+    ext = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext, default)
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) from a binary stream without reading it all in"""
+    text = codecs.getreader('utf-8-sig')(stream, errors='replace')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as e:
+            # e.g. a field over csv.field_size_limit(); the reader can't resync after a bad record
+            raise MalformedFile(reader.line_num, f"malformed CSV: {e}")
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    row = e
+                yield line_num, row
+    else:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def validate(row):
+    """(name, description, price, category) for one input row, or ValueError saying what is wrong"""
+    if isinstance(row, Exception):
+        raise ValueError(f"not valid JSON: {row}")
+    if not isinstance(row, dict):
+        raise ValueError("expected an object")
+
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    if len(name) > 100:
+        raise ValueError("name is longer than 100 characters")
+
+    try:
+        price = Decimal(str(row.get('price', '')).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"price {row.get('price')!r} is not a number")
+    if not price.is_finite() or price <= 0 or price > MAX_PRICE:
+        raise ValueError(f"price must be between 0.01 and {MAX_PRICE}")
+
+    category = str(row.get('category') or '').strip() or None
+    if category and len(category) > 50:
+        raise ValueError("category is longer than 50 characters")
+
+    description = str(row.get('description') or '').strip() or None
+    return name, description, price, category
+
+
+class ImportReport:
+
+    def __init__(self, max_errors=IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.imported = 0
+        self.batches = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line, message):
+        self.errors.append({'line': line, 'error': message})
+        if len(self.errors) > self.max_errors:
+            raise ImportAborted(f"more than {self.max_errors} invalid rows")
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': len(self.errors),
+            'batches': self.batches,
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_s': round(self.rows / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def write_batch(conn, seller_id, batch, report):
+    """Insert one batch in its own transaction; fall back to single rows if the database rejects it"""
+    cursor = conn.cursor()
+    params = [(name, description, price, seller_id, category)
+              for _, (name, description, price, category) in batch]
+    try:
+        try:
+            # mysql-connector sends an INSERT ... VALUES executemany as one multi-row statement
+            cursor.executemany(INSERT_SQL, params)
+            conn.commit()
+            report.imported += len(batch)
+        except (mysql.connector.IntegrityError, mysql.connector.DataError):
+            conn.rollback()
+            for (line, _), row_params in zip(batch, params):
+                try:
+                    cursor.execute(INSERT_SQL, row_params)
+                    conn.commit()
+                    report.imported += 1
+                except (mysql.connector.IntegrityError, mysql.connector.DataError) as e:
+                    conn.rollback()
+                    report.error(line, e.msg)
+    finally:
+        # report.error can abort the import after some of the single-row inserts committed
+        report.batches += 1
+        invalidate(CATALOG_HEAD_TAG)
+
+
+def import_products(conn, stream, fmt, seller_id, batch_size=IMPORT_BATCH_SIZE, max_errors=IMPORT_MAX_ERRORS,
+                    progress=None):
+    """Stream rows from a CSV/JSONL binary stream into products; returns the report as a dict.
+
+    progress(report) is called after every batch. Stops early, keeping the
+    committed batches, once more than max_errors rows are invalid.
+    """
+    report = ImportReport(max_errors)
+    batch = []
+    try:
+        for line, row in read_rows(stream, fmt):
+            report.rows += 1
+            try:
+                batch.append((line, validate(row)))
+            except ValueError as e:
+                report.error(line, str(e))
+            if len(batch) >= batch_size:
+                write_batch(conn, seller_id, batch, report)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            write_batch(conn, seller_id, batch, report)
+            if progress:
+                progress(report)
+    except ImportAborted as e:
+        if isinstance(e, MalformedFile):
+            report.errors.append({'line': e.line, 'error': e.message})
+        result = report.as_dict()
+        result['aborted'] = str(e)
+        return result
+    return report.as_dict()
@@ -0,0 +1,153 @@
+"""Precomputed "frequently bought together" recommendations.
+
+`flask build-recommendations` (run it from cron, e.g. nightly) streams the
+paid order lines of the last RECOMMENDATIONS_WINDOW_DAYS into NumPy arrays,
+builds the sparse order x product incidence matrix B with SciPy and gets
+every pair's shared order count from one sparse product, B.T @ B. Pairs are
+ranked by cosine similarity, shared / sqrt(orders_a * orders_b), so a
+best-seller doesn't top every list. The best RECOMMENDATIONS_TOP_N
+neighbours of each product replace the product_recommendations table in
+one transaction.
+
+Views read a product's neighbours by primary key once and keep them in the
+in-process recommendation cache until the next build invalidates it, so a
+lookup is a dictionary hit. Only the build needs NumPy and SciPy.
+"""
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from db import get_db_connection, pool, router
+from cache import recommendation_cache, invalidate, RECOMMENDATIONS_TAG
+from config import RECOMMENDATIONS_TOP_N, RECOMMENDATIONS_MIN_ORDERS, RECOMMENDATIONS_WINDOW_DAYS, RECOMMENDATIONS_SHOWN
+
+
+# ------------------- BUILD ------------------- #
+
+def load_order_lines(window_days, fetch_size=100_000):
+    """(order_id, product_id) int64 array of paid order lines, read off an unbuffered cursor"""
+    import numpy as np
+
+    since = datetime.now() - timedelta(days=window_days)
+    conn = router.get_connection() or pool.get_connection()
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute("""
+            SELECT i.order_id, i.product_id
+            FROM order_items i
+            JOIN order_headers h ON i.order_id = h.id
+            WHERE h.payment_status = 'paid' AND h.created_at >= %s
+        """, (since,))
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+    finally:
+        conn.close()
+    return np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+
+
+def co_purchases(lines, top_n, min_orders):
+    """Best top_n neighbours per product; returns arrays (product, neighbour, position, shared, score)"""
+    import numpy as np
+    from scipy import sparse
+
+    order_ids, order_index = np.unique(lines[:, 0], return_inverse=True)
+    product_ids, product_index = np.unique(lines[:, 1], return_inverse=True)
+    baskets = sparse.csr_matrix((np.ones(len(lines), dtype=np.int32), (order_index, product_index)),
+                                shape=(len(order_ids), len(product_ids)))
+    # Duplicate lines were summed; a product counts once per order
+    baskets.data[:] = 1
+    bought = np.asarray(baskets.sum(axis=0)).ravel()
+
+    together = (baskets.T @ baskets).tocoo()
+    keep = (together.row != together.col) & (together.data >= min_orders)
+    rows, cols, shared = together.row[keep], together.col[keep], together.data[keep]
+    score = shared / np.sqrt(bought[rows].astype(np.float64) * bought[cols])
+
+    # Group by product, best score first, then each pair's position within its product
+    order = np.lexsort((cols, -score, rows))
+    rows, cols, shared, score = rows[order], cols[order], shared[order], score[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+    position = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = position < top_n
+    return product_ids[rows[keep]], product_ids[cols[keep]], position[keep], shared[keep], score[keep]
+
+
+def write_recommendations(product, neighbour, position, shared, score, batch=5000):
+    """Replace the table in one transaction; readers see the old lists until it commits"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    rows = zip(product.tolist(), position.tolist(), neighbour.tolist(), shared.tolist(), score.tolist())
+    try:
+        cursor.execute("DELETE FROM product_recommendations")
+        while True:
+            chunk = list(islice(rows, batch))
+            if not chunk:
+                break
+            cursor.executemany("""
+                INSERT INTO product_recommendations (product_id, position, recommended_id, orders, score)
+                VALUES (%s, %s, %s, %s, %s)
+            """, chunk)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidate(RECOMMENDATIONS_TAG)
+
+
+def build_recommendations(top_n=RECOMMENDATIONS_TOP_N, min_orders=RECOMMENDATIONS_MIN_ORDERS,
+                          window_days=RECOMMENDATIONS_WINDOW_DAYS):
+    """Rebuild product_recommendations from order history; returns sizes and timings"""
+    import numpy as np
+
+    start = time.perf_counter()
+    lines = load_order_lines(window_days)
+    loaded = time.perf_counter()
+    product, neighbour, position, shared, score = co_purchases(lines, top_n, min_orders)
+    built = time.perf_counter()
+    write_recommendations(product, neighbour, position, shared, score)
+    written = time.perf_counter()
+    return {
+        'order_lines': len(lines),
+        'orders': len(np.unique(lines[:, 0])),
+        'products': len(np.unique(product)),
+        'rows': len(product),
+        'load_s': round(loaded - start, 3),
+        'build_s': round(built - loaded, 3),
+        'write_s': round(written - built, 3),
+    }
+
+
+# ------------------- LOOKUP ------------------- #
+
+def neighbours(product_id):
+    """((recommended_id, score), ...) for one product, best first; cached until the next build"""
+    product_id = int(product_id)
+    cached = recommendation_cache.get(product_id)
+    if cached is None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT recommended_id, score FROM product_recommendations
+            WHERE product_id = %s ORDER BY position
+        """, (product_id,))
+        cached = tuple(cursor.fetchall())
+        conn.close()
+        recommendation_cache.set(product_id, cached, [RECOMMENDATIONS_TAG])
+    return cached
+
+
+def recommend(product_ids, limit=RECOMMENDATIONS_SHOWN):
+    """Ids of the products most often bought with any of product_ids, best first, excluding those"""
+    exclude = {int(product_id) for product_id in product_ids}
+    scores = {}
+    for product_id in exclude:
+        for recommended_id, score in neighbours(product_id):
+            if recommended_id not in exclude:
+                scores[recommended_id] = scores.get(recommended_id, 0.0) + score
+    return sorted(scores, key=lambda recommended_id: (-scores[recommended_id], recommended_id))[:limit]
@@ -0,0 +1,313 @@
+"""Production server: a prefork master with threaded WSGI workers.
+
+    python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+
+The master binds the socket and forks --workers processes. It never imports
+app.py: each worker imports it after the fork, so every worker builds its
+own connection pools, cache-bus listener and notifier threads, then warms
+them (pool connections, the schema check, the first catalog page) before it
+accepts a request. Each worker serves from a pool of --threads threads and
+accepts a connection only while one of them is free, so the rest wait in the
+shared listen backlog for whichever worker frees up first. Keep --threads at
+or below DB_POOL_SIZE so a request never waits on the pool.
+
+The master also runs the payment worker pool (`flask payment-worker`) and
+the image worker pool (`flask image-worker`) as child processes, unless
+--payment-workers / --image-workers is 0.
+
+Signals to the master:
+
+    HUP        graceful reload. Fresh workers import the current code and
+               config.py and take over the socket. The old workers finish
+               in-flight requests and the old payment and image workers
+               finish their claimed jobs before they exit. The master's own
+               options (--bind, --workers, ...) keep their startup values;
+               changing those takes a restart.
+    TERM, INT  graceful shutdown, with the same draining.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BOOT_FAILED = 3     # worker exit status that stops the master instead of a respawn loop
+
+
+def load_config():
+    """config.py as it is on disk now.
+
+    The master never leaves config in sys.modules, so workers forked after a
+    HUP import it afresh instead of inheriting the master's copy.
+    """
+    sys.modules.pop('config', None)
+    try:
+        import config
+    finally:
+        sys.modules.pop('config', None)
+    return config
+
+
+def exit_child(code):
+    # os._exit skips the interpreter's cleanup, including flushing buffered output
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+# ------------------- WORKER ------------------- #
+
+def warm(app, threads):
+    """Open this worker's pooled connections and fill the hot caches before serving"""
+    from app import get_catalog_page
+    from cache import bus
+    from db import pool, router
+    from migrations import require_current_schema
+
+    with app.app_context():
+        failure = require_current_schema()
+        if failure is not None:
+            print(f"[worker {os.getpid()}] {failure[0]}")
+            sys.exit(BOOT_FAILED)
+
+    for db_pool in [pool] + [replica.pool for replica in router.replicas]:
+        conns = [db_pool.get_connection() for _ in range(min(threads, db_pool.size))]
+        for conn in conns:
+            conn.close()
+
+    with app.app_context():
+        get_catalog_page()
+    bus.start()
+
+
+def serve_worker(sock, threads, keepalive, graceful_timeout):
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    from app import app
+
+    class RequestHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        timeout = keepalive
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Werkzeug's server with connections handed to a fixed thread pool"""
+        multithread = True
+
+        def __init__(self):
+            host, port = sock.getsockname()[:2]
+            super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+            self.executor = ThreadPoolExecutor(threads, thread_name_prefix='request')
+            self.slots = threading.BoundedSemaphore(threads)
+            self.stopping = False
+
+        def get_request(self):
+            # Accept only with a thread free for the connection; until then it waits in the shared
+            # listen backlog, where a sibling worker with a free thread picks it up
+            while not self.slots.acquire(timeout=0.5):
+                if self.stopping:
+                    raise OSError("shutting down")     # serve_forever skips this round and sees the shutdown
+            try:
+                return super().get_request()
+            except OSError:
+                self.slots.release()
+                raise
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self.handle_in_thread, request, client_address)
+
+        def handle_in_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.slots.release()
+
+    try:
+        warm(app, threads)
+    except Exception as e:
+        print(f"[worker {os.getpid()}] warm-up failed: {e}")
+        sys.exit(BOOT_FAILED)
+
+    server = PooledWSGIServer()
+
+    def stop(*_):
+        # shutdown() waits for serve_forever, which runs on this (the main) thread
+        server.stopping = True
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # ^C reaches the whole group; the master decides
+    print(f"[worker {os.getpid()}] serving with {threads} threads")
+    server.serve_forever()
+
+    # No new connections from here; let in-flight requests finish
+    drain = threading.Thread(target=server.executor.shutdown, kwargs={'wait': True}, daemon=True)
+    drain.start()
+    drain.join(graceful_timeout)
+    if drain.is_alive():
+        print(f"[worker {os.getpid()}] graceful timeout, dropping in-flight requests")
+    exit_child(0)
+
+
+def serve_payments(workers):
+    from app import verify_payment_and_create_order
+    from payment_worker import run_workers
+
+    run_workers(verify_payment_and_create_order, workers)
+
+
+def serve_images(workers):
+    from images import run_image_workers
+
+    run_image_workers(workers)
+
+
+# ------------------- MASTER ------------------- #
+
+class Master:
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}           # pid -> generation
+        self.background = {}        # pid -> (generation, name)
+        self.jobs = [(name, target, threads) for name, target, threads in (
+            ('payment worker', serve_payments, args.payment_workers),
+            ('image worker', serve_images, args.image_workers)) if threads]
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+
+    def bind(self):
+        host, port = self.args.bind.rsplit(':', 1)
+        self.sock = socket.create_server((host, int(port)), backlog=self.args.backlog)
+        self.sock.set_inheritable(True)
+
+    def spawn(self, target, *args):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.SIG_DFL)
+            try:
+                target(*args)
+            except SystemExit as e:
+                exit_child(e.code if isinstance(e.code, int) else 1)
+            except BaseException as e:
+                print(f"[{os.getpid()}] {e}")
+                exit_child(1)
+            exit_child(0)
+        return pid
+
+    def spawn_generation(self):
+        self.generation += 1
+        for _ in range(self.args.workers):
+            pid = self.spawn(serve_worker, self.sock, self.args.threads, self.args.keepalive,
+                             self.args.graceful_timeout)
+            self.workers[pid] = self.generation
+        for name, target, threads in self.jobs:
+            self.background[self.spawn(target, threads)] = (self.generation, name)
+
+    def retire(self, generation):
+        """SIGTERM every child older than generation; they drain and exit on their own"""
+        children = list(self.workers.items()) + [(pid, g) for pid, (g, _) in self.background.items()]
+        for pid, child_generation in children:
+            if child_generation < generation:
+                os.kill(pid, signal.SIGTERM)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            code = os.waitstatus_to_exitcode(status)
+            if pid in self.workers:
+                generation, kind = self.workers.pop(pid), 'worker'
+            elif pid in self.background:
+                generation, kind = self.background.pop(pid)
+            else:
+                continue
+            if code == BOOT_FAILED:
+                print(f"[master] {kind} {pid} failed to boot; shutting down")
+                self.stop()
+            elif generation == self.generation and not self.stopping:
+                print(f"[master] {kind} {pid} exited ({code}); respawning")
+                if kind == 'worker':
+                    new = self.spawn(serve_worker, self.sock, self.args.threads, self.args.keepalive,
+                                     self.args.graceful_timeout)
+                    self.workers[new] = generation
+                else:
+                    _, target, threads = next(job for job in self.jobs if job[0] == kind)
+                    self.background[self.spawn(target, threads)] = (generation, kind)
+
+    def reload(self, *_):
+        self.reloading = True
+
+    def stop(self, *_):
+        if not self.stopping:
+            self.stopping = True
+            self.retire(self.generation + 1)
+
+    def run(self):
+        self.bind()
+        if self.args.pidfile:
+            with open(self.args.pidfile, 'w') as f:
+                f.write(f"{os.getpid()}\n")
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"[master] {os.getpid()} listening on {self.args.bind}: {self.args.workers} workers x "
+              f"{self.args.threads} threads, {self.args.payment_workers} payment / "
+              f"{self.args.image_workers} image worker threads")
+        self.spawn_generation()
+
+        deadline = None
+        while self.workers or self.background:
+            if self.reloading and not self.stopping:
+                self.reloading = False
+                print(f"[master] reloading: generation {self.generation + 1}")
+                self.spawn_generation()
+                self.retire(self.generation)
+            if self.stopping and deadline is None:
+                # Claimed jobs get their lease time; after that another worker would retry them anyway
+                config = load_config()
+                deadline = time.monotonic() + max(self.args.graceful_timeout, config.PAYMENT_JOB_VISIBILITY_TIMEOUT,
+                                                  config.IMAGE_JOB_VISIBILITY_TIMEOUT)
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in list(self.workers) + list(self.background):
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float('inf')
+            self.reap()
+            time.sleep(0.2)
+
+        self.sock.close()
+        if self.args.pidfile and os.path.exists(self.args.pidfile):
+            os.remove(self.args.pidfile)
+        print("[master] stopped")
+
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default=config.SERVER_BIND, help='host:port')
+    parser.add_argument('--workers', type=int, default=config.SERVER_WORKERS)
+    parser.add_argument('--threads', type=int, default=config.SERVER_THREADS, help='request threads per worker')
+    parser.add_argument('--payment-workers', type=int, default=config.SERVER_PAYMENT_WORKERS,
+                        help='payment worker threads; 0 when `flask payment-worker` runs elsewhere')
+    parser.add_argument('--image-workers', type=int, default=config.SERVER_IMAGE_WORKERS,
+                        help='image worker threads; 0 when `flask image-worker` runs elsewhere')
+    parser.add_argument('--backlog', type=int, default=config.SERVER_BACKLOG)
+    parser.add_argument('--keepalive', type=float, default=config.SERVER_KEEPALIVE)
+    parser.add_argument('--graceful-timeout', type=float, default=config.SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument('--pidfile', help='write the master pid here, e.g. for `kill -HUP`')
+    Master(parser.parse_args()).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+"""SQLite storage backend for single-node deployments, benchmarks and CI.
+
+Selected with DB_BACKEND = 'sqlite'. The connection and cursor classes
+implement the parts of the mysql-connector API the app uses. They translate
+each MySQL statement to SQLite at execute time, so app.py, payment_worker.py
+and migrations.py keep a single set of SQL:
+
+- ON DUPLICATE KEY UPDATE becomes an upsert.
+- INSERT IGNORE becomes INSERT OR IGNORE.
+- ENUM becomes TEXT with a CHECK.
+- Inline INDEX and UNIQUE KEY become CREATE INDEX.
+- FULLTEXT becomes an FTS5 table named <table>_fts, kept in sync by
+  triggers, and MATCH ... AGAINST queries it.
+- Timestamps are local time, like MySQL's CURRENT_TIMESTAMP.
+
+SQLite has a single writer. A transaction that writes, or reads FOR UPDATE,
+starts with BEGIN IMMEDIATE, so it holds the write lock from its first
+locking statement to commit. Plain reads outside a transaction run in
+autocommit mode; in WAL mode they never wait for the writer. Errors are
+raised as mysql.connector errors, so the app's error handling is the same
+for both backends.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+import mysql.connector
+
+from config import SQLITE_PATH, SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_MB, SQLITE_MMAP_MB
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",          # readers and the writer don't block each other
+    "PRAGMA synchronous = NORMAL",        # fsync at checkpoints; safe in WAL mode, much faster commits
+    "PRAGMA foreign_keys = ON",           # ON DELETE CASCADE as in InnoDB
+    f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Same Python types mysql-connector returns; every DECIMAL column in the schema has scale 2
+CENTS = Decimal('0.01')
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()))
+sqlite3.register_converter('DECIMAL', lambda raw: Decimal(raw.decode()).quantize(CENTS))
+sqlite3.register_converter('BOOLEAN', lambda raw: bool(int(raw)))
+
+NOW = "strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')"
+NOW_MS = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+NOW_MS_PLUS_SECONDS = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', '+' || ? || ' seconds')"
+NOW_MS_MINUS_SECONDS = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', '-' || ? || ' seconds')"
+
+
+# ------------------- SQL TRANSLATION ------------------- #
+
+_read_only = re.compile(r'\s*\(?\s*(SELECT|EXPLAIN|WITH|PRAGMA)\b', re.IGNORECASE)
+_for_update = re.compile(r'\s+FOR UPDATE(\s+SKIP LOCKED)?', re.IGNORECASE)
+_inline_index = re.compile(r',\s*(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)', re.IGNORECASE)
+_alter_index = re.compile(r'\s*ALTER TABLE (\w+) ADD (INDEX|UNIQUE|FULLTEXT) (\w+) \(([^)]*)\)\s*$', re.IGNORECASE)
+_match = re.compile(r'(WHERE\s+)?MATCH\s*\([^)]*\)\s*AGAINST\s*\(\?\s+IN NATURAL LANGUAGE MODE\)', re.IGNORECASE)
+
+_ddl_rules = [
+    (re.compile(r'\b(?:BIG)?INT AUTO_INCREMENT PRIMARY KEY', re.IGNORECASE), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r'\b(\w+) ENUM\(([^)]*)\)', re.IGNORECASE), r'\1 TEXT CHECK (\1 IN (\2))'),
+    (re.compile(r'\bTIMESTAMP\(3\)', re.IGNORECASE), 'TIMESTAMP'),
+    (re.compile(r'\s+ON UPDATE CURRENT_TIMESTAMP\b', re.IGNORECASE), ''),
+    (re.compile(r'DEFAULT CURRENT_TIMESTAMP\(3\)', re.IGNORECASE), f'DEFAULT ({NOW_MS})'),
+    (re.compile(r'DEFAULT CURRENT_TIMESTAMP\b', re.IGNORECASE), f'DEFAULT ({NOW})'),
+    (re.compile(r'\s+AFTER\s+\w+\s*$', re.IGNORECASE), ''),
+]
+
+_dml_rules = [
+    (re.compile(r'\bINSERT IGNORE\b', re.IGNORECASE), 'INSERT OR IGNORE'),
+    (re.compile(r'<=>'), ' IS '),
+    (re.compile(r'CURRENT_TIMESTAMP\(3\) \+ INTERVAL \? SECOND', re.IGNORECASE), NOW_MS_PLUS_SECONDS),
+    (re.compile(r'CURRENT_TIMESTAMP\(3\) - INTERVAL \? SECOND', re.IGNORECASE), NOW_MS_MINUS_SECONDS),
+    (re.compile(r'CURRENT_TIMESTAMP\(3\)', re.IGNORECASE), NOW_MS),
+    (re.compile(r'\bCURRENT_TIMESTAMP\b', re.IGNORECASE), NOW),
+    (re.compile(r'\bTIMESTAMPDIFF\((\w+),', re.IGNORECASE), r"TIMESTAMPDIFF('\1',"),
+    (re.compile(r'\bLEFT\(\s*([^,()]+),', re.IGNORECASE), r'substr(\1, 1,'),
+    (re.compile(r'^\s*EXPLAIN\s+', re.IGNORECASE), 'EXPLAIN QUERY PLAN '),
+    (re.compile(r'^\s*RENAME TABLE (\w+) TO (\w+)', re.IGNORECASE), r'ALTER TABLE \1 RENAME TO \2'),
+]
+
+
+def _fulltext(table, columns):
+    """FTS5 index over `columns` of `table`, maintained by triggers"""
+    columns = [column.strip() for column in columns.split(',')]
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        # Only when indexed text changes: stock decrements shouldn't rewrite the index
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _create_table(sql):
+    table = re.search(r'CREATE TABLE (?:IF NOT EXISTS )?(\w+)', sql, re.IGNORECASE).group(1)
+    indexes = []
+
+    def pull_index(match):
+        unique, name, columns = match.groups()
+        indexes.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        return ''
+
+    sql = _inline_index.sub(pull_index, sql)
+    for pattern, replacement in _ddl_rules:
+        sql = pattern.sub(replacement, sql)
+    return [sql] + indexes
+
+
+def _alter_table(sql):
+    match = _alter_index.match(sql)
+    if match:
+        table, kind, name, columns = match.groups()
+        if kind.upper() == 'FULLTEXT':
+            return _fulltext(table, columns)
+        unique = 'UNIQUE ' if kind.upper() == 'UNIQUE' else ''
+        return [f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {table} ({columns})"]
+    for pattern, replacement in _ddl_rules:
+        sql = pattern.sub(replacement, sql)
+    return [sql]
+
+
+def _match_against(sql):
+    table = re.search(r'\bFROM\s+(\w+)', sql, re.IGNORECASE).group(1)
+    fts = f'{table}_fts'
+
+    def rewrite(match):
+        if match.group(1):
+            return f"{match.group(1)}{table}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH fts_query(?))"
+        return f"(SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH fts_query(?) AND rowid = {table}.id)"
+
+    return _match.sub(rewrite, sql)
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """MySQL statement -> (SQLite statements, whether it needs the write lock)"""
+    sql = sql.replace('%s', '?').replace('%%', '%')
+    head = sql.lstrip()[:12].upper()
+    if head.startswith('CREATE TABLE'):
+        return tuple(_create_table(sql)), True
+    if head.startswith('ALTER TABLE'):
+        return tuple(_alter_table(sql)), True
+
+    locking = _for_update.search(sql) is not None
+    sql = _for_update.sub('', sql)
+    if 'ON DUPLICATE KEY UPDATE' in sql.upper():
+        start = sql.upper().index('ON DUPLICATE KEY UPDATE')
+        updates = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', sql[start + len('ON DUPLICATE KEY UPDATE'):])
+        sql = sql[:start] + 'ON CONFLICT DO UPDATE SET' + updates
+    if 'AGAINST' in sql.upper():
+        sql = _match_against(sql)
+    for pattern, replacement in _dml_rules:
+        sql = pattern.sub(replacement, sql)
+    return (sql,), locking or not _read_only.match(sql)
+
+
+# ------------------- SQL FUNCTIONS ------------------- #
+
+def _unix_timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+_UNIT_SECONDS = {'MICROSECOND': 1e-6, 'SECOND': 1, 'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400}
+
+
+def _timestampdiff(unit, start, end):
+    if start is None or end is None:
+        return None
+    seconds = (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+    return int(seconds / _UNIT_SECONDS[unit.upper()])
+
+
+def fts_query(q):
+    """Natural-language search text -> FTS5 query matching any of its words"""
+    words = re.findall(r'\w+', q or '')
+    return ' OR '.join(f'"{word}"' for word in words) or '""'
+
+
+# ------------------- CONNECTIONS ------------------- #
+
+@contextmanager
+def _errors():
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        errno = 1062 if 'UNIQUE' in str(e) else 1452
+        raise mysql.connector.errors.IntegrityError(msg=str(e), errno=errno) from e
+    except sqlite3.OperationalError as e:
+        if 'locked' in str(e) or 'busy' in str(e):
+            raise mysql.connector.errors.OperationalError(msg=str(e)) from e
+        raise mysql.connector.errors.ProgrammingError(msg=str(e)) from e
+    except sqlite3.Error as e:
+        raise mysql.connector.errors.DatabaseError(msg=str(e)) from e
+
+
+def connect(path=SQLITE_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Autocommit at the driver level; SQLiteConnection issues BEGIN itself
+    db = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None,
+                         check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    db.create_function('UNIX_TIMESTAMP', 1, _unix_timestamp, deterministic=True)
+    db.create_function('TIMESTAMPDIFF', 3, _timestampdiff, deterministic=True)
+    db.create_function('fts_query', 1, fts_query, deterministic=True)
+    return db
+
+
+class SQLiteCursor:
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._db.cursor()
+        self.dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def execute(self, operation, params=(), multi=False):
+        statements, write = translate(operation)
+        with _errors():
+            self._connection.begin(write)
+            self._cursor.execute(statements[0], tuple(params or ()))
+            self.rowcount = self._cursor.rowcount
+            self.lastrowid = self._cursor.lastrowid
+            for statement in statements[1:]:
+                self._cursor.execute(statement)
+
+    def executemany(self, operation, seq_params):
+        statements, _ = translate(operation)
+        with _errors():
+            self._connection.begin(True)
+            self._cursor.executemany(statements[0], [tuple(params) for params in seq_params])
+            self.rowcount = self._cursor.rowcount
+            # mysql-connector sends a multi-row INSERT and reports the first id
+            if self.rowcount > 0 and statements[0].lstrip().upper().startswith('INSERT'):
+                last = self._connection._db.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self.lastrowid = last - self.rowcount + 1
+
+    def fetchone(self):
+        with _errors():
+            return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        with _errors():
+            return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        with _errors():
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+
+    unread_result = False   # results are always buffered
+
+    def __init__(self, path=SQLITE_PATH, pool=None):
+        self.path = path
+        self._pool = pool
+        self.pid = os.getpid()
+        self.reconnect()
+
+    def cursor(self, buffered=None, dictionary=False, **kwargs):
+        return SQLiteCursor(self, dictionary)
+
+    def begin(self, write):
+        if write and not self._db.in_transaction:
+            self._db.execute("BEGIN IMMEDIATE")
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def commit(self):
+        with _errors():
+            self._db.commit()
+
+    def rollback(self):
+        with _errors():
+            self._db.rollback()
+
+    def is_connected(self):
+        # A file replaced underneath us (a replica restored from a copy) keeps
+        # serving the old inode through open handles; treat that as a lost connection
+        try:
+            return os.stat(self.path).st_ino == self._inode
+        except OSError:
+            return False
+
+    def reconnect(self, attempts=1, delay=0):
+        with _errors():
+            self._db = connect(self.path)
+            self._inode = os.stat(self.path).st_ino
+
+    def close(self):
+        if self._db.in_transaction:
+            self._db.rollback()
+        if self._pool is not None:
+            self._pool.put(self)
+        else:
+            self._db.close()
+
+
+class SQLitePool:
+    """Idle SQLite connections for reuse; db.ConnectionPool still bounds how many are in use"""
+
+    def __init__(self, path=SQLITE_PATH, size=10):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                # A forked child must not use its parent's SQLite handles
+                if conn.pid == os.getpid():
+                    return conn
+        return SQLiteConnection(self.path, self)
+
+    def put(self, conn):
+        with self._lock:
+            if conn.pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn._db.close()